@@ -1,10 +1,126 @@
-from fastapi import FastAPI
-from fastapi.responses import UJSONResponse
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from fastapi import FastAPI, Request, status
+from fastapi.logger import logger
+from fastapi.responses import Response, UJSONResponse
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
+from starlette.requests import ClientDisconnect
 
+from app import constants
+from app.api.v1.chat.cache import context_prompt_cache
+from app.api.v1.chat.worker import GenerationWorkerPool
+from app.api.v1.chat.write_buffer import chat_message_write_buffer
 from app.api.v1.router import api_router
+from app.database import session_factory
 from app.settings import settings
+from app.utils.http import DeadlineMiddleware
+from app.utils.openai import RETRYABLE_ERRORS
+from app.utils.scheduler import SchedulerFullError
+
+
+def warm_caches() -> None:
+    """
+    Warm the in-process caches, so the first requests of a worker are not slower.
+    """
+
+    session = session_factory()
+    try:
+        context_prompt_cache.warm(session)
+    except Exception as e:
+        logger.exception(f"[Startup] Failed to warm caches: {e}")
+    finally:
+        session.close()
+
+
+async def scheduler_full_handler(
+    request: Request,
+    exc: SchedulerFullError,
+) -> UJSONResponse:
+    """
+    Reject calls that cannot be queued: 429 when the user has too many in flight,
+    503 when the whole worker is overloaded.
+    """
+
+    return UJSONResponse(
+        status_code=(
+            status.HTTP_429_TOO_MANY_REQUESTS
+            if exc.per_user
+            else status.HTTP_503_SERVICE_UNAVAILABLE
+        ),
+        content={"detail": exc.detail},
+        headers={"Retry-After": "1"},
+    )
+
+
+async def timeout_handler(
+    request: Request,
+    exc: asyncio.TimeoutError,
+) -> UJSONResponse:
+    """
+    Report calls that ran out of time, usually because of the request deadline.
+    """
+
+    return UJSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={"detail": "Timed out."},
+    )
+
+
+async def llm_unavailable_handler(
+    request: Request,
+    exc: Exception,
+) -> UJSONResponse:
+    """
+    Report LLM calls that still failed with a transient error once retries ran out.
+    """
+
+    return UJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "The language model is unavailable, try again later."},
+        headers={"Retry-After": "1"},
+    )
+
+
+async def client_disconnect_handler(
+    request: Request,
+    exc: ClientDisconnect,
+) -> Response:
+    """
+    Answer requests whose client went away; nobody reads the response.
+    """
+
+    return Response(status_code=499)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Run startup and shutdown steps of the application.
+    """
+
+    await run_in_threadpool(warm_caches)
+
+    if settings.chat_write_buffer_enabled:
+        chat_message_write_buffer.start()
+
+    generation_workers = None
+    if settings.chat_generation_workers:
+        generation_workers = GenerationWorkerPool(
+            concurrency=settings.chat_generation_workers,
+            poll_interval=settings.chat_generation_poll_seconds,
+        )
+        generation_workers.start()
+
+    yield
+
+    if generation_workers:
+        await generation_workers.stop()
+
+    await chat_message_write_buffer.stop()
 
 
 def get_app() -> FastAPI:
@@ -24,28 +140,40 @@ def get_app() -> FastAPI:
         redoc_url="/redoc",
         openapi_url="/openapi.json",
         default_response_class=UJSONResponse,
+        lifespan=lifespan,
     )
 
-    allowed_origins = [
-        settings.frontend_url,
+    default_headers_allowed = [
+        "Content-Type",
+        "Authorization",
+        "X-Workspace-Code",
+        "If-None-Match",
+        constants.REQUEST_TIMEOUT_HEADER,
     ]
 
-    allowed_origins.append(
-        "http://localhost:3000",
-    )  # for development -- not recommended for production
-
-    default_headers_allowed = ["Content-Type", "Authorization", "X-Workspace-Code"]
-
     app.add_middleware(
         CORSMiddleware,
-        allow_origins=allowed_origins,
+        allow_origins=settings.allowed_origins,
         allow_credentials=True,
         allow_methods=["GET", "PUT", "POST", "DELETE", "OPTIONS", "PATCH"],
         allow_headers=default_headers_allowed,
+        expose_headers=["ETag"],
     )
 
     app.add_middleware(SessionMiddleware, secret_key=settings.secret_key)
 
+    app.add_middleware(
+        DeadlineMiddleware,
+        timeout=settings.http_request_timeout_seconds,
+    )
+
+    app.add_exception_handler(SchedulerFullError, scheduler_full_handler)
+    # not the builtin TimeoutError before Python 3.11
+    app.add_exception_handler(asyncio.TimeoutError, timeout_handler)
+    for error in RETRYABLE_ERRORS:
+        app.add_exception_handler(error, llm_unavailable_handler)
+    app.add_exception_handler(ClientDisconnect, client_disconnect_handler)
+
     app.include_router(router=api_router)
 
     return app
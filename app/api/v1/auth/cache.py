@@ -0,0 +1,109 @@
+from typing import Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.api.v1.auth.models import User
+from app.settings import settings
+from app.utils.cache import TTLCache
+from app.utils.metrics import metrics
+
+# ``Session.info`` key of the users changed in the session's transaction
+INVALIDATED_USER_IDS_KEY = "invalidated_user_ids"
+
+
+def detached_user(values: dict) -> User:
+    """Build a detached user from its column values, without a query."""
+    user = inspect(User).class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(user, key, value)
+    make_transient_to_detached(user)
+    return user
+
+
+class UserCache:
+    """In-process cache of users, keyed by id.
+
+    Saves the query loading the user of every authenticated request. The column
+    values of a user are cached, and a hit is merged into the session of the request
+    with ``Session.merge(load=False)``, so it runs no query and the user behaves
+    like one loaded by that session.
+
+    Changes made through this worker's ORM drop the user when they are flushed and
+    again once committed, as a concurrent request may have cached the old row in
+    between. Changes made by other workers are picked up after ``ttl`` seconds.
+    When a token version is given, a cached user of another version is loaded
+    again, and counted as ``user_cache.stale``.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self._cache = TTLCache("user_cache", maxsize, ttl)
+
+    def get_user(
+        self,
+        session: Session,
+        user_id: int,
+        token_version: Optional[int] = None,
+    ) -> Optional[User]:
+        """Get a user, or ``None`` if it does not exist or has another token
+        version than ``token_version``."""
+        values = self._cache.get(user_id)
+        if (
+            values is not None
+            and token_version is not None
+            and values["token_version"] != token_version
+        ):
+            metrics.increment("user_cache.stale")
+            values = None
+
+        if values is not None:
+            return session.merge(detached_user(values), load=False)
+
+        user = User.get(session, user_id)
+        if not user:
+            return None
+        self._cache.set(user_id, user.to_dict())
+
+        if token_version is not None and user.token_version != token_version:
+            return None
+        return user
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop a cached user."""
+        self._cache.pop(user_id)
+
+
+user_cache = UserCache(
+    maxsize=settings.auth_user_cache_max_entries,
+    ttl=settings.auth_user_cache_ttl_seconds,
+)
+
+# decoded access tokens and their expiry, keyed by the digest of the token
+token_cache = TTLCache(
+    "auth_token_cache",
+    maxsize=settings.auth_token_cache_max_entries,
+    ttl=settings.auth_token_cache_ttl_seconds,
+)
+
+
+def _invalidate_user_cache(mapper, connection, target) -> None:
+    user_cache.invalidate(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(INVALIDATED_USER_IDS_KEY, set()).add(target.id)
+
+
+def _invalidate_committed_users(session: Session) -> None:
+    for user_id in session.info.pop(INVALIDATED_USER_IDS_KEY, ()):
+        user_cache.invalidate(user_id)
+
+
+def _forget_rolled_back_users(session: Session) -> None:
+    session.info.pop(INVALIDATED_USER_IDS_KEY, None)
+
+
+for event_name in ("after_update", "after_delete"):
+    event.listen(User, event_name, _invalidate_user_cache)
+event.listen(Session, "after_commit", _invalidate_committed_users)
+event.listen(Session, "after_rollback", _forget_rolled_back_users)
@@ -96,6 +96,29 @@ def logout() -> JSONResponse:
     return response
 
 
+@router.post("/logout/all")
+def logout_all(
+    user: User = Depends(services.get_current_user),
+    session: Session = Depends(db),
+) -> JSONResponse:
+    """
+    Log out a user everywhere, revoking all their access tokens.
+    """
+
+    services.revoke_access_tokens(session=session, user=user)
+
+    response = JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"message": "Logged out everywhere."},
+    )
+
+    response.delete_cookie(
+        key=constants.AUTH_TOKEN_NAME,
+    )
+
+    return response
+
+
 @router.get("/whoami")
 def whoami(user: User = Depends(services.get_current_user)):
     """
@@ -2,6 +2,7 @@ import bcrypt
 from sqlalchemy import Column
 from sqlalchemy.sql.sqltypes import Integer, String
 
+from app import constants
 from app.database import Base
 
 
@@ -15,6 +16,10 @@ class User(Base):
     email = Column(String, nullable=False, index=True, unique=True)
     password = Column(String, nullable=False)
     name = Column(String, nullable=False)
+    # decides which LLM models may answer the user, see ``settings.llm_routes``
+    tier = Column(String, nullable=False, server_default=constants.USER_TIER_FREE)
+    # bumped to revoke every access token issued so far
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     def __init__(
         self,
@@ -14,6 +14,11 @@ class UserResponseSchema(BaseUserSchema):
     user_id: int
 
 
+class AuthTokenSchema(UserResponseSchema):
+    # tokens issued before versions existed are of the first one
+    token_version: int = 0
+
+
 class UserLoginSchema(BaseModel):
     email: str
     password: str
@@ -1,16 +1,21 @@
+import hashlib
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 import jwt
-from fastapi import Depends, HTTPException, Request, status
+from fastapi import Depends, HTTPException, status
 from fastapi.logger import logger
 from fastapi.responses import JSONResponse
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from starlette.requests import HTTPConnection
 
 from app import constants
+from app.api.v1.auth.cache import token_cache, user_cache
 from app.api.v1.auth.models import User
 from app.api.v1.auth.schemas import (
+    AuthTokenSchema,
     UserLoginSchema,
     UserResponseSchema,
     UserSignupSchema,
@@ -97,19 +102,24 @@ def login(
 
 def create_jwt_with_expiry(
     data: dict,
+    expires_delta: Optional[timedelta] = None,
 ) -> str:
     """Generate a JWT with given data and expiry.
 
     Args:
         data (dict): Data to encode in the JWT
         expires_delta (timedelta, optional): Timedelta defining JWT expiry.
-        Defaults to 48 hours.
+        Defaults to the lifetime of the auth cookie.
 
     Returns:
         str: JWT string
     """
 
-    return jwt.encode(data, settings.secret_key, algorithm=ALGORITHM)
+    if expires_delta is None:
+        expires_delta = timedelta(days=constants.ACCESS_TOKEN_EXPIRY_DAYS)
+
+    payload = {**data, "exp": datetime.now(tz=timezone.utc) + expires_delta}
+    return jwt.encode(payload, settings.secret_key, algorithm=ALGORITHM)
 
 
 def create_user_access_token(
@@ -117,7 +127,7 @@ def create_user_access_token(
 ) -> str:
     """Create an Access Token for the given user.
 
-    JWT payload contains user's id, email, and name.
+    JWT payload contains user's id, email, name, and token version.
 
     Args:
         user (User): User to make an access token for.
@@ -126,10 +136,11 @@ def create_user_access_token(
         str: JWT string
     """
 
-    jwt_payload = UserResponseSchema(
+    jwt_payload = AuthTokenSchema(
         user_id=user.id,
         email=user.email,
         name=user.name,
+        token_version=user.token_version,
     )
 
     return create_jwt_with_expiry(jwt_payload.model_dump())
@@ -159,8 +170,33 @@ def create_success_auth_user_response(user: User, status_code: int) -> JSONRespo
     return response
 
 
-def decode_auth_token(token: str) -> Optional[UserResponseSchema]:
-    """Decode the JWT token to get user details."""
+def revoke_access_tokens(session: Session, user: User) -> None:
+    """
+    Revoke every access token issued to the user so far, logging them out
+    everywhere.
+
+    Only enforced with ``settings.auth_check_token_version``.
+    """
+
+    user.token_version = User.token_version + 1
+    session.commit()
+
+
+def decode_auth_token(token: str) -> Optional[AuthTokenSchema]:
+    """Decode the JWT token to get user details.
+
+    Valid tokens are kept decoded in ``token_cache``, keyed by their digest, so a
+    token sent again is not verified again. Its expiry is checked on every use.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    cached = token_cache.get(key)
+    if cached is not None:
+        expires_at, token_data = cached
+        if expires_at is None or time.time() < expires_at:
+            return token_data
+        token_cache.pop(key)
+        return None
+
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=[ALGORITHM])
     except jwt.ExpiredSignatureError:
@@ -168,13 +204,22 @@ def decode_auth_token(token: str) -> Optional[UserResponseSchema]:
     except jwt.InvalidTokenError:
         return None
 
-    return UserResponseSchema(**payload)
+    token_data = AuthTokenSchema(**payload)
+    # tokens issued before expiries were set have none
+    expires_at = payload.get("exp")
+    ttl = settings.auth_token_cache_ttl_seconds
+    if expires_at is not None:
+        ttl = min(ttl, expires_at - time.time())
+    token_cache.set(key, (expires_at, token_data), ttl=ttl)
+
+    return token_data
 
 
-def get_auth_token_data(request: Request) -> UserResponseSchema:
-    """Get authentication token data from the request."""
+def get_auth_token_data(request: HTTPConnection) -> AuthTokenSchema:
+    """Get authentication token data from the request or WebSocket handshake."""
     token = request.cookies.get(constants.AUTH_TOKEN_NAME) or request.headers.get(
         "Authorization",
+        "",
     ).replace("Bearer ", "")
     if not token:
         raise HTTPException(
@@ -190,12 +235,24 @@ def get_auth_token_data(request: Request) -> UserResponseSchema:
     return token_data
 
 
-def get_current_user(request: Request, session: Session = Depends(db)) -> User:
-    """Get the current authenticated user or raise an HTTP exception."""
+def get_current_user(
+    request: HTTPConnection,
+    session: Session = Depends(db),
+) -> User:
+    """Get the current authenticated user or raise an HTTP exception.
+
+    Users are served from ``user_cache``, so the common path runs no query.
+    """
     token_data = get_auth_token_data(request)
     user = None
     if token_data and token_data.user_id:
-        user = User.get(session, token_data.user_id)
+        user = user_cache.get_user(
+            session,
+            token_data.user_id,
+            token_version=(
+                token_data.token_version if settings.auth_check_token_version else None
+            ),
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -0,0 +1,131 @@
+import math
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from app.api.v1.chat.models import ChatContextPrompt
+from app.api.v1.chat.schemas import ChatContextPromptSchema
+from app.settings import settings
+from app.utils.cache import MISSING, TTLCache
+from app.utils.metrics import metrics
+
+ALL_PROMPTS_KEY = "all"
+
+
+def chat_context_to_schema(context: ChatContextPrompt) -> ChatContextPromptSchema:
+    return ChatContextPromptSchema(
+        id=context.id,
+        title=context.title,
+        prompt=context.prompt,
+        cache_responses=context.cache_responses,
+    )
+
+
+class ChatContextPromptCache:
+    """In-process cache of chat context prompts.
+
+    Prompts are effectively static, so they are served from memory. Every
+    ``check_interval`` seconds the cache compares a cheap version of the table
+    (count, max id, max updated_at) against the database and drops everything when
+    it changed, which is how edits made by other uvicorn workers are picked up.
+    Edits made through this worker's ORM invalidate the cache right away.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, check_interval: float) -> None:
+        self.check_interval = check_interval
+        self._cache = TTLCache("chat_context_prompts_cache", maxsize, ttl)
+        self._lock = threading.Lock()
+        self._version: Optional[tuple] = None
+        self._checked_at = -math.inf
+
+    def _revalidate(self, session: Session) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+
+        version = tuple(
+            session.query(
+                func.count(ChatContextPrompt.id),
+                func.max(ChatContextPrompt.id),
+                func.max(ChatContextPrompt.updated_at),
+            ).one(),
+        )
+
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    metrics.increment("chat_context_prompts_cache.invalidations")
+                self._cache.clear()
+                self._version = version
+            self._checked_at = now
+
+    def get_version(self, session: Session) -> tuple:
+        """Get the version of the chat context prompts."""
+        self._revalidate(session)
+        return self._version
+
+    def get_context(
+        self,
+        session: Session,
+        context_id: int,
+    ) -> Optional[ChatContextPromptSchema]:
+        """Get a chat context, or ``None`` if it does not exist."""
+        self._revalidate(session)
+
+        context = self._cache.get(context_id, MISSING)
+        if context is MISSING:
+            chat_context = ChatContextPrompt.get(session, context_id)
+            context = chat_context_to_schema(chat_context) if chat_context else None
+            self._cache.set(context_id, context)
+
+        return context
+
+    def get_prompt(self, session: Session, context_id: int) -> Optional[str]:
+        """Get the prompt of a chat context, or ``None`` if it does not exist."""
+        context = self.get_context(session, context_id)
+        return context.prompt if context else None
+
+    def get_all(self, session: Session) -> list[ChatContextPromptSchema]:
+        """Get all chat context prompts."""
+        self._revalidate(session)
+
+        prompts = self._cache.get(ALL_PROMPTS_KEY, MISSING)
+        if prompts is MISSING:
+            prompts = [
+                chat_context_to_schema(context)
+                for context in session.query(ChatContextPrompt).all()
+            ]
+            self._cache.set(ALL_PROMPTS_KEY, prompts)
+
+        return prompts
+
+    def warm(self, session: Session) -> None:
+        """Load every prompt into the cache."""
+        self.invalidate()
+        for context in self.get_all(session):
+            self._cache.set(context.id, context)
+
+    def invalidate(self) -> None:
+        """Drop every cached prompt and the known version."""
+        with self._lock:
+            self._cache.clear()
+            self._version = None
+            self._checked_at = -math.inf
+
+
+context_prompt_cache = ChatContextPromptCache(
+    maxsize=settings.chat_context_cache_max_entries,
+    ttl=settings.chat_context_cache_ttl_seconds,
+    check_interval=settings.chat_context_cache_check_seconds,
+)
+
+
+def _invalidate_context_prompt_cache(mapper, connection, target) -> None:
+    context_prompt_cache.invalidate()
+
+
+for event_name in ("after_insert", "after_update", "after_delete"):
+    event.listen(ChatContextPrompt, event_name, _invalidate_context_prompt_cache)
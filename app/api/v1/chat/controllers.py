@@ -1,30 +1,115 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import time
+from typing import Optional, Union
+
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    status,
+)
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from app import constants
 from app.api.v1.auth.models import User
 from app.api.v1.auth.services import get_current_user
-from app.api.v1.chat import services
+from app.api.v1.chat import idempotency, memory, services, summaries
+from app.api.v1.chat.models import GenerationJobStatus
 from app.api.v1.chat.schemas import (
     ChatContextPromptSchema,
     ChatHistoryResponseSchema,
+    ChatSearchResponseSchema,
+    ChatSyncResponseSchema,
+    ConversationListResponseSchema,
+    ConversationResponseSchema,
+    CreateConversationSchema,
     DeleteMessageSchema,
+    GenerationJobResponseSchema,
     SendMessageResponseSchema,
     SendMessageSchema,
     UpdateMessageSchema,
 )
+from app.api.v1.chat.sockets import ChatSocket
 from app.database import db
+from app.settings import settings
+from app.utils.http import cancel_on_disconnect, is_not_modified, make_etag
 
 router = APIRouter()
 
 
+@router.get("/conversations")
+def list_conversations(
+    limit: int = Query(
+        default=constants.CONVERSATIONS_DEFAULT_PAGE_SIZE,
+        ge=1,
+        le=constants.CONVERSATIONS_MAX_PAGE_SIZE,
+    ),
+    before_id: int = None,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(db),
+) -> ConversationListResponseSchema:
+    """
+    Get a page of conversations, newest first.
+    """
+
+    return services.list_conversations(
+        user_id=current_user.id,
+        session=session,
+        limit=limit,
+        before_id=before_id,
+    )
+
+
+@router.post("/conversations", status_code=status.HTTP_201_CREATED)
+def create_conversation(
+    payload: CreateConversationSchema,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(db),
+) -> ConversationResponseSchema:
+    """
+    Start a new conversation.
+    """
+
+    return services.create_conversation(
+        user_id=current_user.id,
+        session=session,
+        title=payload.title,
+    )
+
+
 @router.post("/send")
-def send_message(
+async def send_message(
+    request: Request,
     payload: SendMessageSchema,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    idempotency_key: Optional[str] = Header(
+        default=None,
+        alias=constants.IDEMPOTENCY_KEY_HEADER,
+        max_length=constants.IDEMPOTENCY_KEY_MAX_LENGTH,
+    ),
     current_user: User = Depends(get_current_user),
     session: Session = Depends(db),
-) -> SendMessageResponseSchema:
+) -> Union[SendMessageResponseSchema, GenerationJobResponseSchema]:
     """
-    Send a message.
+    Send a message to a conversation, the default one when none is given.
+
+    With ``background`` set, the reply is queued for the generation workers and a
+    202 with the job is returned right away; poll ``/jobs/{job_id}`` for the reply.
+
+    Retries carrying the same ``Idempotency-Key`` header get the original response
+    instead of sending the message again.
+
+    When the client disconnects before the reply is ready, the LLM call is cancelled
+    and no reply is saved.
     """
 
     if not payload.message:
@@ -33,28 +118,286 @@ def send_message(
             detail="Message cannot be empty.",
         )
 
-    response = services.receive_chatbot_message(
-        user=current_user,
+    user_id = current_user.id
+    conversation_id = await run_in_threadpool(
+        services.resolve_send_conversation_id,
+        session=session,
+        user_id=user_id,
+        conversation_id=payload.conversation_id,
+    )
+
+    if payload.background:
+        response.status_code = status.HTTP_202_ACCEPTED
+        handle_message = services.enqueue_chatbot_message
+        response_class = GenerationJobResponseSchema
+    else:
+        handle_message = services.receive_chatbot_message
+        response_class = SendMessageResponseSchema
+        background_tasks.add_task(
+            summaries.summarize_chat_history,
+            user_id=user_id,
+            conversation_id=conversation_id,
+        )
+        background_tasks.add_task(memory.embed_chat_messages, user_id=user_id)
+
+    def send():
+        return handle_message(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            message=payload.message,
+            session=session,
+            context_id=payload.context_id,
+        )
+
+    if idempotency_key:
+        return await cancel_on_disconnect(
+            request,
+            idempotency.run_idempotently(
+                session=session,
+                user_id=user_id,
+                key=idempotency_key,
+                payload=payload.model_dump_json(),
+                func=send,
+                response_class=response_class,
+            ),
+        )
+
+    return await cancel_on_disconnect(request, send())
+
+
+@router.get("/jobs/{job_id}")
+async def get_generation_job(
+    job_id: int,
+    wait: float = Query(
+        default=0,
+        ge=0,
+        le=constants.CHAT_GENERATION_JOB_MAX_WAIT_SECONDS,
+    ),
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(db),
+) -> GenerationJobResponseSchema:
+    """
+    Get a background generation job.
+
+    With ``wait``, the call long-polls for up to that many seconds until the job
+    is done or failed.
+    """
+
+    user_id = current_user.id
+    deadline = time.monotonic() + wait
+
+    while True:
+        job = await run_in_threadpool(
+            services.get_generation_job,
+            session=session,
+            user_id=user_id,
+            job_id=job_id,
+        )
+        if (
+            job.status
+            in (GenerationJobStatus.DONE.value, GenerationJobStatus.FAILED.value)
+            or time.monotonic() >= deadline
+        ):
+            return job
+        await asyncio.sleep(settings.chat_generation_poll_seconds)
+
+
+@router.post("/send/stream")
+async def send_message_stream(
+    payload: SendMessageSchema,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(db),
+) -> StreamingResponse:
+    """
+    Send a message and stream the reply as Server-Sent Events.
+
+    When the client disconnects, the LLM call is cancelled and the partial reply is
+    saved or dropped, see ``settings.chat_store_partial_replies``.
+    """
+
+    if not payload.message:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Message cannot be empty.",
+        )
+
+    user_id = current_user.id
+    conversation_id = await run_in_threadpool(
+        services.resolve_conversation_id,
+        session=session,
+        user_id=user_id,
+        conversation_id=payload.conversation_id,
+    )
+
+    event_stream = await services.stream_chatbot_message(
+        user_id=user_id,
+        conversation_id=conversation_id,
         message=payload.message,
         session=session,
         context_id=payload.context_id,
     )
 
-    return response
+    background_tasks.add_task(
+        summaries.summarize_chat_history,
+        user_id=user_id,
+        conversation_id=conversation_id,
+    )
+    background_tasks.add_task(memory.embed_chat_messages, user_id=user_id)
+
+    return StreamingResponse(
+        event_stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background_tasks,
+    )
+
+
+@router.websocket("/ws")
+async def chat_websocket(
+    websocket: WebSocket,
+    session: Session = Depends(db),
+) -> None:
+    """
+    Chat over a WebSocket, see ``ChatSocket`` for the frames.
+
+    The connection is authenticated once, from the cookie or ``Authorization``
+    header of the handshake, and keeps one session for all its frames. Replies are
+    pushed token by token as they are generated.
+
+    CORS does not cover WebSockets, so handshakes from an ``Origin`` outside
+    ``settings.allowed_origins`` are refused: otherwise any site could chat as its
+    logged-in visitors, with their cookie. Browsers always send the header;
+    handshakes without it come from other clients, which authenticate on their own.
+    """
+    origin = websocket.headers.get("origin")
+    if origin is not None and origin not in settings.allowed_origins:
+        await websocket.close(
+            code=status.WS_1008_POLICY_VIOLATION,
+            reason="Origin not allowed.",
+        )
+        return
+
+    def authenticate() -> User:
+        user = get_current_user(websocket, session)
+        # keep the user loaded across the commits of the connection
+        session.expunge(user)
+        session.commit()
+        return user
+
+    try:
+        user = await run_in_threadpool(authenticate)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+        return
+
+    await websocket.accept()
+    await ChatSocket(websocket, user, session).run()
 
 
 @router.get("/history")
 def get_chat_history(
+    request: Request,
+    response: Response,
+    limit: int = Query(
+        default=constants.CHAT_HISTORY_DEFAULT_PAGE_SIZE,
+        ge=1,
+        le=constants.CHAT_HISTORY_MAX_PAGE_SIZE,
+    ),
+    before_id: int = None,
+    after_id: int = None,
+    conversation_id: int = None,
     current_user: User = Depends(get_current_user),
     session: Session = Depends(db),
 ) -> ChatHistoryResponseSchema:
     """
-    Get chat history.
+    Get a page of the history of a conversation, the default one when none is given.
+
+    Answers 304 Not Modified without loading any messages when the client's
+    ``If-None-Match`` matches the current version of the history.
+    """
+
+    conversation_id = services.resolve_conversation_id(
+        session=session,
+        user_id=current_user.id,
+        conversation_id=conversation_id,
+        create=False,
+    )
+
+    etag = make_etag(
+        current_user.id,
+        conversation_id,
+        services.get_chat_history_version(session, current_user.id, conversation_id),
+        limit,
+        before_id,
+        after_id,
+    )
+    if is_not_modified(request, etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag},
+        )
+    response.headers["ETag"] = etag
+
+    return services.get_chat_history(
+        user=current_user,
+        session=session,
+        conversation_id=conversation_id,
+        limit=limit,
+        before_id=before_id,
+        after_id=after_id,
+    )
+
+
+@router.get("/search")
+def search_chat_history(
+    q: str = Query(min_length=1, max_length=constants.CHAT_SEARCH_QUERY_MAX_LENGTH),
+    limit: int = Query(
+        default=constants.CHAT_SEARCH_DEFAULT_PAGE_SIZE,
+        ge=1,
+        le=constants.CHAT_SEARCH_MAX_PAGE_SIZE,
+    ),
+    offset: int = Query(default=0, ge=0),
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(db),
+) -> ChatSearchResponseSchema:
+    """
+    Search the chat history. Results are ranked by relevance and highlighted.
+    """
+
+    return services.search_chat_history(
+        user_id=current_user.id,
+        session=session,
+        query=q,
+        limit=limit,
+        offset=offset,
+    )
+
+
+@router.get("/sync")
+def sync_chat_history(
+    since_id: int = Query(default=0, ge=0),
+    since: float = None,
+    limit: int = Query(
+        default=constants.CHAT_SYNC_DEFAULT_PAGE_SIZE,
+        ge=1,
+        le=constants.CHAT_SYNC_MAX_PAGE_SIZE,
+    ),
+    cursor: str = None,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(db),
+) -> ChatSyncResponseSchema:
+    """
+    Get chat history changes since the client's watermark, page by page.
     """
 
-    response = services.get_chat_history(
+    response = services.sync_chat_history(
         user=current_user,
         session=session,
+        since_id=since_id,
+        since=since,
+        limit=limit,
+        cursor=cursor,
     )
 
     return response
@@ -101,14 +444,22 @@ def delete_chat_history(
     session: Session = Depends(db),
 ) -> ChatHistoryResponseSchema:
     """
-    Delete chat history.
+    Delete a message, or all messages of a conversation.
     """
 
+    conversation_id = services.resolve_conversation_id(
+        session=session,
+        user_id=current_user.id,
+        conversation_id=payload.conversation_id,
+        create=False,
+    )
+
     response = services.delete_chat_history(
         user=current_user,
         message_id=payload.message_id,
         delete_all=payload.delete_all,
         session=session,
+        conversation_id=conversation_id,
     )
 
     return response
@@ -116,15 +467,29 @@ def delete_chat_history(
 
 @router.get("/context")
 def get_chat_context_prompts(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     session: Session = Depends(db),
 ) -> list[ChatContextPromptSchema]:
     """
     Get chat context prompts.
+
+    Answers 304 Not Modified when the client's ``If-None-Match`` matches, and lets
+    clients cache the prompts, which almost never change.
     """
 
-    response = services.get_chat_context_prompts(
+    etag = make_etag(services.get_chat_context_prompts_version(session))
+    headers = {
+        "ETag": etag,
+        "Cache-Control": (
+            f"private, max-age={constants.CHAT_CONTEXT_PROMPTS_MAX_AGE_SECONDS}"
+        ),
+    }
+    if is_not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+
+    return services.get_chat_context_prompts(
         session=session,
     )
-
-    return response
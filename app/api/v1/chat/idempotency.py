@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional, Type, TypeVar
+
+from fastapi import HTTPException, status
+from fastapi.logger import logger
+from pydantic import BaseModel
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import constants
+from app.api.v1.chat.models import ChatIdempotencyKey
+from app.settings import settings
+from app.utils.metrics import metrics
+
+ResponseSchema = TypeVar("ResponseSchema", bound=BaseModel)
+
+
+def hash_request(payload: str) -> str:
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def claim_idempotency_key(
+    session: Session,
+    user_id: int,
+    key: str,
+    request_hash: str,
+) -> tuple[bool, Optional[str]]:
+    """
+    Try to claim an idempotency key for a new request.
+
+    Returns whether the key was claimed, and the stored response when the original
+    request already finished. Expired keys of the user are removed on the way, and
+    an unfinished key expires after ``idempotency_wait_seconds`` so a crashed
+    request does not block its retries forever.
+    """
+
+    now = datetime.now()
+
+    session.execute(
+        delete(ChatIdempotencyKey).where(
+            ChatIdempotencyKey.user_id == user_id,
+            ChatIdempotencyKey.expires_at <= now,
+        ),
+    )
+
+    claimed = session.scalar(
+        insert(ChatIdempotencyKey)
+        .values(
+            user_id=user_id,
+            key=key,
+            request_hash=request_hash,
+            expires_at=now + timedelta(seconds=settings.idempotency_wait_seconds),
+        )
+        .on_conflict_do_nothing()
+        .returning(ChatIdempotencyKey.key),
+    )
+
+    stored_response = None
+    if claimed is None:
+        stored_hash, stored_response = session.execute(
+            select(ChatIdempotencyKey.request_hash, ChatIdempotencyKey.response).where(
+                ChatIdempotencyKey.user_id == user_id,
+                ChatIdempotencyKey.key == key,
+            ),
+        ).one()
+        if stored_hash != request_hash:
+            session.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used with a different request.",
+            )
+
+    session.commit()
+
+    return claimed is not None, stored_response
+
+
+def store_idempotent_response(
+    session: Session,
+    user_id: int,
+    key: str,
+    response: str,
+) -> None:
+    """
+    Store the response of a finished request and keep it for
+    ``idempotency_key_ttl_seconds``.
+    """
+
+    session.execute(
+        update(ChatIdempotencyKey)
+        .where(ChatIdempotencyKey.user_id == user_id, ChatIdempotencyKey.key == key)
+        .values(
+            response=response,
+            expires_at=datetime.now()
+            + timedelta(seconds=settings.idempotency_key_ttl_seconds),
+        ),
+    )
+    session.commit()
+
+
+def release_idempotency_key(session: Session, user_id: int, key: str) -> None:
+    """
+    Release the key of a failed request, so that a retry can run it again.
+    """
+
+    session.rollback()
+    session.execute(
+        delete(ChatIdempotencyKey).where(
+            ChatIdempotencyKey.user_id == user_id,
+            ChatIdempotencyKey.key == key,
+            ChatIdempotencyKey.response.is_(None),
+        ),
+    )
+    session.commit()
+
+
+async def run_idempotently(
+    session: Session,
+    user_id: int,
+    key: str,
+    payload: str,
+    func: Callable[[], Awaitable[ResponseSchema]],
+    response_class: Type[ResponseSchema],
+) -> ResponseSchema:
+    """
+    Run ``func`` at most once per user and idempotency key.
+
+    A retry of a finished request gets the stored response. A retry that arrives
+    while the original is still running waits for it for up to
+    ``idempotency_wait_seconds`` and then gets a 409.
+    """
+    log_prefix = "[Idempotency]"
+
+    request_hash = hash_request(payload)
+    deadline = time.monotonic() + settings.idempotency_wait_seconds
+
+    while True:
+        claimed, stored_response = await run_in_threadpool(
+            claim_idempotency_key,
+            session,
+            user_id,
+            key,
+            request_hash,
+        )
+        if stored_response is not None:
+            logger.info(f"{log_prefix} Replaying stored response for key: {key}")
+            metrics.increment("idempotency.replayed")
+            return response_class.model_validate_json(stored_response)
+        if claimed:
+            break
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still in progress.",
+            )
+        metrics.increment("idempotency.waited")
+        await asyncio.sleep(constants.IDEMPOTENCY_POLL_INTERVAL_SECONDS)
+
+    try:
+        response = await func()
+    except BaseException:
+        await run_in_threadpool(release_idempotency_key, session, user_id, key)
+        raise
+
+    await run_in_threadpool(
+        store_idempotent_response,
+        session,
+        user_id,
+        key,
+        response.model_dump_json(),
+    )
+
+    return response
@@ -0,0 +1,234 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from fastapi.logger import logger
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import constants
+from app.api.v1.chat.models import ChatMessage, ChatMessageEmbedding
+from app.database import session_factory
+from app.settings import settings
+from app.utils.embeddings import get_embedder
+from app.utils.metrics import metrics
+from app.utils.resilience import without_deadline
+from app.utils.vector_index import VectorIndex
+
+
+def get_memory_index(user_id: int, conversation_id: int) -> VectorIndex:
+    """
+    Get the on-disk index of a conversation's embeddings for the current embedding
+    model.
+    """
+
+    embedder = get_embedder()
+    return VectorIndex(
+        Path(settings.chat_memory_index_dir)
+        / embedder.model
+        / str(user_id)
+        / str(conversation_id),
+        embedder.dimensions,
+    )
+
+
+def sync_memory_index(
+    session: Session,
+    user_id: int,
+    conversation_id: int,
+    index: VectorIndex,
+) -> None:
+    """
+    Append the embeddings saved since the index was last synced.
+
+    The database is the source of truth: an index missing on this host is rebuilt,
+    and embeddings saved by other hosts are picked up. Embeddings committed after
+    ones with a higher id are picked up by reading the last
+    ``CHAT_MEMORY_SYNC_LOOKBACK_IDS`` ids again, the index skips those it has.
+    """
+
+    rows = (
+        session.query(
+            ChatMessageEmbedding.id,
+            ChatMessageEmbedding.message_id,
+            ChatMessageEmbedding.embedding,
+        )
+        .join(ChatMessage, ChatMessage.id == ChatMessageEmbedding.message_id)
+        .filter(
+            ChatMessageEmbedding.user_id == user_id,
+            ChatMessageEmbedding.model == get_embedder().model,
+            ChatMessageEmbedding.id
+            > index.last_sequence - constants.CHAT_MEMORY_SYNC_LOOKBACK_IDS,
+            ChatMessage.conversation_id == conversation_id,
+        )
+        .order_by(ChatMessageEmbedding.id)
+        .all()
+    )
+    if not rows:
+        return
+
+    index.append(
+        np.array([row.id for row in rows]),
+        np.array([row.message_id for row in rows]),
+        np.stack([np.frombuffer(row.embedding, dtype=np.float32) for row in rows]),
+    )
+
+
+def recall_chat_messages(
+    session: Session,
+    user_id: int,
+    conversation_id: int,
+    query_vector: np.ndarray,
+    before_id: Optional[int] = None,
+) -> list:
+    """
+    Find the conversation's messages most similar to ``query_vector``, oldest first.
+
+    Only messages older than ``before_id`` are considered.
+    """
+
+    index = get_memory_index(user_id, conversation_id)
+    sync_memory_index(session, user_id, conversation_id, index)
+
+    hits = index.search(query_vector, settings.chat_memory_top_k, before_id)
+    if not hits:
+        return []
+
+    # deleted messages drop out here
+    return (
+        session.query(ChatMessage.id, ChatMessage.sender_type, ChatMessage.message)
+        .filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.conversation_id == conversation_id,
+            ChatMessage.id.in_([message_id for message_id, _ in hits]),
+        )
+        .order_by(ChatMessage.id)
+        .all()
+    )
+
+
+async def embed_query(text: str) -> Optional[np.ndarray]:
+    """
+    Embed the text memories are recalled for. Returns ``None`` when memory is
+    disabled or the embedding fails, so replies never depend on it.
+    """
+
+    if not settings.chat_memory_enabled or not text:
+        return None
+
+    try:
+        return (await get_embedder().embed([text]))[0]
+    except Exception as e:
+        logger.exception(f"[Chat Memory] Failed to embed query: {e}")
+        return None
+
+
+def load_messages_to_embed(session: Session, user_id: int) -> list:
+    """
+    Load a batch of the user's messages without an embedding of the current model.
+    """
+
+    messages = (
+        session.query(ChatMessage.id, ChatMessage.message)
+        .outerjoin(
+            ChatMessageEmbedding,
+            (ChatMessageEmbedding.message_id == ChatMessage.id)
+            & (ChatMessageEmbedding.model == get_embedder().model),
+        )
+        .filter(
+            ChatMessage.user_id == user_id,
+            ChatMessageEmbedding.id.is_(None),
+        )
+        .order_by(ChatMessage.id)
+        .limit(constants.CHAT_MEMORY_EMBED_BATCH_SIZE)
+        .all()
+    )
+
+    session.commit()
+
+    return messages
+
+
+def save_chat_message_embeddings(
+    session: Session,
+    user_id: int,
+    message_ids: list[int],
+    vectors: np.ndarray,
+) -> None:
+    """
+    Save embeddings, skipping messages embedded concurrently.
+    """
+
+    model = get_embedder().model
+    session.execute(
+        insert(ChatMessageEmbedding)
+        .values(
+            [
+                {
+                    "user_id": user_id,
+                    "message_id": message_id,
+                    "model": model,
+                    "embedding": vector.astype(np.float32).tobytes(),
+                }
+                for message_id, vector in zip(message_ids, vectors)
+            ],
+        )
+        .on_conflict_do_nothing(
+            index_elements=[
+                ChatMessageEmbedding.message_id,
+                ChatMessageEmbedding.model,
+            ],
+        ),
+    )
+    session.commit()
+
+
+def invalidate_chat_message_embedding(session: Session, message_id: int) -> None:
+    """
+    Drop the embeddings of an edited message, so it gets embedded again.
+
+    Does not commit, the caller commits with the edit.
+    """
+
+    session.query(ChatMessageEmbedding).filter(
+        ChatMessageEmbedding.message_id == message_id,
+    ).delete(synchronize_session=False)
+
+
+@without_deadline
+async def embed_chat_messages(user_id: int) -> None:
+    """
+    Background step run after a message is sent: embed the user's messages that
+    have no embedding yet.
+    """
+    log_prefix = "[Chat Memory]"
+
+    if not settings.chat_memory_enabled:
+        return
+
+    session = session_factory()
+    try:
+        for _ in range(constants.CHAT_MEMORY_EMBED_MAX_BATCHES):
+            messages = await run_in_threadpool(load_messages_to_embed, session, user_id)
+            if not messages:
+                break
+
+            vectors = await get_embedder().embed(
+                [message.message for message in messages],
+            )
+            await run_in_threadpool(
+                save_chat_message_embeddings,
+                session=session,
+                user_id=user_id,
+                message_ids=[message.id for message in messages],
+                vectors=vectors,
+            )
+            metrics.increment("chat_memory.embedded", len(messages))
+
+            if len(messages) < constants.CHAT_MEMORY_EMBED_BATCH_SIZE:
+                break
+    except Exception as e:
+        logger.exception(f"{log_prefix} {e}")
+    finally:
+        await run_in_threadpool(session.close)
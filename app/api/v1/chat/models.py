@@ -1,8 +1,11 @@
 import enum
 
-from sqlalchemy import Column, Enum, ForeignKey
-from sqlalchemy.sql.sqltypes import Integer, String
+from sqlalchemy import Column, Computed, Enum, ForeignKey, Index, UniqueConstraint, true
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred
+from sqlalchemy.sql.sqltypes import Boolean, DateTime, Integer, LargeBinary, String
 
+from app import constants
 from app.database import Base
 
 
@@ -15,14 +18,120 @@ class SenderType(enum.Enum):
     SYSTEM = "SYSTEM"
 
 
+class GenerationJobStatus(enum.Enum):
+    """
+    Enum for background generation job status.
+    """
+
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+
+class Conversation(Base):
+    """A chat thread of a user. Every chat message belongs to one conversation."""
+
+    __tablename__ = "conversations"
+    __table_args__ = (
+        # listing and the default conversation: WHERE user_id = ? ORDER BY id
+        Index("ix_conversations_user_id_id", "user_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    title = Column(String, nullable=True)
+
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
-    __table_args__ = ()
+    __table_args__ = (
+        # sync across conversations: WHERE user_id = ? AND id > ?
+        Index("ix_chat_messages_user_id_id", "user_id", "id"),
+        # history and context of a conversation:
+        # WHERE user_id = ? AND conversation_id = ? ORDER BY id
+        Index(
+            "ix_chat_messages_user_id_conversation_id_id",
+            "user_id",
+            "conversation_id",
+            "id",
+        ),
+        # delta sync of edited messages: WHERE user_id = ? AND updated_at > ?
+        Index("ix_chat_messages_user_id_updated_at", "user_id", "updated_at"),
+        # full-text search: WHERE message_tsv @@ query
+        Index(
+            "ix_chat_messages_message_tsv",
+            "message_tsv",
+            postgresql_using="gin",
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     sender_type = Column(Enum(SenderType), nullable=False, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    conversation_id = Column(
+        Integer,
+        ForeignKey("conversations.id", ondelete="CASCADE"),
+        nullable=False,
+    )
     message = Column(String, nullable=False)
+    # kept up to date by Postgres, only loaded when asked for
+    message_tsv = deferred(
+        Column(
+            TSVECTOR,
+            Computed(
+                f"to_tsvector('{constants.CHAT_SEARCH_TEXT_CONFIG}', message)",
+                persisted=True,
+            ),
+        ),
+    )
+
+
+class ChatMessageTombstone(Base):
+    """Record of a deleted chat message, so clients can sync deletes.
+
+    ``created_at`` is the time the message was deleted.
+    """
+
+    __tablename__ = "chat_message_tombstones"
+    __table_args__ = (
+        Index("ix_chat_message_tombstones_user_id_created_at", "user_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    message_id = Column(Integer, nullable=False)
+
+
+class ChatMessageEmbedding(Base):
+    """Embedding of a chat message, to recall relevant older messages by similarity.
+
+    Rows are only ever added or deleted (an edited message is embedded again), so the
+    ids of a user's rows tell which ones an on-disk index is missing.
+    """
+
+    __tablename__ = "chat_message_embeddings"
+    __table_args__ = (
+        UniqueConstraint("message_id", "model"),
+        # index sync: WHERE user_id = ? AND model = ? AND id > ?
+        Index(
+            "ix_chat_message_embeddings_user_id_model_id",
+            "user_id",
+            "model",
+            "id",
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    message_id = Column(
+        Integer,
+        ForeignKey("chat_messages.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    model = Column(String, nullable=False)
+    # L2-normalized float32 vector
+    embedding = Column(LargeBinary, nullable=False)
 
 
 class ChatContextPrompt(Base):
@@ -32,3 +141,87 @@ class ChatContextPrompt(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     prompt = Column(String, nullable=False)
+    # whether LLM responses under this context may be served from the response cache
+    cache_responses = Column(Boolean, nullable=False, server_default=true())
+
+
+class ChatResponseCacheEntry(Base):
+    """LLM response shared across workers by the Postgres response cache backend."""
+
+    __tablename__ = "chat_response_cache"
+    # eviction keeps the most recently written rows
+    __table_args__ = (Index("ix_chat_response_cache_updated_at", "updated_at"),)
+
+    # sha256 of the model, system prompt and messages sent to the LLM
+    key = Column(String(64), primary_key=True)
+    response = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class ChatSummary(Base):
+    """Running summary of the older chat messages of a conversation."""
+
+    __tablename__ = "chat_summaries"
+    __table_args__ = ()
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    conversation_id = Column(
+        Integer,
+        ForeignKey("conversations.id", ondelete="CASCADE"),
+        nullable=False,
+        unique=True,
+    )
+    summary = Column(String, nullable=False)
+    # id of the newest chat message folded into the summary
+    last_message_id = Column(Integer, nullable=False)
+
+
+class ChatIdempotencyKey(Base):
+    """Response of a /chat/send call made with an ``Idempotency-Key`` header.
+
+    ``response`` is empty while the original request is still running.
+    """
+
+    __tablename__ = "chat_idempotency_keys"
+    __table_args__ = ()
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    # sha256 of the request payload, a reused key must come with the same payload
+    request_hash = Column(String(64), nullable=False)
+    response = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class ChatGenerationJob(Base):
+    """Queued generation of the SYSTEM reply to a user message.
+
+    Workers claim jobs with ``SELECT ... FOR UPDATE SKIP LOCKED``. A RUNNING job
+    whose ``locked_until`` passed belongs to a crashed worker and is claimed again.
+    """
+
+    __tablename__ = "chat_generation_jobs"
+    __table_args__ = (Index("ix_chat_generation_jobs_status_id", "status", "id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    message_id = Column(
+        Integer,
+        ForeignKey("chat_messages.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    context_id = Column(Integer, nullable=True)
+    status = Column(
+        Enum(GenerationJobStatus),
+        nullable=False,
+        default=GenerationJobStatus.PENDING,
+    )
+    attempts = Column(Integer, nullable=False, default=0)
+    locked_until = Column(DateTime, nullable=True)
+    result_message_id = Column(
+        Integer,
+        ForeignKey("chat_messages.id", ondelete="SET NULL"),
+        nullable=True,
+    )
+    error = Column(String, nullable=True)
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Union
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.api.v1.chat.cache import context_prompt_cache
+from app.api.v1.chat.models import ChatResponseCacheEntry
+from app.settings import settings
+from app.utils.cache import TTLCache
+from app.utils.metrics import metrics
+
+MEMORY_BACKEND = "memory"
+POSTGRES_BACKEND = "postgres"
+
+# expired and overflowing rows are deleted once every this many writes
+POSTGRES_EVICTION_INTERVAL = 100
+
+
+def make_response_cache_key(model: str, messages: list[dict]) -> str:
+    """
+    Hash the model and the messages sent to it. Whitespace in the message contents
+    is normalized, so trivially different prompts share a key.
+    """
+
+    normalized_messages = [
+        {
+            "role": message["role"],
+            "content": " ".join(message["content"].split()),
+        }
+        for message in messages
+    ]
+    payload = json.dumps(
+        {"model": model, "messages": normalized_messages},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryResponseCache:
+    """LRU + TTL response cache local to the worker."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self._cache = TTLCache("llm_response_cache.memory", maxsize, ttl)
+
+    async def get(self, session: Session, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    async def set(self, session: Session, key: str, response: str) -> None:
+        self._cache.set(key, response)
+
+
+class PostgresResponseCache:
+    """TTL response cache stored in the ``chat_response_cache`` table, shared by all
+    workers. Once every ``POSTGRES_EVICTION_INTERVAL`` writes, expired rows and
+    the oldest rows over ``maxsize`` are deleted.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _get(self, session: Session, key: str) -> Optional[str]:
+        response = session.scalar(
+            select(ChatResponseCacheEntry.response).where(
+                ChatResponseCacheEntry.key == key,
+                ChatResponseCacheEntry.expires_at > datetime.now(),
+            ),
+        )
+        session.commit()
+        return response
+
+    def _set(self, session: Session, key: str, response: str) -> None:
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=self.ttl)
+        session.execute(
+            insert(ChatResponseCacheEntry)
+            .values(key=key, response=response, expires_at=expires_at)
+            .on_conflict_do_update(
+                index_elements=[ChatResponseCacheEntry.key],
+                set_={
+                    "response": response,
+                    "expires_at": expires_at,
+                    "updated_at": now,
+                },
+            ),
+        )
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % POSTGRES_EVICTION_INTERVAL == 0
+        if evict:
+            self._evict(session, now)
+
+        session.commit()
+
+    def _evict(self, session: Session, now: datetime) -> None:
+        session.execute(
+            delete(ChatResponseCacheEntry).where(
+                ChatResponseCacheEntry.expires_at <= now,
+            ),
+        )
+        overflowing_keys = (
+            select(ChatResponseCacheEntry.key)
+            .order_by(ChatResponseCacheEntry.updated_at.desc())
+            .offset(self.maxsize)
+        )
+        session.execute(
+            delete(ChatResponseCacheEntry).where(
+                ChatResponseCacheEntry.key.in_(overflowing_keys),
+            ),
+        )
+
+    async def get(self, session: Session, key: str) -> Optional[str]:
+        return await run_in_threadpool(self._get, session, key)
+
+    async def set(self, session: Session, key: str, response: str) -> None:
+        await run_in_threadpool(self._set, session, key, response)
+
+
+ResponseCache = Union[MemoryResponseCache, PostgresResponseCache]
+
+_backends: dict[str, ResponseCache] = {}
+
+
+def get_response_cache(
+    session: Session,
+    context_id: int = None,
+) -> Optional[ResponseCache]:
+    """
+    Get the configured response cache backend, or ``None`` when response caching is
+    disabled globally or for the given chat context.
+    """
+
+    backend = settings.llm_response_cache_backend
+    if backend not in (MEMORY_BACKEND, POSTGRES_BACKEND):
+        return None
+
+    if context_id:
+        context = context_prompt_cache.get_context(session, context_id)
+        if context and not context.cache_responses:
+            return None
+
+    if backend not in _backends:
+        backend_class = (
+            MemoryResponseCache if backend == MEMORY_BACKEND else PostgresResponseCache
+        )
+        _backends[backend] = backend_class(
+            maxsize=settings.llm_response_cache_max_entries,
+            ttl=settings.llm_response_cache_ttl_seconds,
+        )
+
+    return _backends[backend]
+
+
+async def get_cached_response(
+    response_cache: ResponseCache,
+    session: Session,
+    key: str,
+) -> Optional[str]:
+    """
+    Look a response up in the cache, counting hits and misses.
+    """
+
+    response = await response_cache.get(session, key)
+    metrics.increment(
+        (
+            "llm_response_cache.hits"
+            if response is not None
+            else "llm_response_cache.misses"
+        ),
+    )
+    return response
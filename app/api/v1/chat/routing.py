@@ -0,0 +1,119 @@
+import random
+from typing import Optional
+
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from app.api.v1.auth.models import User
+from app.settings import settings
+from app.utils.metrics import metrics
+from app.utils.openai import model_metric
+from app.utils.tokens import estimate_message_tokens
+
+
+class ModelRoute(BaseModel):
+    """
+    Rule sending the requests it matches to ``model``. Unset conditions match anything.
+    """
+
+    model: str
+    min_prompt_tokens: int = 0
+    max_prompt_tokens: Optional[int] = None
+    context_ids: Optional[list[int]] = None
+    user_tiers: Optional[list[str]] = None
+
+    def matches(
+        self,
+        prompt_tokens: int,
+        context_id: Optional[int],
+        user_tier: Optional[str],
+    ) -> bool:
+        if prompt_tokens < self.min_prompt_tokens:
+            return False
+        if (
+            self.max_prompt_tokens is not None
+            and prompt_tokens > self.max_prompt_tokens
+        ):
+            return False
+        if self.context_ids is not None and context_id not in self.context_ids:
+            return False
+        if self.user_tiers is not None and user_tier not in self.user_tiers:
+            return False
+        return True
+
+
+# routes parsed from the current ``settings.llm_routes`` list
+_parsed_routes: tuple[Optional[list], list[ModelRoute]] = (None, [])
+
+
+def get_model_routes() -> list[ModelRoute]:
+    """
+    Get the rules of ``settings.llm_routes``, in order.
+    """
+
+    global _parsed_routes
+
+    raw_routes, routes = _parsed_routes
+    if raw_routes is not settings.llm_routes:
+        routes = [ModelRoute.model_validate(route) for route in settings.llm_routes]
+        _parsed_routes = (settings.llm_routes, routes)
+    return routes
+
+
+def is_model_over_slo(model: str) -> bool:
+    """
+    Check whether the recent p95 latency of a model exceeds ``settings.llm_latency_slo_seconds``.
+    """
+
+    if not settings.llm_latency_slo_seconds:
+        return False
+    timing = metrics.timing(model_metric(model, "latency_seconds"))
+    return (
+        timing["count"] >= settings.llm_latency_slo_min_samples
+        and timing["p95"] > settings.llm_latency_slo_seconds
+    )
+
+
+def choose_model(
+    session: Session,
+    user_id: int,
+    context_id: Optional[int],
+    messages: list[dict],
+) -> str:
+    """
+    Pick the model answering a request.
+
+    The first route of ``settings.llm_routes`` matching the estimated prompt tokens,
+    the context and the tier of the user wins, ``settings.llm_model`` otherwise. While
+    that model is slower than the latency SLO, requests go to ``settings.llm_fallback_model``,
+    except for a share of probes which keep its latency up to date.
+    """
+
+    routes = get_model_routes()
+    prompt_tokens = sum(estimate_message_tokens(message) for message in messages)
+
+    user_tier = None
+    if any(route.user_tiers is not None for route in routes):
+        user_tier = session.query(User.tier).filter(User.id == user_id).scalar()
+
+    model = next(
+        (
+            route.model
+            for route in routes
+            if route.matches(prompt_tokens, context_id, user_tier)
+        ),
+        settings.llm_model,
+    )
+
+    fallback_model = settings.llm_fallback_model
+    if (
+        fallback_model
+        and model != fallback_model
+        and is_model_over_slo(model)
+        and random.random() >= settings.llm_latency_slo_probe_rate
+    ):
+        metrics.increment(f"llm_router.{model}.fallbacks")
+        model = fallback_model
+
+    metrics.increment(f"llm_router.{model}.routed")
+    return model
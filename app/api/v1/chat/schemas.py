@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Annotated, Literal, Optional, Union
+
+from pydantic import BaseModel, Field
 
 
 class BaseChatMessage(BaseModel):
@@ -6,11 +8,16 @@ class BaseChatMessage(BaseModel):
 
 
 class SendMessageSchema(BaseChatMessage):
+    # the user's default conversation when not given
+    conversation_id: int = None
     context_id: int = None
+    # queue the reply and answer 202 with a generation job instead of waiting for it
+    background: bool = False
 
 
 class ChatMessageResponseSchema(BaseChatMessage):
     id: int
+    conversation_id: int
     sender_type: str
     timestamp: float
     updated_at: float = None
@@ -21,12 +28,46 @@ class SendMessageResponseSchema(BaseModel):
     bot_message: ChatMessageResponseSchema
 
 
+class GenerationJobResponseSchema(BaseModel):
+    job_id: int
+    status: str
+    user_message: ChatMessageResponseSchema
+    bot_message: Optional[ChatMessageResponseSchema] = None
+    error: Optional[str] = None
+
+
 class ChatHistoryResponseSchema(BaseModel):
     messages: list[ChatMessageResponseSchema]
+    has_more: bool = False
+
+
+class ChatSearchResultSchema(BaseModel):
+    message: ChatMessageResponseSchema
+    rank: float
+    # HTML-escaped fragments of the message, the matches wrapped in <mark> tags
+    highlight: str
+
+
+class ChatSearchResponseSchema(BaseModel):
+    results: list[ChatSearchResultSchema]
+    has_more: bool = False
+
+
+class ChatSyncResponseSchema(BaseModel):
+    messages: list[ChatMessageResponseSchema]
+    deleted_message_ids: list[int]
+    # watermark to send on the next sync
+    since_id: int
+    since: float
+    # with ``has_more``, send the same watermark again with the cursor
+    has_more: bool = False
+    cursor: Optional[str] = None
 
 
 class DeleteMessageSchema(BaseModel):
     message_id: int
+    # with ``delete_all``, the conversation to clear, the default one when not given
+    conversation_id: int = None
     delete_all: bool = False
 
 
@@ -34,7 +75,45 @@ class UpdateMessageSchema(BaseChatMessage):
     message_id: int
 
 
+class CreateConversationSchema(BaseModel):
+    title: Optional[str] = None
+
+
+class ConversationResponseSchema(BaseModel):
+    id: int
+    title: Optional[str] = None
+    timestamp: float
+
+
+class ConversationListResponseSchema(BaseModel):
+    conversations: list[ConversationResponseSchema]
+    has_more: bool = False
+
+
 class ChatContextPromptSchema(BaseModel):
     id: int
     title: str
     prompt: str
+    cache_responses: bool = True
+
+
+class ChatSocketSendFrame(SendMessageSchema):
+    type: Literal["send"]
+    # echoed back in the frames answering this one
+    ref: Optional[str] = None
+
+
+class ChatSocketUpdateFrame(UpdateMessageSchema):
+    type: Literal["update"]
+    ref: Optional[str] = None
+
+
+class ChatSocketDeleteFrame(DeleteMessageSchema):
+    type: Literal["delete"]
+    ref: Optional[str] = None
+
+
+ChatSocketFrame = Annotated[
+    Union[ChatSocketSendFrame, ChatSocketUpdateFrame, ChatSocketDeleteFrame],
+    Field(discriminator="type"),
+]
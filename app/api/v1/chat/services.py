@@ -1,42 +1,99 @@
+import asyncio
+import html
+import json
+import re
+from contextlib import aclosing
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+
+import anyio
+import numpy as np
 from fastapi import HTTPException, status
 from fastapi.logger import logger
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, func, insert, or_
+from sqlalchemy.orm import Session, aliased
+from starlette.concurrency import run_in_threadpool
 
+from app import constants
 from app.api.v1.auth.models import User
-from app.api.v1.chat.models import ChatContextPrompt, ChatMessage, SenderType
+from app.api.v1.chat import memory, summaries
+from app.api.v1.chat.cache import context_prompt_cache
+from app.api.v1.chat.models import (
+    ChatGenerationJob,
+    ChatMessage,
+    ChatMessageTombstone,
+    Conversation,
+    SenderType,
+)
+from app.api.v1.chat.response_cache import (
+    ResponseCache,
+    get_cached_response,
+    get_response_cache,
+    make_response_cache_key,
+)
+from app.api.v1.chat.routing import choose_model
 from app.api.v1.chat.schemas import (
     ChatContextPromptSchema,
     ChatHistoryResponseSchema,
     ChatMessageResponseSchema,
+    ChatSearchResponseSchema,
+    ChatSearchResultSchema,
+    ChatSyncResponseSchema,
+    ConversationListResponseSchema,
+    ConversationResponseSchema,
+    GenerationJobResponseSchema,
     SendMessageResponseSchema,
 )
+from app.api.v1.chat.write_buffer import chat_message_write_buffer, insert_chat_messages
 from app.constants import SYSTEM_CHATBOT_PROMPT
 from app.settings import settings
-from app.utils.openai import get_response_from_gpt_with_context
+from app.utils.metrics import metrics
+from app.utils.openai import (
+    async_get_response_from_gpt_with_context,
+    async_stream_response_from_gpt_with_context,
+)
+from app.utils.resilience import CircuitOpenError
+from app.utils.singleflight import SingleFlight
+from app.utils.tokens import estimate_message_tokens, estimate_tokens
+
+llm_single_flight = SingleFlight("llm_single_flight")
 
 
-def generate_response_using_gpt(
+def build_chat_context_messages(
     session: Session,
     user_id: int,
+    conversation_id: int,
     context_id: int = None,
-) -> str:
+    token_budget: int = None,
+    query_vector: Optional[np.ndarray] = None,
+    unsaved_message: Optional[str] = None,
+) -> list[dict]:
     """
-    Generate a response using GPT-3. Send chat history to GPT-3 and get a response.
+    Build the list of messages (system prompt + conversation history) sent to GPT-3.
+
+    The system prompt is always included, followed by the running summary of older
+    messages when there is one. Chat history after the summary is then read backwards from
+    the newest message, one batch at a time, until the token budget is spent, so the
+    work done is bounded by the budget and not by the size of the history. The
+    newest message is always included, even if it does not fit the budget.
+
+    An ``unsaved_message`` is a user message not saved yet; it is added as the
+    newest message.
+
+    With a ``query_vector`` (chat memory), only the newest
+    ``chat_memory_tail_messages`` are read, and the older messages most similar to
+    the query are added before them while the budget allows.
     """
 
-    chat_history = (
-        session.query(ChatMessage)
-        .filter(ChatMessage.user_id == user_id)
-        .order_by(ChatMessage.id.asc())
-        .all()
-    )
+    if token_budget is None:
+        token_budget = settings.chat_context_token_budget
 
     system_prompt = SYSTEM_CHATBOT_PROMPT
 
     if context_id:
-        chat_context = ChatContextPrompt.get(session, context_id)
-        if chat_context:
-            system_prompt = chat_context.prompt
+        system_prompt = (
+            context_prompt_cache.get_prompt(session, context_id) or system_prompt
+        )
 
     system_context = [
         {
@@ -45,146 +102,951 @@ def generate_response_using_gpt(
         },
     ]
 
-    messages = [
-        {
-            "role": "assistant" if message.sender_type == SenderType.SYSTEM else "user",
-            "content": message.message,
-        }
-        for message in chat_history
-    ]
+    chat_summary = summaries.get_chat_summary(session, conversation_id)
+    if chat_summary:
+        system_context.append(
+            {
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{chat_summary.summary}",
+            },
+        )
+
+    remaining_tokens = token_budget - sum(
+        estimate_message_tokens(message) for message in system_context
+    )
+
+    query = (
+        session.query(ChatMessage.id, ChatMessage.sender_type, ChatMessage.message)
+        .filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.conversation_id == conversation_id,
+        )
+        .order_by(ChatMessage.id.desc())
+    )
+    if chat_summary:
+        query = query.filter(ChatMessage.id > chat_summary.last_message_id)
 
-    return get_response_from_gpt_with_context(messages=system_context + messages)
+    max_messages = None
+    if query_vector is not None:
+        max_messages = settings.chat_memory_tail_messages
 
+    messages = []
+    if unsaved_message is not None:
+        context_message = {"role": "user", "content": unsaved_message}
+        remaining_tokens -= estimate_message_tokens(context_message)
+        messages.append(context_message)
 
-def generate_system_response(
+    oldest_id = None
+    before_id = None
+    budget_spent = False
+    while not budget_spent:
+        batch_query = query
+        if before_id is not None:
+            batch_query = batch_query.filter(ChatMessage.id < before_id)
+        batch = batch_query.limit(constants.CHAT_CONTEXT_BATCH_SIZE).all()
+
+        for message in batch:
+            context_message = {
+                "role": (
+                    "assistant" if message.sender_type == SenderType.SYSTEM else "user"
+                ),
+                "content": message.message,
+            }
+            message_tokens = estimate_message_tokens(context_message)
+            if (message_tokens > remaining_tokens and messages) or (
+                max_messages is not None and len(messages) >= max_messages
+            ):
+                budget_spent = True
+                break
+            remaining_tokens -= message_tokens
+            messages.append(context_message)
+            oldest_id = message.id
+
+        if len(batch) < constants.CHAT_CONTEXT_BATCH_SIZE:
+            break
+        before_id = batch[-1].id
+
+    if query_vector is not None and oldest_id is not None:
+        lines = []
+        for message in memory.recall_chat_messages(
+            session,
+            user_id,
+            conversation_id,
+            query_vector,
+            before_id=oldest_id,
+        ):
+            sender = "Assistant" if message.sender_type == SenderType.SYSTEM else "User"
+            line = f"{sender}: {message.message}"
+            line_tokens = estimate_tokens(line)
+            if line_tokens > remaining_tokens:
+                continue
+            remaining_tokens -= line_tokens
+            lines.append(line)
+        if lines:
+            system_context.append(
+                {
+                    "role": "system",
+                    "content": "Relevant earlier messages:\n" + "\n".join(lines),
+                },
+            )
+
+    return system_context + messages[::-1]
+
+
+def make_chat_message_row(
+    user_id: int,
+    conversation_id: int,
+    sender_type: SenderType,
+    message: str,
+) -> dict:
+    """
+    Make the row of a chat message to save with ``save_chat_messages``.
+    """
+
+    return {
+        "sender_type": sender_type,
+        "user_id": user_id,
+        "conversation_id": conversation_id,
+        "message": message,
+    }
+
+
+async def save_chat_messages(
+    session: Session,
+    rows: list[dict],
+) -> list[ChatMessageResponseSchema]:
+    """
+    Save chat messages with one multi-row insert and return their response schemas.
+
+    When the worker's write buffer runs, the insert is group-committed with the
+    saves of other requests, otherwise it is committed on ``session``.
+    """
+
+    if chat_message_write_buffer.running:
+        chat_messages = await chat_message_write_buffer.save(rows)
+    else:
+        chat_messages = await run_in_threadpool(insert_chat_messages, session, rows)
+
+    return [chat_message_to_schema(chat_message) for chat_message in chat_messages]
+
+
+def load_chat_context_messages(
     session: Session,
     user_id: int,
+    conversation_id: int,
+    context_id: int = None,
+    query_vector: Optional[np.ndarray] = None,
+    unsaved_message: Optional[str] = None,
+) -> tuple[list[dict], Optional[ResponseCache], str]:
+    """
+    Build the context messages, resolve the response cache and pick the model, then
+    end the read transaction, so that the pooled connection is not held while waiting
+    for the LLM.
+    """
+
+    messages = build_chat_context_messages(
+        session=session,
+        user_id=user_id,
+        conversation_id=conversation_id,
+        context_id=context_id,
+        query_vector=query_vector,
+        unsaved_message=unsaved_message,
+    )
+    response_cache = get_response_cache(session, context_id)
+    model = choose_model(session, user_id, context_id, messages)
+    session.commit()
+
+    return messages, response_cache, model
+
+
+async def generate_response_using_gpt(
+    session: Session,
+    user_id: int,
+    conversation_id: int,
+    context_id: int = None,
+    message: str = None,
+    message_saved: bool = True,
+) -> str:
+    """
+    Generate a response using GPT-3. Send chat history to GPT-3 and get a response.
+
+    Identical prompts are answered from the response cache when it is enabled, and
+    identical in-flight requests of the same user (same conversation, chat context
+    and message) are coalesced into one LLM call.
+    With chat memory enabled, older messages relevant to ``message`` are recalled.
+    Unless ``message_saved``, ``message`` is not in the history yet and is added
+    to the context.
+    """
+
+    query_vector = await memory.embed_query(message)
+
+    messages, response_cache, model = await run_in_threadpool(
+        load_chat_context_messages,
+        session=session,
+        user_id=user_id,
+        conversation_id=conversation_id,
+        context_id=context_id,
+        query_vector=query_vector,
+        unsaved_message=None if message_saved else message,
+    )
+
+    cache_key = make_response_cache_key(model, messages)
+
+    if response_cache is not None:
+        response = await get_cached_response(response_cache, session, cache_key)
+        if response is not None:
+            return response
+
+    # concurrent identical requests of a user (double submits, several tabs) share
+    # one upstream call; keyed on the request, as the context of the second one may
+    # already hold the first one's message
+    response = await llm_single_flight.do(
+        (user_id, conversation_id, context_id, message),
+        lambda: async_get_response_from_gpt_with_context(
+            messages=messages,
+            user_id=user_id,
+            model=model,
+        ),
+    )
+
+    if response_cache is not None:
+        await response_cache.set(session, cache_key, response)
+
+    return response
+
+
+async def generate_system_response(
+    session: Session,
+    user_id: int,
+    conversation_id: int,
     message: str,
     context_id: int = None,
+    message_saved: bool = True,
 ) -> str:
     """
     Generate a system response.
+
+    Falls back to the echo response when the LLM is disabled or its circuit is open.
     """
 
-    if settings.is_openai_enabled:
-        return generate_response_using_gpt(
-            session=session,
-            user_id=user_id,
-            context_id=context_id,
-        )
+    if settings.is_llm_enabled:
+        try:
+            return await generate_response_using_gpt(
+                session=session,
+                user_id=user_id,
+                conversation_id=conversation_id,
+                context_id=context_id,
+                message=message,
+                message_saved=message_saved,
+            )
+        except CircuitOpenError:
+            metrics.increment("llm.fallbacks")
 
     return f"System says: {message}"
 
 
-def process_response_for_chat_message(
-    message: ChatMessage,
+async def stream_system_response(
     session: Session,
+    user_id: int,
+    conversation_id: int,
+    message: str,
     context_id: int = None,
-) -> ChatMessageResponseSchema:
+) -> AsyncIterator[str]:
     """
-    Process a chat message response.
+    Stream a system response token by token.
+
+    Falls back to streaming the echo response word by word when the LLM is disabled or
+    its circuit is open.
     """
 
-    system_message = ChatMessage(
-        sender_type=SenderType.SYSTEM,
-        user_id=message.user_id,
-        message=generate_system_response(
+    if settings.is_llm_enabled:
+        query_vector = await memory.embed_query(message)
+        messages, response_cache, model = await run_in_threadpool(
+            load_chat_context_messages,
             session=session,
-            user_id=message.user_id,
-            message=message.message,
+            user_id=user_id,
+            conversation_id=conversation_id,
             context_id=context_id,
-        ),
-    )
+            query_vector=query_vector,
+        )
 
-    session.add(system_message)
-    session.commit()
+        cache_key = None
+        if response_cache is not None:
+            cache_key = make_response_cache_key(model, messages)
+            response = await get_cached_response(response_cache, session, cache_key)
+            if response is not None:
+                yield response
+                return
 
-    session.refresh(system_message)
+        tokens = []
+        try:
+            async with aclosing(
+                async_stream_response_from_gpt_with_context(
+                    messages=messages,
+                    user_id=user_id,
+                    model=model,
+                ),
+            ) as llm_tokens:
+                async for token in llm_tokens:
+                    tokens.append(token)
+                    yield token
+        except CircuitOpenError:
+            # raised before the first token, the echo can take over
+            metrics.increment("llm.fallbacks")
+        else:
+            if response_cache is not None:
+                await response_cache.set(session, cache_key, "".join(tokens))
+            return
 
-    timestamp = system_message.created_at.timestamp()
+    for token in re.findall(r"\S+\s*", f"System says: {message}"):
+        yield token
+
+
+def chat_message_to_schema(message: ChatMessage) -> ChatMessageResponseSchema:
+    """
+    Convert a chat message model to its response schema.
+    """
 
     return ChatMessageResponseSchema(
-        id=system_message.id,
-        sender_type=system_message.sender_type.value,
-        message=system_message.message,
-        timestamp=timestamp,
+        id=message.id,
+        conversation_id=message.conversation_id,
+        sender_type=message.sender_type.value,
+        message=message.message,
+        timestamp=message.created_at.timestamp(),
+        updated_at=message.updated_at.timestamp() if message.updated_at else None,
     )
 
 
-def receive_chatbot_message(
-    user: User,
+def format_sse_event(event: str, data: dict) -> str:
+    """
+    Format a Server-Sent Event.
+    """
+
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def receive_chatbot_message(
+    user_id: int,
+    conversation_id: int,
     message: str,
     session: Session,
     context_id: int = None,
 ) -> SendMessageResponseSchema:
     """
     Receive a message from the chatbot.
+
+    The reply is generated first, with the message added to the context, and only
+    then are both saved, in one statement. Reads end their transaction before the
+    LLM call, so no transaction or pooled connection is held while waiting for it,
+    and database work runs in the threadpool while the LLM call is awaited on the
+    event loop. A message whose reply fails or is cancelled is saved alone, as the
+    streaming paths save it before the reply.
     """
     log_prefix = "[Chatbot Message]"
     logger.info(
         f"{log_prefix} Attempting to send message: {message}",
     )
 
+    try:
+        reply = await generate_system_response(
+            session=session,
+            user_id=user_id,
+            conversation_id=conversation_id,
+            message=message,
+            context_id=context_id,
+            message_saved=False,
+        )
+    except BaseException:
+        logger.info(f"{log_prefix} Saving message without a reply")
+        with anyio.CancelScope(shield=True):
+            await run_in_threadpool(session.rollback)
+            await save_chat_messages(
+                session,
+                [
+                    make_chat_message_row(
+                        user_id,
+                        conversation_id,
+                        SenderType.USER,
+                        message,
+                    ),
+                ],
+            )
+        raise
+
+    # both messages in one statement
+    user_message, bot_message = await save_chat_messages(
+        session,
+        [
+            make_chat_message_row(user_id, conversation_id, SenderType.USER, message),
+            make_chat_message_row(user_id, conversation_id, SenderType.SYSTEM, reply),
+        ],
+    )
+
+    return SendMessageResponseSchema(
+        user_message=user_message,
+        bot_message=bot_message,
+    )
+
+
+async def stream_chatbot_events(
+    user_id: int,
+    conversation_id: int,
+    message: str,
+    session: Session,
+    context_id: int = None,
+) -> AsyncIterator[tuple[str, dict]]:
+    """
+    Receive a message from the user and stream the chatbot reply as events.
+
+    The user message is saved before streaming starts. Every token is sent as a
+    ``token`` event, and once the stream ends the system message is saved and a
+    ``done`` event carrying the ``SendMessageResponseSchema`` is sent. If the client
+    goes away, the stream is cancelled or closed, and with it the LLM call; the
+    tokens received so far are saved only with
+    ``settings.chat_store_partial_replies``.
+
+    Events are ``(event, data)`` pairs, formatted by the transport: Server-Sent
+    Events or WebSocket frames.
+    """
+    log_prefix = "[Chatbot Stream]"
+    logger.info(
+        f"{log_prefix} Attempting to stream message: {message}",
+    )
+
+    (user_message,) = await save_chat_messages(
+        session,
+        [make_chat_message_row(user_id, conversation_id, SenderType.USER, message)],
+    )
+
+    async def events() -> AsyncIterator[tuple[str, dict]]:
+        tokens = []
+        try:
+            # closed right away on disconnect, releasing the LLM call and its slot
+            async with aclosing(
+                stream_system_response(
+                    session=session,
+                    user_id=user_id,
+                    conversation_id=conversation_id,
+                    message=message,
+                    context_id=context_id,
+                ),
+            ) as system_tokens:
+                async for token in system_tokens:
+                    tokens.append(token)
+                    yield "token", {"token": token}
+
+            (bot_message,) = await save_chat_messages(
+                session,
+                [
+                    make_chat_message_row(
+                        user_id,
+                        conversation_id,
+                        SenderType.SYSTEM,
+                        "".join(tokens),
+                    ),
+                ],
+            )
+
+            response = SendMessageResponseSchema(
+                user_message=user_message,
+                bot_message=bot_message,
+            )
+            yield "done", response.model_dump()
+        except (asyncio.CancelledError, GeneratorExit):
+            # the client disconnected, the LLM call was cancelled with the stream
+            metrics.increment("chat.stream.cancelled")
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(session.rollback)
+                if tokens and settings.chat_store_partial_replies:
+                    logger.info(f"{log_prefix} Saving partial reply after disconnect")
+                    await save_chat_messages(
+                        session,
+                        [
+                            make_chat_message_row(
+                                user_id,
+                                conversation_id,
+                                SenderType.SYSTEM,
+                                "".join(tokens),
+                            ),
+                        ],
+                    )
+            raise
+        except Exception as e:
+            logger.exception(f"{log_prefix} {e}")
+            await run_in_threadpool(session.rollback)
+            yield "error", {"detail": str(e)}
+
+    return events()
+
+
+async def stream_chatbot_message(
+    user_id: int,
+    conversation_id: int,
+    message: str,
+    session: Session,
+    context_id: int = None,
+) -> AsyncIterator[str]:
+    """
+    Receive a message from the user and stream the chatbot reply as Server-Sent
+    Events, see ``stream_chatbot_events``. The session is closed once the stream
+    ends.
+    """
+
+    events = await stream_chatbot_events(
+        user_id=user_id,
+        conversation_id=conversation_id,
+        message=message,
+        session=session,
+        context_id=context_id,
+    )
+
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            async with aclosing(events):
+                async for event, data in events:
+                    yield format_sse_event(event, data)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(session.close)
+
+    return event_stream()
+
+
+def create_generation_job(
+    session: Session,
+    user_id: int,
+    conversation_id: int,
+    message: str,
+    context_id: int = None,
+) -> GenerationJobResponseSchema:
+    """
+    Save a user message and queue the generation of its reply.
+    """
+
     chat_message = ChatMessage(
         sender_type=SenderType.USER,
-        user_id=user.id,
+        user_id=user_id,
+        conversation_id=conversation_id,
         message=message,
     )
-
     session.add(chat_message)
+    session.flush()
+
+    job = ChatGenerationJob(
+        user_id=user_id,
+        message_id=chat_message.id,
+        context_id=context_id,
+    )
+    session.add(job)
     session.commit()
 
-    bot_message = process_response_for_chat_message(
-        message=chat_message,
+    return GenerationJobResponseSchema(
+        job_id=job.id,
+        status=job.status.value,
+        user_message=chat_message_to_schema(chat_message),
+    )
+
+
+async def enqueue_chatbot_message(
+    user_id: int,
+    conversation_id: int,
+    message: str,
+    session: Session,
+    context_id: int = None,
+) -> GenerationJobResponseSchema:
+    """
+    Receive a message and leave the reply to the background generation workers.
+    """
+    log_prefix = "[Chatbot Job]"
+    logger.info(
+        f"{log_prefix} Attempting to queue message: {message}",
+    )
+
+    return await run_in_threadpool(
+        create_generation_job,
         session=session,
+        user_id=user_id,
+        conversation_id=conversation_id,
+        message=message,
         context_id=context_id,
     )
 
-    user_message = ChatMessageResponseSchema(
-        id=chat_message.id,
-        sender_type=chat_message.sender_type.value,
-        message=chat_message.message,
-        timestamp=chat_message.created_at.timestamp(),
+
+def get_generation_job(
+    session: Session,
+    user_id: int,
+    job_id: int,
+) -> GenerationJobResponseSchema:
+    """
+    Get the status of a generation job, and its reply once it is done.
+    """
+
+    job = (
+        session.query(ChatGenerationJob)
+        .filter(ChatGenerationJob.id == job_id, ChatGenerationJob.user_id == user_id)
+        .first()
+    )
+
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found.",
+        )
+
+    user_message = ChatMessage.get(session, job.message_id)
+    bot_message = (
+        ChatMessage.get(session, job.result_message_id)
+        if job.result_message_id
+        else None
     )
 
-    return SendMessageResponseSchema(
-        user_message=user_message,
-        bot_message=bot_message,
+    response = GenerationJobResponseSchema(
+        job_id=job.id,
+        status=job.status.value,
+        user_message=chat_message_to_schema(user_message),
+        bot_message=chat_message_to_schema(bot_message) if bot_message else None,
+        error=job.error,
     )
 
+    # end the read transaction, long-polling clients call this repeatedly
+    session.commit()
+
+    return response
+
 
 def get_chat_history(
     user: User,
     session: Session,
+    conversation_id: Optional[int],
+    limit: int = constants.CHAT_HISTORY_DEFAULT_PAGE_SIZE,
+    before_id: int = None,
+    after_id: int = None,
 ) -> ChatHistoryResponseSchema:
     """
-    Get chat history.
+    Get a page of the history of a conversation.
+
+    Pages are keyset-paginated on the message id: ``before_id`` returns the newest
+    messages older than it, ``after_id`` the oldest messages newer than it, and no
+    cursor returns the newest page. Messages are always returned oldest first.
     """
     log_prefix = "[Chat History]"
     logger.info(
         f"{log_prefix} Attempting to get chat history for user: {user.email}",
     )
 
+    if before_id is not None and after_id is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only one of before_id and after_id can be given.",
+        )
+
+    query = session.query(ChatMessage).filter(
+        ChatMessage.user_id == user.id,
+        ChatMessage.conversation_id == conversation_id,
+    )
+
+    if after_id is not None:
+        query = query.filter(ChatMessage.id > after_id).order_by(ChatMessage.id.asc())
+    else:
+        if before_id is not None:
+            query = query.filter(ChatMessage.id < before_id)
+        query = query.order_by(ChatMessage.id.desc())
+
+    # fetch one extra row to know whether there is another page
+    chat_messages = query.limit(limit + 1).all()
+    has_more = len(chat_messages) > limit
+    chat_messages = chat_messages[:limit]
+
+    if after_id is None:
+        chat_messages.reverse()
+
+    return ChatHistoryResponseSchema(
+        messages=[chat_message_to_schema(message) for message in chat_messages],
+        has_more=has_more,
+    )
+
+
+def render_search_highlight(headline: str) -> str:
+    """
+    HTML-escape a ``ts_headline`` and wrap its matches in ``<mark>`` tags.
+    """
+
+    return (
+        html.escape(headline)
+        .replace(constants.CHAT_SEARCH_HEADLINE_START, "<mark>")
+        .replace(constants.CHAT_SEARCH_HEADLINE_STOP, "</mark>")
+    )
+
+
+def search_chat_history(
+    user_id: int,
+    session: Session,
+    query: str,
+    limit: int = constants.CHAT_SEARCH_DEFAULT_PAGE_SIZE,
+    offset: int = 0,
+) -> ChatSearchResponseSchema:
+    """
+    Full-text search the user's chat messages, best matches first.
+
+    ``query`` uses the web search syntax ("quoted phrases", OR, -excluded). One
+    query finds the matches through the GIN index on ``message_tsv``, ranks them,
+    and highlights only the messages of the requested page. Highlights are
+    HTML-escaped, so they can be rendered as HTML.
+    """
+
+    ts_query = func.websearch_to_tsquery(constants.CHAT_SEARCH_TEXT_CONFIG, query)
+    rank = func.ts_rank_cd(ChatMessage.message_tsv, ts_query)
+
+    # fetch one extra row to know whether there is another page
+    page = (
+        session.query(ChatMessage, rank.label("rank"))
+        .filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.message_tsv.bool_op("@@")(ts_query),
+        )
+        .order_by(rank.desc(), ChatMessage.id.desc())
+        .limit(limit + 1)
+        .offset(offset)
+        .subquery()
+    )
+    page_message = aliased(ChatMessage, page)
+
+    rows = (
+        session.query(
+            page_message,
+            page.c.rank,
+            func.ts_headline(
+                constants.CHAT_SEARCH_TEXT_CONFIG,
+                # messages cannot fake a match
+                func.translate(
+                    page.c.message,
+                    constants.CHAT_SEARCH_HEADLINE_START
+                    + constants.CHAT_SEARCH_HEADLINE_STOP,
+                    "",
+                ),
+                ts_query,
+                constants.CHAT_SEARCH_HEADLINE_OPTIONS,
+            ),
+        )
+        .order_by(page.c.rank.desc(), page.c.id.desc())
+        .all()
+    )
+
+    return ChatSearchResponseSchema(
+        results=[
+            ChatSearchResultSchema(
+                message=chat_message_to_schema(message),
+                rank=rank,
+                highlight=render_search_highlight(highlight),
+            )
+            for message, rank, highlight in rows[:limit]
+        ],
+        has_more=len(rows) > limit,
+    )
+
+
+def get_chat_history_version(
+    session: Session,
+    user_id: int,
+    conversation_id: Optional[int],
+) -> tuple:
+    """
+    Get a version of the conversation's history that changes on every send, update
+    and delete. Each part is a single index lookup, so no message rows are loaded.
+    Deletes are tracked per user, they change the version of every conversation.
+    """
+
+    last_id, last_updated_at = (
+        session.query(
+            func.max(ChatMessage.id),
+            func.max(ChatMessage.updated_at),
+        )
+        .filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.conversation_id == conversation_id,
+        )
+        .one()
+    )
+
+    last_deleted_at = (
+        session.query(func.max(ChatMessageTombstone.created_at))
+        .filter(ChatMessageTombstone.user_id == user_id)
+        .scalar()
+    )
+
+    return last_id, last_updated_at, last_deleted_at
+
+
+def get_tombstone_cutoff() -> datetime:
+    """
+    Get the time before which deletes are no longer synced, and their tombstones
+    are pruned.
+    """
+
+    return datetime.now() - timedelta(days=settings.chat_tombstone_retention_days)
+
+
+def sync_watermark_to_datetime(since: float) -> datetime:
+    """
+    Convert a sync watermark to the naive datetimes of the timestamp columns. Both
+    ways read them as UTC, so watermarks do not depend on the timezone of the host.
+    """
+
+    return datetime.fromtimestamp(since, tz=timezone.utc).replace(tzinfo=None)
+
+
+def datetime_to_sync_watermark(value: datetime) -> float:
+    """
+    Convert a naive datetime of a timestamp column to a sync watermark, see
+    ``sync_watermark_to_datetime``.
+    """
+
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def encode_sync_cursor(
+    after_id: int,
+    after_tombstone_id: int,
+    since_id: int,
+    since: float,
+) -> str:
+    """
+    Build the cursor of the next sync page: where the messages and deletes stopped,
+    and the watermark of the pages so far.
+    """
+
+    return f"{after_id}:{after_tombstone_id}:{since_id}:{since!r}"
+
+
+def decode_sync_cursor(cursor: str) -> tuple[int, int, int, float]:
+    """
+    Parse a cursor of ``encode_sync_cursor``.
+    """
+
+    try:
+        after_id, after_tombstone_id, since_id, since = cursor.split(":")
+        return int(after_id), int(after_tombstone_id), int(since_id), float(since)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid sync cursor.",
+        )
+
+
+def sync_chat_history(
+    user: User,
+    session: Session,
+    since_id: int = 0,
+    since: float = None,
+    limit: int = constants.CHAT_SYNC_DEFAULT_PAGE_SIZE,
+    cursor: str = None,
+) -> ChatSyncResponseSchema:
+    """
+    Get the chat history changes after a client watermark.
+
+    Returns messages newer than ``since_id``, messages updated after ``since`` and
+    the ids of messages deleted after ``since``, together with the watermark to
+    send on the next sync. Deletes are only tracked by time, so ``since`` is
+    required once ``since_id`` is given; the first sync sends neither. Changes come
+    in pages of at most ``limit`` messages and ``limit`` deletes: while ``has_more``
+    is set, the same watermark is sent again with the returned ``cursor``, and the
+    watermark of the last page is kept.
+
+    Deletes are only kept for ``settings.chat_tombstone_retention_days``, so older
+    watermarks are refused with a 410 and the client has to reload its history.
+    """
+    log_prefix = "[Chat Sync]"
+    logger.info(
+        f"{log_prefix} Attempting to sync chat history for user: {user.email}",
+    )
+
+    if since_id and since is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="since is required with since_id.",
+        )
+
+    since_datetime = sync_watermark_to_datetime(since) if since is not None else None
+    if since_datetime is not None and since_datetime < get_tombstone_cutoff():
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Sync watermark is too old, reload the chat history.",
+        )
+
+    after_id, after_tombstone_id, next_since_id, next_since = 0, 0, since_id, since or 0
+    if cursor is not None:
+        after_id, after_tombstone_id, next_since_id, next_since = decode_sync_cursor(
+            cursor,
+        )
+
+    changed_filter = ChatMessage.id > since_id
+    if since_datetime is not None:
+        changed_filter = or_(changed_filter, ChatMessage.updated_at > since_datetime)
+
+    # fetch one extra row to know whether there is another page
     chat_messages = (
         session.query(ChatMessage)
-        .filter(ChatMessage.user_id == user.id)
+        .filter(
+            ChatMessage.user_id == user.id,
+            changed_filter,
+            ChatMessage.id > after_id,
+        )
         .order_by(ChatMessage.id.asc())
+        .limit(limit + 1)
         .all()
     )
 
-    chat_history = [
-        ChatMessageResponseSchema(
-            id=message.id,
-            sender_type=message.sender_type.value,
-            message=message.message,
-            timestamp=message.created_at.timestamp(),
-            updated_at=message.updated_at.timestamp() if message.updated_at else None,
+    tombstones = []
+    if since_datetime is not None:
+        tombstones = (
+            session.query(
+                ChatMessageTombstone.id,
+                ChatMessageTombstone.message_id,
+                ChatMessageTombstone.created_at,
+            )
+            .filter(
+                ChatMessageTombstone.user_id == user.id,
+                ChatMessageTombstone.created_at > since_datetime,
+                ChatMessageTombstone.id > after_tombstone_id,
+            )
+            .order_by(ChatMessageTombstone.id.asc())
+            .limit(limit + 1)
+            .all()
         )
-        for message in chat_messages
-    ]
 
-    return ChatHistoryResponseSchema(
-        messages=chat_history,
+    has_more = len(chat_messages) > limit or len(tombstones) > limit
+    chat_messages = chat_messages[:limit]
+    tombstones = tombstones[:limit]
+
+    messages = [chat_message_to_schema(message) for message in chat_messages]
+    next_since_id = max([next_since_id] + [message.id for message in messages])
+    next_since = max(
+        [next_since]
+        + [
+            datetime_to_sync_watermark(message.updated_at or message.created_at)
+            for message in chat_messages
+        ]
+        + [
+            datetime_to_sync_watermark(tombstone.created_at) for tombstone in tombstones
+        ],
+    )
+
+    return ChatSyncResponseSchema(
+        messages=messages,
+        deleted_message_ids=[tombstone.message_id for tombstone in tombstones],
+        since_id=next_since_id,
+        since=next_since,
+        has_more=has_more,
+        cursor=(
+            encode_sync_cursor(
+                messages[-1].id if messages else after_id,
+                tombstones[-1].id if tombstones else after_tombstone_id,
+                next_since_id,
+                next_since,
+            )
+            if has_more
+            else None
+        ),
     )
 
 
@@ -193,25 +1055,55 @@ def delete_chat_history(
     message_id: int,
     delete_all: bool,
     session: Session,
+    conversation_id: Optional[int] = None,
 ) -> ChatHistoryResponseSchema:
     """
-    Delete chat history.
+    Delete a chat message, or with ``delete_all`` every message of the conversation.
+    Returns the newest page of the remaining history of the conversation.
     """
     log_prefix = "[Chat History]"
     logger.info(
         f"{log_prefix} Attempting to delete chat history for user: {user.email}",
     )
 
+    statement = delete(ChatMessage).where(ChatMessage.user_id == user.id)
+
     if delete_all:
-        session.query(ChatMessage).filter(ChatMessage.user_id == user.id).delete()
+        statement = statement.where(ChatMessage.conversation_id == conversation_id)
     else:
-        session.query(ChatMessage).filter(ChatMessage.id == message_id).delete()
+        statement = statement.where(ChatMessage.id == message_id)
+
+    deleted = session.execute(
+        statement.returning(ChatMessage.id, ChatMessage.conversation_id),
+    ).all()
+
+    if deleted:
+        conversation_id = deleted[0].conversation_id
+        summaries.invalidate_chat_summary(
+            session,
+            conversation_id,
+            None if delete_all else message_id,
+        )
+
+        # keep tombstones so that syncing clients learn about the deletes
+        session.execute(
+            insert(ChatMessageTombstone),
+            [
+                {"user_id": user.id, "message_id": deleted_id}
+                for deleted_id, _ in deleted
+            ],
+        )
+        session.query(ChatMessageTombstone).filter(
+            ChatMessageTombstone.user_id == user.id,
+            ChatMessageTombstone.created_at < get_tombstone_cutoff(),
+        ).delete(synchronize_session=False)
 
     session.commit()
 
     return get_chat_history(
         user=user,
         session=session,
+        conversation_id=conversation_id,
     )
 
 
@@ -222,7 +1114,7 @@ def update_chat_message(
     session: Session,
 ) -> ChatHistoryResponseSchema:
     """
-    Update chat history.
+    Update a chat message. Returns a page holding only the updated message.
     """
     log_prefix = "[Chat History]"
     logger.info(
@@ -230,7 +1122,9 @@ def update_chat_message(
     )
 
     chat_message = (
-        session.query(ChatMessage).filter(ChatMessage.id == message_id).first()
+        session.query(ChatMessage)
+        .filter(ChatMessage.user_id == user.id, ChatMessage.id == message_id)
+        .first()
     )
 
     if not chat_message:
@@ -240,15 +1134,154 @@ def update_chat_message(
         )
 
     chat_message.message = new_message
+    summaries.invalidate_chat_summary(
+        session,
+        chat_message.conversation_id,
+        message_id,
+    )
+    memory.invalidate_chat_message_embedding(session, message_id)
 
     session.commit()
 
-    return get_chat_history(
-        user=user,
-        session=session,
+    return ChatHistoryResponseSchema(
+        messages=[chat_message_to_schema(chat_message)],
     )
 
 
+def conversation_to_schema(conversation: Conversation) -> ConversationResponseSchema:
+    """
+    Convert a conversation model to its response schema.
+    """
+
+    return ConversationResponseSchema(
+        id=conversation.id,
+        title=conversation.title,
+        timestamp=conversation.created_at.timestamp(),
+    )
+
+
+def resolve_conversation_id(
+    session: Session,
+    user_id: int,
+    conversation_id: int = None,
+    create: bool = True,
+) -> Optional[int]:
+    """
+    Get the id of the conversation to work in.
+
+    A given ``conversation_id`` must belong to the user. Without one, the user's
+    default (oldest) conversation is used, and created on first use unless
+    ``create`` is off, in which case ``None`` is returned. Concurrent first uses
+    are serialized on the user's row, so only one default conversation is created.
+    """
+
+    if conversation_id is not None:
+        conversation = (
+            session.query(Conversation.id)
+            .filter(
+                Conversation.id == conversation_id,
+                Conversation.user_id == user_id,
+            )
+            .first()
+        )
+        if not conversation:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Conversation not found.",
+            )
+        return conversation_id
+
+    def get_default_id() -> Optional[int]:
+        return (
+            session.query(func.min(Conversation.id))
+            .filter(Conversation.user_id == user_id)
+            .scalar()
+        )
+
+    default_id = get_default_id()
+    if default_id is None and create:
+        session.query(User.id).filter(User.id == user_id).with_for_update().one()
+        # another request may have created it while we waited for the lock
+        default_id = get_default_id()
+        if default_id is None:
+            conversation = Conversation(user_id=user_id)
+            session.add(conversation)
+            session.flush()
+            default_id = conversation.id
+        session.commit()
+
+    return default_id
+
+
+def resolve_send_conversation_id(
+    session: Session,
+    user_id: int,
+    conversation_id: int = None,
+) -> int:
+    """
+    Resolve the conversation a message is sent to, see ``resolve_conversation_id``,
+    and end the read transaction, which would otherwise stay open while the reply
+    is generated.
+    """
+
+    conversation_id = resolve_conversation_id(session, user_id, conversation_id)
+    session.commit()
+
+    return conversation_id
+
+
+def create_conversation(
+    user_id: int,
+    session: Session,
+    title: str = None,
+) -> ConversationResponseSchema:
+    """
+    Start a new conversation.
+    """
+
+    conversation = Conversation(user_id=user_id, title=title)
+    session.add(conversation)
+    session.commit()
+
+    return conversation_to_schema(conversation)
+
+
+def list_conversations(
+    user_id: int,
+    session: Session,
+    limit: int = constants.CONVERSATIONS_DEFAULT_PAGE_SIZE,
+    before_id: int = None,
+) -> ConversationListResponseSchema:
+    """
+    Get a page of the user's conversations, newest first, keyset-paginated on the
+    conversation id.
+    """
+
+    query = session.query(Conversation).filter(Conversation.user_id == user_id)
+    if before_id is not None:
+        query = query.filter(Conversation.id < before_id)
+
+    # fetch one extra row to know whether there is another page
+    conversations = query.order_by(Conversation.id.desc()).limit(limit + 1).all()
+
+    return ConversationListResponseSchema(
+        conversations=[
+            conversation_to_schema(conversation)
+            for conversation in conversations[:limit]
+        ],
+        has_more=len(conversations) > limit,
+    )
+
+
+def get_chat_context_prompts_version(session: Session) -> tuple:
+    """
+    Get a version of the chat context prompts that changes when any prompt is
+    added, edited or removed.
+    """
+
+    return context_prompt_cache.get_version(session)
+
+
 def get_chat_context_prompts(
     session: Session,
 ) -> list[ChatContextPromptSchema]:
@@ -260,13 +1293,4 @@ def get_chat_context_prompts(
         f"{log_prefix} Attempting to get chat context prompts.",
     )
 
-    contexts = session.query(ChatContextPrompt).all()
-
-    return [
-        ChatContextPromptSchema(
-            id=context.id,
-            title=context.title,
-            prompt=context.prompt,
-        )
-        for context in contexts
-    ]
+    return context_prompt_cache.get_all(session)
@@ -0,0 +1,187 @@
+import asyncio
+from contextlib import aclosing
+from typing import Optional
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.logger import logger
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.api.v1.auth.models import User
+from app.api.v1.chat import memory, services, summaries
+from app.api.v1.chat.schemas import (
+    ChatSocketDeleteFrame,
+    ChatSocketFrame,
+    ChatSocketSendFrame,
+    ChatSocketUpdateFrame,
+)
+from app.settings import settings
+from app.utils.metrics import metrics
+from app.utils.resilience import deadline_scope
+
+chat_socket_frame = TypeAdapter(ChatSocketFrame)
+
+
+class ChatSocket:
+    """Chat over one authenticated WebSocket connection.
+
+    The client sends JSON frames with a ``type`` of ``send``, ``update`` or
+    ``delete``, carrying the same fields as the HTTP endpoints, and an optional
+    ``ref`` echoed back in the answering frames. A send is answered with ``token``
+    frames followed by a ``done`` frame (the ``SendMessageResponseSchema``), an
+    update with an ``updated`` frame and a delete with a ``deleted`` frame (both a
+    ``ChatHistoryResponseSchema``). Failures are answered with an ``error`` frame,
+    and the connection stays open.
+
+    Frames are handled one at a time, in order, on the session of the connection.
+    Every frame ends its transaction, so no pooled connection is held between
+    frames.
+    """
+
+    def __init__(self, websocket: WebSocket, user: User, session: Session) -> None:
+        self.websocket = websocket
+        self.user = user
+        self.session = session
+        self._background_tasks: set[asyncio.Task] = set()
+
+    async def send_frame(self, type: str, data: dict, ref: Optional[str]) -> None:
+        await self.websocket.send_json({"type": type, "ref": ref, **data})
+
+    def run_in_background(self, coroutine) -> None:
+        """Run a follow-up step of a send without holding up the next frame."""
+        task = asyncio.ensure_future(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def handle_send(self, frame: ChatSocketSendFrame) -> None:
+        if not frame.message:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Message cannot be empty.",
+            )
+        if frame.background:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Background sends are not supported over WebSocket.",
+            )
+
+        user_id = self.user.id
+        conversation_id = await run_in_threadpool(
+            services.resolve_conversation_id,
+            session=self.session,
+            user_id=user_id,
+            conversation_id=frame.conversation_id,
+        )
+
+        events = await services.stream_chatbot_events(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            message=frame.message,
+            session=self.session,
+            context_id=frame.context_id,
+        )
+        async with aclosing(events):
+            async for event, data in events:
+                await self.send_frame(event, data, frame.ref)
+
+        self.run_in_background(
+            summaries.summarize_chat_history(user_id, conversation_id),
+        )
+        self.run_in_background(memory.embed_chat_messages(user_id))
+
+    async def handle_update(self, frame: ChatSocketUpdateFrame) -> None:
+        if not frame.message:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Message cannot be empty.",
+            )
+
+        response = await run_in_threadpool(
+            services.update_chat_message,
+            user=self.user,
+            message_id=frame.message_id,
+            new_message=frame.message,
+            session=self.session,
+        )
+        await self.send_frame("updated", response.model_dump(), frame.ref)
+
+    async def handle_delete(self, frame: ChatSocketDeleteFrame) -> None:
+        def delete():
+            conversation_id = services.resolve_conversation_id(
+                session=self.session,
+                user_id=self.user.id,
+                conversation_id=frame.conversation_id,
+                create=False,
+            )
+            return services.delete_chat_history(
+                user=self.user,
+                message_id=frame.message_id,
+                delete_all=frame.delete_all,
+                session=self.session,
+                conversation_id=conversation_id,
+            )
+
+        response = await run_in_threadpool(delete)
+        await self.send_frame("deleted", response.model_dump(), frame.ref)
+
+    async def handle_frame(self, text: str) -> None:
+        try:
+            frame = chat_socket_frame.validate_json(text)
+        except ValidationError as e:
+            await self.send_frame(
+                "error",
+                {
+                    "status_code": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    "detail": e.errors(include_url=False, include_context=False),
+                },
+                None,
+            )
+            return
+
+        handlers = {
+            "send": self.handle_send,
+            "update": self.handle_update,
+            "delete": self.handle_delete,
+        }
+        metrics.increment(f"chat.socket.{frame.type}")
+
+        try:
+            with deadline_scope(settings.http_request_timeout_seconds):
+                await handlers[frame.type](frame)
+        except HTTPException as e:
+            await run_in_threadpool(self.session.rollback)
+            await self.send_frame(
+                "error",
+                {"status_code": e.status_code, "detail": e.detail},
+                frame.ref,
+            )
+            return
+        except Exception as e:
+            logger.exception(
+                f"[Chat Socket] Failed to handle a {frame.type} frame: {e}"
+            )
+            await run_in_threadpool(self.session.rollback)
+            await self.send_frame(
+                "error",
+                {
+                    "status_code": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    "detail": "Internal server error.",
+                },
+                frame.ref,
+            )
+            return
+
+        # reads leave a transaction open, end it before waiting for the next frame
+        await run_in_threadpool(self.session.commit)
+
+    async def run(self) -> None:
+        """Handle frames until the client disconnects."""
+        log_prefix = "[Chat Socket]"
+
+        try:
+            while True:
+                text = await self.websocket.receive_text()
+                await self.handle_frame(text)
+        except WebSocketDisconnect:
+            logger.info(f"{log_prefix} User {self.user.id} disconnected")
@@ -0,0 +1,242 @@
+from typing import Optional
+
+from fastapi.logger import logger
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import constants
+from app.api.v1.chat.models import ChatMessage, ChatSummary, SenderType
+from app.database import session_factory
+from app.settings import settings
+from app.utils.openai import async_get_response_from_gpt_with_context
+from app.utils.resilience import without_deadline
+
+
+def get_chat_summary(
+    session: Session,
+    conversation_id: int,
+) -> Optional[ChatSummary]:
+    """
+    Get the running summary of a conversation's older chat messages.
+    """
+
+    return (
+        session.query(ChatSummary)
+        .filter(ChatSummary.conversation_id == conversation_id)
+        .first()
+    )
+
+
+def invalidate_chat_summary(
+    session: Session,
+    conversation_id: int,
+    message_id: int = None,
+) -> None:
+    """
+    Drop the conversation's summary if it covers the given message, or
+    unconditionally when no message is given. The summary is rebuilt by the next
+    summarization run.
+    """
+
+    query = session.query(ChatSummary).filter(
+        ChatSummary.conversation_id == conversation_id,
+    )
+    if message_id is not None:
+        query = query.filter(ChatSummary.last_message_id >= message_id)
+    query.delete(synchronize_session=False)
+
+
+def load_messages_to_summarize(
+    session: Session,
+    user_id: int,
+    conversation_id: int,
+) -> tuple[Optional[str], Optional[int], list]:
+    """
+    Load the current summary and the messages that should be folded into it.
+
+    Messages are only folded once more than the threshold have piled up after the
+    summary, and the newest ``chat_summary_tail_messages`` are always left out.
+    At most ``chat_summary_threshold_messages`` are folded per run.
+    """
+
+    threshold = settings.chat_summary_threshold_messages
+    tail = settings.chat_summary_tail_messages
+
+    summary = get_chat_summary(session, conversation_id)
+    previous_summary = summary.summary if summary else None
+    previous_last_message_id = summary.last_message_id if summary else None
+
+    query = session.query(
+        ChatMessage.id,
+        ChatMessage.sender_type,
+        ChatMessage.message,
+        ChatMessage.updated_at,
+    ).filter(
+        ChatMessage.user_id == user_id,
+        ChatMessage.conversation_id == conversation_id,
+    )
+    if previous_last_message_id is not None:
+        query = query.filter(ChatMessage.id > previous_last_message_id)
+    messages = query.order_by(ChatMessage.id.asc()).limit(threshold + tail).all()
+
+    session.commit()
+
+    if len(messages) < threshold + tail:
+        messages = []
+
+    return previous_summary, previous_last_message_id, messages[:threshold]
+
+
+async def generate_chat_summary(
+    user_id: int,
+    previous_summary: Optional[str],
+    messages: list,
+) -> str:
+    """
+    Fold new messages into the running summary.
+
+    Uses the LLM when it is enabled, otherwise keeps a truncated transcript.
+    """
+
+    transcript = "\n".join(
+        f"{'Assistant' if message.sender_type == SenderType.SYSTEM else 'User'}: "
+        f"{message.message}"
+        for message in messages
+    )
+
+    if settings.is_llm_enabled:
+        return await async_get_response_from_gpt_with_context(
+            messages=[
+                {
+                    "role": "system",
+                    "content": constants.CHAT_SUMMARY_PROMPT,
+                },
+                {
+                    "role": "user",
+                    "content": (
+                        f"Current summary:\n{previous_summary or '(none)'}\n\n"
+                        f"New messages:\n{transcript}"
+                    ),
+                },
+            ],
+            user_id=user_id,
+        )
+
+    summary = "\n".join(filter(None, [previous_summary, transcript]))
+    return summary[-constants.CHAT_SUMMARY_MAX_CHARS :]
+
+
+def save_chat_summary(
+    session: Session,
+    user_id: int,
+    conversation_id: int,
+    summary: str,
+    previous_last_message_id: Optional[int],
+    messages: list,
+) -> bool:
+    """
+    Save the summary if nobody changed or invalidated it, or edited or deleted the
+    ``messages`` folded into it, in the meantime.
+
+    The folded messages are locked until the summary is committed, so an edit or
+    delete either shows up here or waits, and then invalidates the saved summary.
+
+    Returns whether the summary was saved.
+    """
+
+    last_message_id = messages[-1].id
+    query = session.query(ChatMessage.id, ChatMessage.updated_at).filter(
+        ChatMessage.user_id == user_id,
+        ChatMessage.conversation_id == conversation_id,
+        ChatMessage.id <= last_message_id,
+    )
+    if previous_last_message_id is not None:
+        query = query.filter(ChatMessage.id > previous_last_message_id)
+    current_messages = (
+        query.order_by(ChatMessage.id.asc()).with_for_update(read=True).all()
+    )
+    if [tuple(message) for message in current_messages] != [
+        (message.id, message.updated_at) for message in messages
+    ]:
+        session.rollback()
+        return False
+
+    if previous_last_message_id is None:
+        result = session.execute(
+            insert(ChatSummary)
+            .values(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                summary=summary,
+                last_message_id=last_message_id,
+            )
+            .on_conflict_do_nothing(index_elements=[ChatSummary.conversation_id]),
+        )
+    else:
+        result = session.execute(
+            ChatSummary.__table__.update()
+            .where(
+                ChatSummary.conversation_id == conversation_id,
+                ChatSummary.last_message_id == previous_last_message_id,
+            )
+            .values(
+                summary=summary,
+                last_message_id=last_message_id,
+            ),
+        )
+
+    session.commit()
+
+    return result.rowcount == 1
+
+
+@without_deadline
+async def summarize_chat_history(user_id: int, conversation_id: int) -> None:
+    """
+    Background step run after a message is sent: fold older messages into the
+    conversation's running summary once enough of them have piled up.
+    """
+    log_prefix = "[Chat Summary]"
+
+    session = session_factory()
+    try:
+        (
+            previous_summary,
+            previous_last_message_id,
+            messages,
+        ) = await run_in_threadpool(
+            load_messages_to_summarize,
+            session,
+            user_id,
+            conversation_id,
+        )
+
+        if not messages:
+            return
+
+        logger.info(
+            f"{log_prefix} Summarizing {len(messages)} messages of conversation: "
+            f"{conversation_id}",
+        )
+
+        summary = await generate_chat_summary(user_id, previous_summary, messages)
+
+        saved = await run_in_threadpool(
+            save_chat_summary,
+            session=session,
+            user_id=user_id,
+            conversation_id=conversation_id,
+            summary=summary,
+            previous_last_message_id=previous_last_message_id,
+            messages=messages,
+        )
+        if not saved:
+            logger.info(
+                f"{log_prefix} Summary or its messages changed concurrently, "
+                "skipping save.",
+            )
+    except Exception as e:
+        logger.exception(f"{log_prefix} {e}")
+    finally:
+        await run_in_threadpool(session.close)
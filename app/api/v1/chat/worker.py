@@ -0,0 +1,262 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi.logger import logger
+from sqlalchemy import ColumnElement, and_, or_
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.api.v1.chat import memory, services, summaries
+from app.api.v1.chat.models import (
+    ChatGenerationJob,
+    ChatMessage,
+    GenerationJobStatus,
+    SenderType,
+)
+from app.database import session_factory
+from app.settings import settings
+from app.utils.metrics import metrics
+
+
+@dataclass
+class ClaimedJob:
+    id: int
+    user_id: int
+    conversation_id: int
+    message: str
+    context_id: Optional[int]
+    # the job's attempts once claimed; a reclaimed job has more
+    attempt: int
+
+
+def claim_generation_job(session: Session) -> Optional[ClaimedJob]:
+    """
+    Claim the oldest pending job, or a running job whose lease expired.
+
+    ``FOR UPDATE SKIP LOCKED`` lets any number of workers claim jobs concurrently
+    without waiting on each other or claiming the same job twice.
+    """
+
+    now = datetime.now()
+
+    row = (
+        session.query(
+            ChatGenerationJob,
+            ChatMessage.conversation_id,
+            ChatMessage.message,
+        )
+        .join(ChatMessage, ChatMessage.id == ChatGenerationJob.message_id)
+        .filter(
+            or_(
+                ChatGenerationJob.status == GenerationJobStatus.PENDING,
+                and_(
+                    ChatGenerationJob.status == GenerationJobStatus.RUNNING,
+                    ChatGenerationJob.locked_until < now,
+                ),
+            ),
+        )
+        .order_by(ChatGenerationJob.id.asc())
+        .with_for_update(of=ChatGenerationJob, skip_locked=True)
+        .first()
+    )
+
+    if row is None:
+        session.commit()
+        return None
+
+    job, conversation_id, message = row
+    job.status = GenerationJobStatus.RUNNING
+    job.attempts += 1
+    job.locked_until = now + timedelta(seconds=settings.chat_generation_lease_seconds)
+
+    claimed_job = ClaimedJob(
+        id=job.id,
+        user_id=job.user_id,
+        conversation_id=conversation_id,
+        message=message,
+        context_id=job.context_id,
+        attempt=job.attempts,
+    )
+    session.commit()
+
+    return claimed_job
+
+
+def is_claimed(job: ClaimedJob) -> ColumnElement[bool]:
+    """
+    Filter matching the job while it is still running under this claim, and not
+    reclaimed by another worker after its lease expired.
+    """
+
+    return and_(
+        ChatGenerationJob.id == job.id,
+        ChatGenerationJob.status == GenerationJobStatus.RUNNING,
+        ChatGenerationJob.attempts == job.attempt,
+    )
+
+
+def complete_generation_job(session: Session, job: ClaimedJob, reply: str) -> None:
+    """
+    Save the SYSTEM reply and mark the job done, in one transaction.
+
+    The reply is dropped when the job is gone, deleted with its user message, or
+    was reclaimed by another worker once the lease of this one expired.
+    """
+
+    done = (
+        session.query(ChatGenerationJob)
+        .filter(is_claimed(job))
+        .update(
+            {
+                ChatGenerationJob.status: GenerationJobStatus.DONE,
+                ChatGenerationJob.locked_until: None,
+                ChatGenerationJob.error: None,
+            },
+            synchronize_session=False,
+        )
+    )
+    if not done:
+        session.rollback()
+        metrics.increment("generation_jobs.lost")
+        return
+
+    system_message = ChatMessage(
+        sender_type=SenderType.SYSTEM,
+        user_id=job.user_id,
+        conversation_id=job.conversation_id,
+        message=reply,
+    )
+    session.add(system_message)
+    session.flush()
+
+    session.query(ChatGenerationJob).filter(ChatGenerationJob.id == job.id).update(
+        {ChatGenerationJob.result_message_id: system_message.id},
+        synchronize_session=False,
+    )
+    session.commit()
+
+
+def fail_generation_job(session: Session, job: ClaimedJob, error: str) -> None:
+    """
+    Put a failed job back in the queue, or mark it failed once it ran out of attempts.
+    Jobs no longer claimed by this worker are left alone, see
+    ``complete_generation_job``.
+    """
+
+    session.rollback()
+
+    failed = (
+        session.query(ChatGenerationJob)
+        .filter(is_claimed(job))
+        .update(
+            {
+                ChatGenerationJob.status: (
+                    GenerationJobStatus.FAILED
+                    if job.attempt >= settings.chat_generation_max_attempts
+                    else GenerationJobStatus.PENDING
+                ),
+                ChatGenerationJob.locked_until: None,
+                ChatGenerationJob.error: error,
+            },
+            synchronize_session=False,
+        )
+    )
+    if not failed:
+        session.rollback()
+        metrics.increment("generation_jobs.lost")
+        return
+    session.commit()
+
+
+async def run_generation_job(session: Session, job: ClaimedJob) -> None:
+    """
+    Generate the reply of a claimed job.
+    """
+    log_prefix = "[Generation Job]"
+
+    try:
+        reply = await services.generate_system_response(
+            session=session,
+            user_id=job.user_id,
+            conversation_id=job.conversation_id,
+            message=job.message,
+            context_id=job.context_id,
+        )
+        await run_in_threadpool(complete_generation_job, session, job, reply)
+    except Exception as e:
+        logger.exception(f"{log_prefix} Job {job.id} failed: {e}")
+        metrics.increment("generation_jobs.failed")
+        await run_in_threadpool(fail_generation_job, session, job, str(e))
+        return
+
+    metrics.increment("generation_jobs.done")
+    await summaries.summarize_chat_history(job.user_id, job.conversation_id)
+    await memory.embed_chat_messages(job.user_id)
+
+
+class GenerationWorkerPool:
+    """Asyncio workers claiming generation jobs from the Postgres queue.
+
+    Each worker runs one job at a time with its own session, so ``concurrency``
+    is the number of LLM calls in flight. Throughput scales by running more pools
+    (``python -m app.worker``) next to the HTTP workers.
+    """
+
+    def __init__(self, concurrency: int, poll_interval: float) -> None:
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._stopping = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    async def _work(self) -> None:
+        session = session_factory()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    job = await run_in_threadpool(claim_generation_job, session)
+                except Exception as e:
+                    logger.exception(f"[Generation Worker] Failed to claim a job: {e}")
+                    await run_in_threadpool(session.rollback)
+                    job = None
+
+                if job is None:
+                    try:
+                        await asyncio.wait_for(
+                            self._stopping.wait(),
+                            timeout=self.poll_interval,
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                try:
+                    await run_generation_job(session, job)
+                except Exception as e:
+                    # a worker must outlive any job
+                    logger.exception(f"[Generation Worker] Job {job.id} failed: {e}")
+                    await run_in_threadpool(session.rollback)
+        finally:
+            await run_in_threadpool(session.close)
+
+    def start(self) -> None:
+        """Start the workers in the running event loop."""
+        self._stopping.clear()
+        self._tasks = [
+            asyncio.ensure_future(self._work()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self) -> None:
+        """Let the workers finish their current job, then stop them."""
+        self._stopping.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def run(self) -> None:
+        """Run the workers until cancelled."""
+        self.start()
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.stop()
@@ -0,0 +1,172 @@
+import asyncio
+from typing import Optional
+
+from fastapi.logger import logger
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.api.v1.chat.models import ChatMessage
+from app.database import session_factory
+from app.settings import settings
+from app.utils.metrics import metrics
+
+
+def insert_chat_messages(session: Session, rows: list[dict]) -> list[ChatMessage]:
+    """
+    Insert chat messages with one multi-row ``INSERT ... RETURNING`` and commit.
+
+    Returns the messages in the order of ``rows``, detached and fully loaded, so
+    reading them needs no further queries.
+    """
+
+    chat_messages = session.scalars(
+        insert(ChatMessage).returning(ChatMessage, sort_by_parameter_order=True),
+        rows,
+    ).all()
+
+    # detached before the commit would expire them
+    for chat_message in chat_messages:
+        session.expunge(chat_message)
+    session.commit()
+
+    return chat_messages
+
+
+class ChatMessageWriteBuffer:
+    """Group commit of chat message inserts, one buffer per worker.
+
+    Saves from concurrent requests are gathered for up to ``max_delay_seconds``,
+    or until ``max_rows`` rows are waiting, and inserted together with a single
+    ``INSERT ... RETURNING`` and commit. Each caller waits for the commit of its
+    batch before getting its messages back, so the ids are real and anything read
+    afterwards, by the sender or anyone else, sees them. The rows of one save are
+    inserted together and in order. When a batch fails, its saves are retried one by
+    one, so a bad row only fails its own save.
+
+    Batches are counted as ``chat_write_buffer.flushes`` and their size observed as
+    ``chat_write_buffer.batch_rows``.
+    """
+
+    def __init__(self, max_rows: int, max_delay_seconds: float) -> None:
+        self.max_rows = max_rows
+        self.max_delay_seconds = max_delay_seconds
+        self._pending: list[tuple[list[dict], asyncio.Future]] = []
+        self._pending_rows = 0
+        self._has_pending: Optional[asyncio.Event] = None
+        self._is_full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def save(self, rows: list[dict]) -> list[ChatMessage]:
+        """Insert the rows with the next batch and return their messages."""
+        if not self.running:
+            raise RuntimeError("The write buffer is not running.")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((rows, future))
+        self._pending_rows += len(rows)
+        self._has_pending.set()
+        if self._pending_rows >= self.max_rows:
+            self._is_full.set()
+
+        # a cancelled caller leaves its rows in the batch
+        return await asyncio.shield(future)
+
+    def _take_batch(self) -> list[tuple[list[dict], asyncio.Future]]:
+        batch = self._pending
+        self._pending = []
+        self._pending_rows = 0
+        self._has_pending.clear()
+        self._is_full.clear()
+        return batch
+
+    async def _flush(self, batch: list[tuple[list[dict], asyncio.Future]]) -> None:
+        rows = [row for entry_rows, _ in batch for row in entry_rows]
+
+        def insert_batch() -> list[ChatMessage]:
+            session = session_factory()
+            try:
+                return insert_chat_messages(session, rows)
+            finally:
+                session.close()
+
+        try:
+            chat_messages = await run_in_threadpool(insert_batch)
+        except Exception as e:
+            logger.exception(f"[Chat Write Buffer] Failed to insert a batch: {e}")
+            if len(batch) > 1:
+                for entry in batch:
+                    await self._flush([entry])
+                return
+            self._fail(batch, e)
+            return
+
+        metrics.increment("chat_write_buffer.flushes")
+        metrics.observe("chat_write_buffer.batch_rows", len(rows))
+
+        start = 0
+        for entry_rows, future in batch:
+            if not future.done():
+                future.set_result(chat_messages[start : start + len(entry_rows)])
+            start += len(entry_rows)
+
+    def _fail(
+        self,
+        batch: list[tuple[list[dict], asyncio.Future]],
+        error: Exception,
+    ) -> None:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _run(self) -> None:
+        while self._pending or not self._stopping:
+            try:
+                await self._has_pending.wait()
+                if not self._stopping:
+                    try:
+                        await asyncio.wait_for(
+                            self._is_full.wait(),
+                            timeout=self.max_delay_seconds,
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+                # saves made while a batch is written wait for the next one
+                if self._pending:
+                    await self._flush(self._take_batch())
+            except Exception as e:
+                # nobody would ever answer the waiting saves otherwise
+                logger.exception(f"[Chat Write Buffer] {e}")
+                self._fail(self._take_batch(), e)
+
+    def start(self) -> None:
+        """Start flushing in the running event loop."""
+        self._has_pending = asyncio.Event()
+        self._is_full = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Write whatever is still buffered, then stop flushing."""
+        if self._task is None:
+            return
+
+        self._stopping = True
+        self._has_pending.set()
+        self._is_full.set()
+        await self._task
+        self._task = None
+        # saved between the last flush and the end of the task
+        if self._pending:
+            await self._flush(self._take_batch())
+
+
+chat_message_write_buffer = ChatMessageWriteBuffer(
+    max_rows=settings.chat_write_buffer_max_rows,
+    max_delay_seconds=settings.chat_write_buffer_max_delay_seconds,
+)
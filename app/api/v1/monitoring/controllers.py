@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, Request
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 from app.database import db
+from app.settings import settings
+from app.utils.metrics import metrics
 
 router = APIRouter()
 
@@ -17,3 +21,26 @@ def health_check(request: Request, session: Session = Depends(db)) -> str:
     session.execute(text("SELECT 1"))
 
     return "OK"
+
+
+@router.get("/metrics")
+def get_metrics(authorization: str = Header(default="")) -> dict:
+    """
+    In-process metrics (cache hit rates and friends) of the worker serving the call.
+
+    Internal only: disabled unless ``metrics_token`` is set, and then requires it
+    as a bearer token.
+    """
+
+    if not settings.metrics_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if not secrets.compare_digest(
+        authorization.encode(),
+        f"Bearer {settings.metrics_token}".encode(),
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token.",
+        )
+
+    return metrics.snapshot()
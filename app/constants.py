@@ -11,4 +11,61 @@ MINIMUM_PASSWORD_LENGTH = 4
 AUTH_TOKEN_NAME = "access_token"
 ACCESS_TOKEN_EXPIRY_DAYS = 7
 
+USER_TIER_FREE = "free"
+
 SYSTEM_CHATBOT_PROMPT = "You are a chatbot created to complete an assessment test for a job at Artisan. You have no real use, but you have to show your utility by completing the test and responding to the user's message with amazing wit and charm. AND USE EMOJIS!"
+
+# number of chat messages fetched per query while building the LLM context
+CHAT_CONTEXT_BATCH_SIZE = 50
+
+CHAT_SUMMARY_PROMPT = "You maintain a running summary of a conversation between a user and a chatbot. Update the current summary with the new messages. Keep facts, names, preferences and open questions. Reply with the updated summary only."
+
+# max length of the summary kept when no LLM is available to summarize
+CHAT_SUMMARY_MAX_CHARS = 4000
+
+# chat messages embedded per embeddings call, and most calls per background run
+CHAT_MEMORY_EMBED_BATCH_SIZE = 100
+CHAT_MEMORY_EMBED_MAX_BATCHES = 10
+# embedding ids below the newest indexed one read again when an index is synced:
+# ids are assigned on insert but visible on commit, so they can show up late
+CHAT_MEMORY_SYNC_LOOKBACK_IDS = 1000
+
+CHAT_HISTORY_DEFAULT_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+
+# messages, and separately deletes, per sync page
+CHAT_SYNC_DEFAULT_PAGE_SIZE = 200
+CHAT_SYNC_MAX_PAGE_SIZE = 1000
+
+CONVERSATIONS_DEFAULT_PAGE_SIZE = 20
+CONVERSATIONS_MAX_PAGE_SIZE = 100
+
+# text search configuration of chat message search, changing it needs a migration
+CHAT_SEARCH_TEXT_CONFIG = "english"
+CHAT_SEARCH_DEFAULT_PAGE_SIZE = 20
+CHAT_SEARCH_MAX_PAGE_SIZE = 100
+CHAT_SEARCH_QUERY_MAX_LENGTH = 256
+# matches are delimited by control characters, swapped for <mark> tags once the
+# headline is HTML-escaped
+CHAT_SEARCH_HEADLINE_START = "\x02"
+CHAT_SEARCH_HEADLINE_STOP = "\x03"
+CHAT_SEARCH_HEADLINE_OPTIONS = (
+    f"StartSel={CHAT_SEARCH_HEADLINE_START}, StopSel={CHAT_SEARCH_HEADLINE_STOP}, "
+    "MaxFragments=2, MaxWords=20, MinWords=5"
+)
+
+# how long clients may reuse the chat context prompts without revalidating
+CHAT_CONTEXT_PROMPTS_MAX_AGE_SECONDS = 300
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# how often a retry checks whether the original request finished
+IDEMPOTENCY_POLL_INTERVAL_SECONDS = 0.2
+
+# lets clients shorten the deadline of their request (in seconds)
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout"
+# shortest deadline a client can ask for, so nothing can time out on purpose
+REQUEST_TIMEOUT_MIN_SECONDS = 1
+
+# longest a client may long-poll a generation job for
+CHAT_GENERATION_JOB_MAX_WAIT_SECONDS = 30
@@ -78,11 +78,11 @@ class Base:
     __table_args__: Tuple[Any, ...]
 
     # Add created and updated timestamps to all tables/models
-    created_at = Column(DateTime, default=datetime.datetime.now())
+    created_at = Column(DateTime, default=datetime.datetime.now)
     updated_at = Column(
         DateTime,
-        default=datetime.datetime.now(),
-        onupdate=datetime.datetime.now(),
+        default=datetime.datetime.now,
+        onupdate=datetime.datetime.now,
     )
 
     @classmethod
@@ -0,0 +1,52 @@
+"""chat summaries
+
+Revision ID: 3f6c1a9e2b47
+Revises: d2b1e5ed3c63
+Create Date: 2026-10-18 09:12:41.201937
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3f6c1a9e2b47"
+down_revision = "d2b1e5ed3c63"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "chat_summaries",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("summary", sa.String(), nullable=False),
+        sa.Column("last_message_id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+            name=op.f("fk_chat_summaries_user_id_users"),
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_chat_summaries")),
+    )
+    op.create_index(
+        op.f("ix_chat_summaries_id"),
+        "chat_summaries",
+        ["id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_chat_summaries_user_id"),
+        "chat_summaries",
+        ["user_id"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_chat_summaries_user_id"), table_name="chat_summaries")
+    op.drop_index(op.f("ix_chat_summaries_id"), table_name="chat_summaries")
+    op.drop_table("chat_summaries")
@@ -0,0 +1,50 @@
+"""chat messages user_id id index
+
+Revision ID: 8a2d4c7e91b0
+Revises: 3f6c1a9e2b47
+Create Date: 2026-10-18 10:05:17.642310
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8a2d4c7e91b0"
+down_revision = "3f6c1a9e2b47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY cannot run inside a transaction, and keeps writes flowing
+    # while the index is built on a large table.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_chat_messages_user_id_id",
+            "chat_messages",
+            ["user_id", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        # the composite index covers every lookup the user_id index served
+        op.drop_index(
+            op.f("ix_chat_messages_user_id"),
+            table_name="chat_messages",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_chat_messages_user_id"),
+            "chat_messages",
+            ["user_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_chat_messages_user_id_id",
+            table_name="chat_messages",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,73 @@
+"""chat message tombstones
+
+Revision ID: c51e07d9a4f3
+Revises: 8a2d4c7e91b0
+Create Date: 2026-10-18 11:31:09.118204
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c51e07d9a4f3"
+down_revision = "8a2d4c7e91b0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "chat_message_tombstones",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("message_id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+            name=op.f("fk_chat_message_tombstones_user_id_users"),
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_chat_message_tombstones")),
+    )
+    op.create_index(
+        op.f("ix_chat_message_tombstones_id"),
+        "chat_message_tombstones",
+        ["id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_chat_message_tombstones_user_id_created_at",
+        "chat_message_tombstones",
+        ["user_id", "created_at"],
+        unique=False,
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_chat_messages_user_id_updated_at",
+            "chat_messages",
+            ["user_id", "updated_at"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_chat_messages_user_id_updated_at",
+            table_name="chat_messages",
+            postgresql_concurrently=True,
+        )
+
+    op.drop_index(
+        "ix_chat_message_tombstones_user_id_created_at",
+        table_name="chat_message_tombstones",
+    )
+    op.drop_index(
+        op.f("ix_chat_message_tombstones_id"),
+        table_name="chat_message_tombstones",
+    )
+    op.drop_table("chat_message_tombstones")
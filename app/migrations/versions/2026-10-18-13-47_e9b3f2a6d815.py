@@ -0,0 +1,52 @@
+"""chat response cache
+
+Revision ID: e9b3f2a6d815
+Revises: c51e07d9a4f3
+Create Date: 2026-10-18 13:47:52.390115
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e9b3f2a6d815"
+down_revision = "c51e07d9a4f3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "chat_response_cache",
+        sa.Column("key", sa.String(length=64), nullable=False),
+        sa.Column("response", sa.String(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("key", name=op.f("pk_chat_response_cache")),
+    )
+    op.create_index(
+        op.f("ix_chat_response_cache_expires_at"),
+        "chat_response_cache",
+        ["expires_at"],
+        unique=False,
+    )
+    op.add_column(
+        "chat_context_prompts",
+        sa.Column(
+            "cache_responses",
+            sa.Boolean(),
+            server_default=sa.text("true"),
+            nullable=False,
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("chat_context_prompts", "cache_responses")
+    op.drop_index(
+        op.f("ix_chat_response_cache_expires_at"),
+        table_name="chat_response_cache",
+    )
+    op.drop_table("chat_response_cache")
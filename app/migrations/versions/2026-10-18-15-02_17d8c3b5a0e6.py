@@ -0,0 +1,43 @@
+"""chat idempotency keys
+
+Revision ID: 17d8c3b5a0e6
+Revises: e9b3f2a6d815
+Create Date: 2026-10-18 15:02:33.870452
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "17d8c3b5a0e6"
+down_revision = "e9b3f2a6d815"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "chat_idempotency_keys",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("key", sa.String(length=255), nullable=False),
+        sa.Column("request_hash", sa.String(length=64), nullable=False),
+        sa.Column("response", sa.String(), nullable=True),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+            name=op.f("fk_chat_idempotency_keys_user_id_users"),
+        ),
+        sa.PrimaryKeyConstraint(
+            "user_id",
+            "key",
+            name=op.f("pk_chat_idempotency_keys"),
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("chat_idempotency_keys")
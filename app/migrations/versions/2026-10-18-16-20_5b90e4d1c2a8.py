@@ -0,0 +1,93 @@
+"""chat generation jobs
+
+Revision ID: 5b90e4d1c2a8
+Revises: 17d8c3b5a0e6
+Create Date: 2026-10-18 16:20:48.013377
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5b90e4d1c2a8"
+down_revision = "17d8c3b5a0e6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "chat_generation_jobs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("message_id", sa.Integer(), nullable=False),
+        sa.Column("context_id", sa.Integer(), nullable=True),
+        sa.Column(
+            "status",
+            sa.Enum(
+                "PENDING",
+                "RUNNING",
+                "DONE",
+                "FAILED",
+                name="generationjobstatus",
+            ),
+            nullable=False,
+        ),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("locked_until", sa.DateTime(), nullable=True),
+        sa.Column("result_message_id", sa.Integer(), nullable=True),
+        sa.Column("error", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["message_id"],
+            ["chat_messages.id"],
+            name=op.f("fk_chat_generation_jobs_message_id_chat_messages"),
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["result_message_id"],
+            ["chat_messages.id"],
+            name=op.f("fk_chat_generation_jobs_result_message_id_chat_messages"),
+            ondelete="SET NULL",
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+            name=op.f("fk_chat_generation_jobs_user_id_users"),
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_chat_generation_jobs")),
+    )
+    op.create_index(
+        op.f("ix_chat_generation_jobs_id"),
+        "chat_generation_jobs",
+        ["id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_chat_generation_jobs_status_id",
+        "chat_generation_jobs",
+        ["status", "id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_chat_generation_jobs_user_id"),
+        "chat_generation_jobs",
+        ["user_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_chat_generation_jobs_user_id"),
+        table_name="chat_generation_jobs",
+    )
+    op.drop_index(
+        "ix_chat_generation_jobs_status_id",
+        table_name="chat_generation_jobs",
+    )
+    op.drop_index(op.f("ix_chat_generation_jobs_id"), table_name="chat_generation_jobs")
+    op.drop_table("chat_generation_jobs")
+    sa.Enum(name="generationjobstatus").drop(op.get_bind())
@@ -0,0 +1,32 @@
+"""user tier
+
+Revision ID: a4e8d0c6b193
+Revises: 5b90e4d1c2a8
+Create Date: 2026-10-18 17:38:04.518263
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a4e8d0c6b193"
+down_revision = "5b90e4d1c2a8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "users",
+        sa.Column(
+            "tier",
+            sa.String(),
+            server_default="free",
+            nullable=False,
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("users", "tier")
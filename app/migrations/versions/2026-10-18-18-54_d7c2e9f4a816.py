@@ -0,0 +1,70 @@
+"""chat message embeddings
+
+Revision ID: d7c2e9f4a816
+Revises: a4e8d0c6b193
+Create Date: 2026-10-18 18:54:21.730946
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d7c2e9f4a816"
+down_revision = "a4e8d0c6b193"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "chat_message_embeddings",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("message_id", sa.Integer(), nullable=False),
+        sa.Column("model", sa.String(), nullable=False),
+        sa.Column("embedding", sa.LargeBinary(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["message_id"],
+            ["chat_messages.id"],
+            name=op.f("fk_chat_message_embeddings_message_id_chat_messages"),
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+            name=op.f("fk_chat_message_embeddings_user_id_users"),
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_chat_message_embeddings")),
+        sa.UniqueConstraint(
+            "message_id",
+            "model",
+            name=op.f("uq_chat_message_embeddings_message_id"),
+        ),
+    )
+    op.create_index(
+        op.f("ix_chat_message_embeddings_id"),
+        "chat_message_embeddings",
+        ["id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_chat_message_embeddings_user_id_model_id",
+        "chat_message_embeddings",
+        ["user_id", "model", "id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_chat_message_embeddings_user_id_model_id",
+        table_name="chat_message_embeddings",
+    )
+    op.drop_index(
+        op.f("ix_chat_message_embeddings_id"),
+        table_name="chat_message_embeddings",
+    )
+    op.drop_table("chat_message_embeddings")
@@ -0,0 +1,52 @@
+"""chat message search
+
+Revision ID: e5b1f8a3c927
+Revises: d7c2e9f4a816
+Create Date: 2026-10-18 20:12:44.519387
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "e5b1f8a3c927"
+down_revision = "d7c2e9f4a816"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # a stored generated column rewrites the table once
+    op.add_column(
+        "chat_messages",
+        sa.Column(
+            "message_tsv",
+            postgresql.TSVECTOR(),
+            sa.Computed("to_tsvector('english', message)", persisted=True),
+            nullable=True,
+        ),
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_chat_messages_message_tsv",
+            "chat_messages",
+            ["message_tsv"],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_chat_messages_message_tsv",
+            table_name="chat_messages",
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+        )
+
+    op.drop_column("chat_messages", "message_tsv")
@@ -0,0 +1,165 @@
+"""conversations
+
+Revision ID: f2a7c4e1d358
+Revises: e5b1f8a3c927
+Create Date: 2026-10-18 21:05:37.204615
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "f2a7c4e1d358"
+down_revision = "e5b1f8a3c927"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "conversations",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("title", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+            name=op.f("fk_conversations_user_id_users"),
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_conversations")),
+    )
+    op.create_index(
+        op.f("ix_conversations_id"),
+        "conversations",
+        ["id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_conversations_user_id_id",
+        "conversations",
+        ["user_id", "id"],
+        unique=False,
+    )
+
+    op.add_column(
+        "chat_messages",
+        sa.Column("conversation_id", sa.Integer(), nullable=True),
+    )
+    op.add_column(
+        "chat_summaries",
+        sa.Column("conversation_id", sa.Integer(), nullable=True),
+    )
+
+    # the existing history of every user becomes their default conversation
+    op.execute(
+        """
+        INSERT INTO conversations (user_id, created_at, updated_at)
+        SELECT user_id, min(created_at), now()
+        FROM chat_messages
+        GROUP BY user_id
+        ORDER BY user_id
+        """,
+    )
+    op.execute(
+        """
+        UPDATE chat_messages
+        SET conversation_id = conversations.id
+        FROM conversations
+        WHERE conversations.user_id = chat_messages.user_id
+        """,
+    )
+    # users with a summary always have messages, so a conversation
+    op.execute(
+        """
+        UPDATE chat_summaries
+        SET conversation_id = conversations.id
+        FROM conversations
+        WHERE conversations.user_id = chat_summaries.user_id
+        """,
+    )
+
+    op.alter_column("chat_messages", "conversation_id", nullable=False)
+    op.alter_column("chat_summaries", "conversation_id", nullable=False)
+    op.create_foreign_key(
+        op.f("fk_chat_messages_conversation_id_conversations"),
+        "chat_messages",
+        "conversations",
+        ["conversation_id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
+    op.create_foreign_key(
+        op.f("fk_chat_summaries_conversation_id_conversations"),
+        "chat_summaries",
+        "conversations",
+        ["conversation_id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
+
+    # summaries are kept per conversation from now on
+    op.drop_index(op.f("ix_chat_summaries_user_id"), table_name="chat_summaries")
+    op.create_index(
+        op.f("ix_chat_summaries_user_id"),
+        "chat_summaries",
+        ["user_id"],
+        unique=False,
+    )
+    op.create_unique_constraint(
+        op.f("uq_chat_summaries_conversation_id"),
+        "chat_summaries",
+        ["conversation_id"],
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_chat_messages_user_id_conversation_id_id",
+            "chat_messages",
+            ["user_id", "conversation_id", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_chat_messages_user_id_conversation_id_id",
+            table_name="chat_messages",
+            postgresql_concurrently=True,
+        )
+
+    # a user can only have one summary again, they are rebuilt on the next send
+    op.execute("DELETE FROM chat_summaries")
+    op.drop_constraint(
+        op.f("uq_chat_summaries_conversation_id"),
+        "chat_summaries",
+        type_="unique",
+    )
+    op.drop_index(op.f("ix_chat_summaries_user_id"), table_name="chat_summaries")
+    op.create_index(
+        op.f("ix_chat_summaries_user_id"),
+        "chat_summaries",
+        ["user_id"],
+        unique=True,
+    )
+
+    op.drop_constraint(
+        op.f("fk_chat_summaries_conversation_id_conversations"),
+        "chat_summaries",
+        type_="foreignkey",
+    )
+    op.drop_constraint(
+        op.f("fk_chat_messages_conversation_id_conversations"),
+        "chat_messages",
+        type_="foreignkey",
+    )
+    op.drop_column("chat_summaries", "conversation_id")
+    op.drop_column("chat_messages", "conversation_id")
+
+    op.drop_index("ix_conversations_user_id_id", table_name="conversations")
+    op.drop_index(op.f("ix_conversations_id"), table_name="conversations")
+    op.drop_table("conversations")
@@ -0,0 +1,27 @@
+"""user token versions
+
+Revision ID: a9d3e6b2c714
+Revises: f2a7c4e1d358
+Create Date: 2026-10-18 21:48:12.530914
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a9d3e6b2c714"
+down_revision = "f2a7c4e1d358"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "users",
+        sa.Column("token_version", sa.Integer(), server_default="0", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("users", "token_version")
@@ -0,0 +1,35 @@
+"""chat response cache eviction index
+
+Revision ID: d4b8e1f6a293
+Revises: a9d3e6b2c714
+Create Date: 2026-10-18 22:40:37.204615
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d4b8e1f6a293"
+down_revision = "a9d3e6b2c714"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_chat_response_cache_updated_at",
+            "chat_response_cache",
+            ["updated_at"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_chat_response_cache_updated_at",
+            table_name="chat_response_cache",
+            postgresql_concurrently=True,
+        )
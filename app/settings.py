@@ -2,6 +2,7 @@ import os
 from functools import lru_cache
 from pathlib import Path
 from tempfile import gettempdir
+from typing import Optional
 
 from pydantic_settings import BaseSettings
 from yarl import URL
@@ -24,6 +25,13 @@ class Settings(BaseSettings):
     port: int = 8000
     secret_key: str = "this-is-a-secret"
 
+    # authentication
+    auth_user_cache_max_entries: int = 10000
+    auth_user_cache_ttl_seconds: int = 60  # edits by other workers show up after this
+    auth_check_token_version: bool = True  # reject tokens of revoked token versions
+    auth_token_cache_max_entries: int = 10000  # decoded access tokens
+    auth_token_cache_ttl_seconds: int = 3600  # at most, tokens leave once expired
+
     # database
     db_name: str = "hermes"
     db_user: str = "hermes"
@@ -35,14 +43,100 @@ class Settings(BaseSettings):
     # basics
     env: str = constants.PRODUCTION
     debug: bool = False
+    metrics_token: str = ""  # bearer token of /v1/metrics, empty disables it
+
+    # llm provider: "openai" or "fake" (in-process, for load tests)
+    llm_provider: str = "openai"
+    llm_model: str = "gpt-3.5-turbo"  # model of requests no route matches
+
+    # llm model routing
+    # rules picking the model of a request, first match wins, e.g.
+    # [{"model": "gpt-4o", "user_tiers": ["pro"], "max_prompt_tokens": 2000}]
+    # see app.api.v1.chat.routing.ModelRoute
+    llm_routes: list[dict] = []
+    llm_fallback_model: str = ""  # answers while a model is slower than the SLO
+    llm_latency_slo_seconds: float = 0  # p95 latency of a model, 0 disables fallbacks
+    llm_latency_slo_min_samples: int = 20  # calls observed before the SLO applies
+    llm_latency_slo_probe_rate: float = 0.05  # share of calls a slow model still gets
 
     # openai
     openai_api_key: str = ""
+    openai_base_url: str = ""  # e.g. a local fake server, defaults to the OpenAI API
+
+    # fake llm provider
+    fake_llm_latency_distribution: str = "lognormal"  # constant, uniform or lognormal
+    fake_llm_latency_mean_seconds: float = 0.5  # time to the first token
+    fake_llm_latency_stddev_seconds: float = 0.2
+    fake_llm_tokens_per_second: float = 50  # 0 returns all tokens at once
+    fake_llm_error_rate: float = 0.0  # share of calls failing with a transient error
+    fake_llm_response_tokens: int = 50
+    fake_llm_seed: Optional[int] = None  # makes latencies and errors reproducible
+
+    # resilience of llm calls
+    http_request_timeout_seconds: float = 60  # deadline of every HTTP request
+    llm_timeout_seconds: float = 30  # per attempt, and deadline outside requests
+    llm_max_attempts: int = 3
+    llm_backoff_base_seconds: float = 0.25
+    llm_backoff_max_seconds: float = 4
+    llm_hedge_enabled: bool = False  # send a second request when the first is slow
+    llm_hedge_min_delay_seconds: float = 1  # hedge after max(p95 latency, this)
+    llm_circuit_failure_threshold: int = 5  # consecutive failures opening the circuit
+    llm_circuit_reset_seconds: float = 30  # how long the circuit stays open
+
+    # llm scheduler, per worker
+    llm_max_concurrency: int = 64  # upstream calls running at once
+    llm_max_queue_depth: int = 256  # calls waiting for a slot, before 503s
+    llm_max_user_queue_depth: int = 8  # calls of one user waiting, before 429s
+
+    # llm response cache: "" (disabled), "memory" or "postgres"
+    llm_response_cache_backend: str = ""
+    llm_response_cache_max_entries: int = 10000
+    llm_response_cache_ttl_seconds: int = 3600
+
+    # idempotency keys of /chat/send
+    idempotency_key_ttl_seconds: int = 86400  # how long responses are replayed
+    idempotency_wait_seconds: int = 60  # how long a retry waits for the original
+
+    # background generation jobs
+    chat_generation_workers: int = 0  # job workers run inside each uvicorn worker
+    chat_generation_worker_concurrency: int = (
+        16  # job workers of `python -m app.worker`
+    )
+    chat_generation_poll_seconds: float = 0.5  # idle workers poll the queue this often
+    chat_generation_lease_seconds: int = 120  # a RUNNING job is reclaimed after this
+    chat_generation_max_attempts: int = 3
+
+    # chat
+    chat_store_partial_replies: bool = False  # keep replies cut by a disconnect
+    chat_tombstone_retention_days: int = 30  # how long deletes can be synced
+    chat_write_buffer_enabled: bool = False  # group commit of chat message inserts
+    chat_write_buffer_max_rows: int = 100  # a batch is written once this many wait
+    chat_write_buffer_max_delay_seconds: float = 0.005  # or once the oldest waited this
+    chat_context_token_budget: int = 3000  # max prompt tokens sent to the LLM
+    chat_summary_threshold_messages: int = 40  # messages folded per summary run
+    chat_summary_tail_messages: int = 10  # newest messages never summarized
+    chat_memory_enabled: bool = False  # recall relevant older messages by similarity
+    chat_memory_embedding_provider: str = "stub"  # "stub" (offline) or "openai"
+    chat_memory_embedding_model: str = "text-embedding-3-small"
+    chat_memory_embedding_dimensions: int = 256
+    chat_memory_index_dir: str = str(TEMP_DIR / "hermes-chat-memory")
+    chat_memory_top_k: int = 5  # older messages recalled per reply
+    chat_memory_tail_messages: int = 10  # newest messages always sent with memory
+    chat_context_cache_max_entries: int = 1024
+    chat_context_cache_ttl_seconds: int = 300
+    chat_context_cache_check_seconds: int = 5  # how often workers compare versions
 
     @property
     def is_openai_enabled(self) -> bool:
         return bool(self.openai_api_key)
 
+    @property
+    def is_llm_enabled(self) -> bool:
+        """Whether replies come from an LLM rather than the echo fallback."""
+        if self.llm_provider == "openai":
+            return self.is_openai_enabled
+        return True
+
     @property
     def frontend_url(self):
         """
@@ -53,6 +147,16 @@ class Settings(BaseSettings):
         else:
             return "http://127.0.0.1:3000"
 
+    @property
+    def allowed_origins(self) -> list[str]:
+        """
+        Origins browsers may call the API from, over CORS and WebSocket.
+        """
+        return [
+            self.frontend_url,
+            "http://localhost:3000",  # development, not recommended in production
+        ]
+
     @property
     def hermes_base_url(self):
         if self.env == constants.PRODUCTION:
@@ -1,8 +1,18 @@
+import time
+from datetime import timedelta
+
+import jwt
+import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 from starlette import status
 
+from app.api.v1.auth import services as auth_services
+from app.api.v1.auth.cache import user_cache
+from app.api.v1.auth.models import User
 from app.tests.utils import create_basic_user
+from app.utils.metrics import metrics
 
 
 def test_signup(client: TestClient, dbsession: Session):
@@ -38,3 +48,78 @@ def test_login(client: TestClient, dbsession: Session):
 def test_whoami(user_client: TestClient):
     response = user_client.get("/v1/auth/whoami")
     assert response.status_code == status.HTTP_200_OK
+
+
+def test_current_user_cache(user_client: TestClient, dbsession: Session):
+    url = "/v1/auth/whoami"
+    user_client.get(url)
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = dbsession.get_bind()
+    event.listen(engine, "before_cursor_execute", count_statement)
+    try:
+        hits = metrics.get("user_cache.hits")
+        response = user_client.get(url)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statement)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert statements == []
+    assert metrics.get("user_cache.hits") == hits + 1
+
+    # changes drop the cached user
+    user = User.get(dbsession, user_client.user.id)
+    user.name = "Renamed"
+    dbsession.commit()
+    assert user_client.get(url).json()["name"] == "Renamed"
+
+    # logging out everywhere revokes the token
+    assert user_client.get(url).status_code == status.HTTP_200_OK
+    response = user_client.post("/v1/auth/logout/all")
+    assert response.status_code == status.HTTP_200_OK
+    assert user_client.get(url).status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_user_cache_is_invalidated_on_commit(dbsession: Session):
+    user, _ = create_basic_user(dbsession)
+    assert user_cache.get_user(dbsession, user.id).name == "Test"
+
+    user.name = "Renamed"
+    dbsession.flush()
+    # a concurrent request caching the row still committed before the change
+    user_cache._cache.set(user.id, {**user.to_dict(), "name": "Test"})
+    dbsession.commit()
+
+    assert user_cache.get_user(dbsession, user.id).name == "Renamed"
+
+
+def test_decode_auth_token_cache(monkeypatch: pytest.MonkeyPatch):
+    token = auth_services.create_jwt_with_expiry(
+        {"user_id": 1, "email": "test@test.com", "name": "Test"},
+        expires_delta=timedelta(minutes=5),
+    )
+    expires_at = jwt.decode(token, options={"verify_signature": False})["exp"]
+
+    decodes = []
+    decode = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decodes.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(jwt, "decode", counting_decode)
+
+    assert auth_services.decode_auth_token(token).user_id == 1
+    assert auth_services.decode_auth_token(token).user_id == 1
+    assert len(decodes) == 1
+
+    # cached tokens expire exactly when their claim says
+    monkeypatch.setattr(time, "time", lambda: expires_at - 0.001)
+    assert auth_services.decode_auth_token(token) is not None
+    monkeypatch.setattr(time, "time", lambda: expires_at)
+    assert auth_services.decode_auth_token(token) is None
+    assert len(decodes) == 1
@@ -1,7 +1,10 @@
+import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
 from starlette import status
 
+from app.settings import settings
+
 
 def test_base():
     # very basic one test
@@ -14,3 +17,29 @@ def test_health_check(client: TestClient, dbsession: Session):
 
     assert response.status_code == status.HTTP_200_OK
     assert "OK" in response.text
+
+
+def test_metrics(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "metrics_token", "metrics-secret")
+
+    response = client.get(
+        "/v1/metrics",
+        headers={"Authorization": "Bearer metrics-secret"},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert "counters" in response.json()
+
+
+def test_metrics_requires_token(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+
+    response = client.get("/v1/metrics")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    monkeypatch.setattr(settings, "metrics_token", "metrics-secret")
+
+    for headers in ({}, {"Authorization": "Bearer wrong"}):
+        response = client.get("/v1/metrics", headers=headers)
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
@@ -1,7 +1,51 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import httpx
+import numpy as np
+import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
+from sqlalchemy import event, text
 from sqlalchemy.orm import Session
 from starlette import status
+from starlette.websockets import WebSocketDisconnect
+
+from app import constants
+from app.api.v1.auth.services import create_user_access_token
+from app.api.v1.chat import idempotency, memory, services, summaries, worker
+from app.api.v1.chat.cache import context_prompt_cache
+from app.api.v1.chat.models import (
+    ChatContextPrompt,
+    ChatGenerationJob,
+    ChatMessage,
+    ChatMessageEmbedding,
+    ChatMessageTombstone,
+    Conversation,
+    SenderType,
+)
+from app.api.v1.chat.routing import choose_model
+from app.api.v1.chat.schemas import SendMessageSchema
+from app.api.v1.chat.summaries import get_chat_summary
+from app.api.v1.chat.write_buffer import ChatMessageWriteBuffer
+from app.constants import SYSTEM_CHATBOT_PROMPT
+from app.database import db, session_factory
+from app.settings import settings
+from app.tests.utils import create_basic_user
+from app.utils import http as http_utils
+from app.utils import llm_providers
+from app.utils import openai as openai_utils
+from app.utils.embeddings import get_embedder
+from app.utils.llm_providers import FakeProvider, OpenAIProvider
+from app.utils.metrics import metrics
+from app.utils.resilience import CircuitBreaker
+from app.utils.tokens import estimate_message_tokens
 
 
 def test_send_message(
@@ -20,3 +64,1562 @@ def test_send_message(
     )
 
     assert response.status_code == status.HTTP_200_OK
+
+
+def _read_sse_events(response) -> list[tuple[str, dict]]:
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_send_message_stream(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+):
+
+    url = fastapi_app.url_path_for("send_message_stream")
+
+    response = user_client.post(
+        url,
+        json={
+            "message": "Hello, world!",
+        },
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = _read_sse_events(response)
+    tokens = [data["token"] for event, data in events if event == "token"]
+    assert len(tokens) > 1
+    assert "".join(tokens) == "System says: Hello, world!"
+
+    event, data = events[-1]
+    assert event == "done"
+    assert data["bot_message"]["message"] == "System says: Hello, world!"
+
+    bot_message = dbsession.get(ChatMessage, data["bot_message"]["id"])
+    assert bot_message.sender_type == SenderType.SYSTEM
+
+
+def test_send_message_stream_with_fake_llm(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    async def fake_llm(messages: list, **kwargs):
+        assert messages[-1]["content"] == "Hi"
+        for token in ["Hello", " there", "!"]:
+            yield token
+
+    monkeypatch.setattr(settings, "openai_api_key", "fake-key")
+    monkeypatch.setattr(
+        services,
+        "async_stream_response_from_gpt_with_context",
+        fake_llm,
+    )
+
+    url = fastapi_app.url_path_for("send_message_stream")
+
+    response = user_client.post(url, json={"message": "Hi"})
+
+    events = _read_sse_events(response)
+    assert [data["token"] for event, data in events if event == "token"] == [
+        "Hello",
+        " there",
+        "!",
+    ]
+    assert events[-1][1]["bot_message"]["message"] == "Hello there!"
+
+
+@pytest.mark.parametrize("store_partial_replies", [True, False])
+def test_send_message_stream_cancelled_by_disconnect(
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+    store_partial_replies: bool,
+):
+    upstream_cancelled = []
+
+    async def fake_llm(messages: list, **kwargs):
+        yield "Hello"
+        yield " there"
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            upstream_cancelled.append(True)
+            raise
+        yield "!"
+
+    monkeypatch.setattr(settings, "openai_api_key", "fake-key")
+    monkeypatch.setattr(settings, "chat_store_partial_replies", store_partial_replies)
+    monkeypatch.setattr(
+        services,
+        "async_stream_response_from_gpt_with_context",
+        fake_llm,
+    )
+    user, _ = create_basic_user(dbsession)
+    user_id = user.id
+    conversation_id = services.resolve_conversation_id(dbsession, user_id)
+
+    async def main():
+        events = []
+        two_tokens_received = asyncio.Event()
+
+        async def consume(event_stream):
+            async for sse_event in event_stream:
+                events.append(sse_event)
+                if len(events) == 2:
+                    two_tokens_received.set()
+
+        event_stream = await services.stream_chatbot_message(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            message="Hi",
+            session=session_factory(),
+        )
+        # like Starlette does when the client goes away mid-stream
+        task = asyncio.ensure_future(consume(event_stream))
+        await two_tokens_received.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+
+    assert upstream_cancelled == [True]
+    replies = (
+        dbsession.query(ChatMessage.message)
+        .filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.sender_type == SenderType.SYSTEM,
+        )
+        .all()
+    )
+    assert replies == ([("Hello there",)] if store_partial_replies else [])
+
+
+def test_send_message_stream_closed_early_closes_upstream(
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    cancelled_streams = []
+
+    async def fake_llm(messages: list, **kwargs):
+        try:
+            yield "Hello"
+            yield " there"
+        finally:
+            cancelled_streams.append(metrics.get("chat.stream.cancelled"))
+
+    monkeypatch.setattr(settings, "openai_api_key", "fake-key")
+    monkeypatch.setattr(
+        services,
+        "async_stream_response_from_gpt_with_context",
+        fake_llm,
+    )
+    user, _ = create_basic_user(dbsession)
+    conversation_id = services.resolve_conversation_id(dbsession, user.id)
+    cancelled_before = metrics.get("chat.stream.cancelled")
+
+    async def main():
+        events = await services.stream_chatbot_events(
+            user_id=user.id,
+            conversation_id=conversation_id,
+            message="Hi",
+            session=session_factory(),
+        )
+        assert await events.__anext__() == ("token", {"token": "Hello"})
+        await events.aclose()
+
+    asyncio.run(main())
+
+    # closed along with the stream, before its cancellation is handled, and not
+    # later by the garbage collector
+    assert cancelled_streams == [cancelled_before]
+
+
+def test_chat_websocket(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    client: TestClient,
+):
+    url = fastapi_app.url_path_for("chat_websocket")
+    headers = {"origin": settings.frontend_url}
+
+    with user_client.websocket_connect(url, headers=headers) as websocket:
+        websocket.send_json({"type": "send", "message": "Hello there", "ref": "1"})
+        frames = []
+        while not frames or frames[-1]["type"] == "token":
+            frames.append(websocket.receive_json())
+
+        assert {frame["ref"] for frame in frames} == {"1"}
+        assert frames[-1]["type"] == "done"
+        tokens = [frame["token"] for frame in frames if frame["type"] == "token"]
+        assert "".join(tokens) == "System says: Hello there"
+        user_message_id = frames[-1]["user_message"]["id"]
+
+        websocket.send_json(
+            {"type": "update", "message_id": user_message_id, "message": "Edited"},
+        )
+        frame = websocket.receive_json()
+        assert frame["type"] == "updated"
+        assert frame["messages"][0]["message"] == "Edited"
+
+        websocket.send_json({"type": "update", "message_id": 0, "message": "Edited"})
+        frame = websocket.receive_json()
+        assert frame["type"] == "error"
+        assert frame["status_code"] == status.HTTP_404_NOT_FOUND
+
+        websocket.send_json({"type": "unknown"})
+        assert websocket.receive_json()["type"] == "error"
+
+        websocket.send_json({"type": "delete", "message_id": user_message_id})
+        frame = websocket.receive_json()
+        assert frame["type"] == "deleted"
+        assert [message["message"] for message in frame["messages"]] == [
+            "System says: Hello there",
+        ]
+
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect(url, headers=headers):
+            pass
+    assert e.value.code == status.WS_1008_POLICY_VIOLATION
+
+    # another site opening the socket with the visitor's credentials
+    with pytest.raises(WebSocketDisconnect) as e:
+        with user_client.websocket_connect(
+            url,
+            headers={"origin": "https://evil.example.com"},
+        ):
+            pass
+    assert e.value.code == status.WS_1008_POLICY_VIOLATION
+
+    # clients other than browsers send no Origin, only their bearer token
+    with user_client.websocket_connect(url) as websocket:
+        websocket.send_json({"type": "send", "message": "Hi", "ref": "1"})
+        frames = [websocket.receive_json()]
+        while frames[-1]["type"] == "token":
+            frames.append(websocket.receive_json())
+        assert frames[-1]["type"] == "done"
+
+
+def test_chat_websocket_survives_unexpected_errors(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    def broken_update(**kwargs):
+        raise RuntimeError("Database went away")
+
+    monkeypatch.setattr(services, "update_chat_message", broken_update)
+
+    url = fastapi_app.url_path_for("chat_websocket")
+    headers = {"origin": settings.frontend_url}
+
+    with user_client.websocket_connect(url, headers=headers) as websocket:
+        websocket.send_json(
+            {"type": "update", "message_id": 1, "message": "Edited", "ref": "1"},
+        )
+        frame = websocket.receive_json()
+        assert frame["type"] == "error"
+        assert frame["ref"] == "1"
+        assert frame["status_code"] == status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        # the connection is still usable
+        websocket.send_json({"type": "send", "message": "Hello there"})
+        frames = []
+        while not frames or frames[-1]["type"] == "token":
+            frames.append(websocket.receive_json())
+        assert frames[-1]["type"] == "done"
+
+
+def test_send_message_with_async_fake_llm(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    async def fake_llm(messages: list, **kwargs) -> str:
+        await asyncio.sleep(0.01)
+        return f"You said: {messages[-1]['content']}"
+
+    monkeypatch.setattr(settings, "openai_api_key", "fake-key")
+    monkeypatch.setattr(services, "async_get_response_from_gpt_with_context", fake_llm)
+
+    url = fastapi_app.url_path_for("send_message")
+
+    response = user_client.post(url, json={"message": "Hi"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["user_message"]["message"] == "Hi"
+    assert response.json()["bot_message"]["message"] == "You said: Hi"
+
+
+def test_send_message_falls_back_to_echo_while_circuit_is_open(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    upstream = {"calls": 0, "failing": False}
+
+    def fake_openai_server(request: httpx.Request) -> httpx.Response:
+        upstream["calls"] += 1
+        if upstream["failing"]:
+            return httpx.Response(503, json={"error": {"message": "Overloaded"}})
+        return httpx.Response(
+            200,
+            json={
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": 0,
+                "model": settings.llm_model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "Hello there!"},
+                        "finish_reason": "stop",
+                    },
+                ],
+            },
+        )
+
+    monkeypatch.setattr(settings, "openai_api_key", "fake-key")
+    monkeypatch.setattr(settings, "llm_max_attempts", 2)
+    monkeypatch.setattr(settings, "llm_backoff_base_seconds", 0.001)
+    monkeypatch.setitem(
+        llm_providers._providers,
+        "openai",
+        OpenAIProvider(
+            AsyncOpenAI(
+                api_key="fake-key",
+                base_url="http://fake-openai/v1",
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    transport=httpx.MockTransport(fake_openai_server),
+                ),
+            ),
+        ),
+    )
+    monkeypatch.setattr(
+        openai_utils,
+        "llm_circuit_breaker",
+        CircuitBreaker("test_llm_circuit", failure_threshold=1, reset_seconds=60),
+    )
+
+    url = fastapi_app.url_path_for("send_message")
+
+    response = user_client.post(url, json={"message": "Hi"})
+    assert response.json()["bot_message"]["message"] == "Hello there!"
+
+    upstream["failing"] = True
+    response = user_client.post(url, json={"message": "Unanswered"})
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
+    # the message is kept without a reply, as when streaming
+    history = user_client.get(fastapi_app.url_path_for("get_chat_history")).json()
+    assert [message["message"] for message in history["messages"]][-2:] == [
+        "Hello there!",
+        "Unanswered",
+    ]
+    # the failed call was retried once
+    assert upstream["calls"] == 3
+
+    response = user_client.post(url, json={"message": "Hi"})
+    assert response.json()["bot_message"]["message"] == "System says: Hi"
+    assert upstream["calls"] == 3
+
+
+def test_send_message_past_deadline(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "llm_provider", "fake")
+    monkeypatch.setitem(
+        llm_providers._providers,
+        "fake",
+        FakeProvider(latency_mean_seconds=0.01, response_tokens=4, seed=1),
+    )
+    # lets the header spend the whole budget before the LLM is called
+    monkeypatch.setattr(http_utils, "REQUEST_TIMEOUT_MIN_SECONDS", 0)
+
+    response = user_client.post(
+        fastapi_app.url_path_for("send_message"),
+        json={"message": "Hi"},
+        headers={constants.REQUEST_TIMEOUT_HEADER: "0"},
+    )
+
+    assert response.status_code == status.HTTP_504_GATEWAY_TIMEOUT
+    assert response.json() == {"detail": "Timed out."}
+
+
+def test_send_message_with_fake_provider(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "llm_provider", "fake")
+    monkeypatch.setitem(
+        llm_providers._providers,
+        "fake",
+        FakeProvider(latency_mean_seconds=0.01, response_tokens=4, seed=1),
+    )
+
+    latency_metric = f"llm.{settings.llm_model}.latency_seconds"
+    stream_open_metric = f"llm.{settings.llm_model}.stream_open_seconds"
+    latencies = metrics.timing(latency_metric)["count"]
+    stream_opens = metrics.timing(stream_open_metric)["count"]
+
+    response = user_client.post(
+        fastapi_app.url_path_for("send_message"),
+        json={"message": "ping pong"},
+    )
+    assert response.json()["bot_message"]["message"] == "ping pong ping pong"
+
+    response = user_client.post(
+        fastapi_app.url_path_for("send_message_stream"),
+        json={"message": "ping pong"},
+    )
+    events = _read_sse_events(response)
+    assert [data["token"] for event, data in events if event == "token"] == [
+        "ping ",
+        "pong ",
+        "ping ",
+        "pong",
+    ]
+    # streams do not skew the latency of whole completions
+    assert metrics.timing(latency_metric)["count"] == latencies + 1
+    assert metrics.timing(stream_open_metric)["count"] == stream_opens + 1
+
+
+def test_concurrent_identical_sends_share_one_llm_call(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    llm_calls = []
+
+    async def fake_llm(messages: list, **kwargs) -> str:
+        llm_calls.append(messages)
+        await asyncio.sleep(0.1)
+        return "Reply"
+
+    monkeypatch.setattr(settings, "openai_api_key", "fake-key")
+    monkeypatch.setattr(services, "async_get_response_from_gpt_with_context", fake_llm)
+
+    url = fastapi_app.url_path_for("send_message")
+    # creates the default conversation
+    user_client.post(url, json={"message": "First"})
+    llm_calls.clear()
+
+    # concurrent requests need sessions of their own
+    def session_gen():
+        session = session_factory()
+        try:
+            yield session
+            session.commit()
+        finally:
+            session.close()
+
+    fastapi_app.dependency_overrides[db] = session_gen
+
+    async def double_submit() -> list:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=fastapi_app),
+            base_url="http://test",
+            headers=user_client.headers,
+        ) as client:
+            return await asyncio.gather(
+                client.post(url, json={"message": "Again"}),
+                client.post(url, json={"message": "Again"}),
+            )
+
+    responses = asyncio.run(double_submit())
+
+    assert [response.status_code for response in responses] == [
+        status.HTTP_200_OK,
+        status.HTTP_200_OK,
+    ]
+    assert [response.json()["bot_message"]["message"] for response in responses] == [
+        "Reply",
+        "Reply",
+    ]
+    assert len(llm_calls) == 1
+
+
+def test_send_message_statements(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    in_transaction_during_llm_call = []
+    newest_context_messages = []
+
+    async def fake_llm(messages: list, **kwargs):
+        in_transaction_during_llm_call.append(dbsession.in_transaction())
+        newest_context_messages.append(messages[-1])
+        return "Reply"
+
+    monkeypatch.setattr(settings, "openai_api_key", "fake-key")
+    monkeypatch.setattr(
+        services,
+        "async_get_response_from_gpt_with_context",
+        fake_llm,
+    )
+
+    url = fastapi_app.url_path_for("send_message")
+    # creates the default conversation
+    user_client.post(url, json={"message": "First"})
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement.split()[0])
+
+    def count_commit(conn):
+        statements.append("COMMIT")
+
+    engine = dbsession.get_bind()
+    event.listen(engine, "before_cursor_execute", count_statement)
+    event.listen(engine, "commit", count_commit)
+    try:
+        response = user_client.post(url, json={"message": "Second"})
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statement)
+        event.remove(engine, "commit", count_commit)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["bot_message"]["message"] == "Reply"
+    assert in_transaction_during_llm_call == [False, False]
+    # the message is in the context before it is saved
+    assert newest_context_messages[-1] == {"role": "user", "content": "Second"}
+    assert statements == [
+        # conversation, the user is cached
+        "SELECT",
+        "COMMIT",
+        # summary, context messages
+        "SELECT",
+        "SELECT",
+        "COMMIT",
+        # both messages, after the LLM call
+        "INSERT",
+        "COMMIT",
+    ]
+
+
+def test_chat_write_buffer_group_commits(dbsession: Session):
+    user, _ = create_basic_user(dbsession)
+    conversation_id = services.resolve_conversation_id(dbsession, user.id)
+    dbsession.commit()
+
+    def row(message: str) -> dict:
+        return services.make_chat_message_row(
+            user.id,
+            conversation_id,
+            SenderType.USER,
+            message,
+        )
+
+    # only a full batch or the shutdown can trigger a flush within the test
+    write_buffer = ChatMessageWriteBuffer(max_rows=6, max_delay_seconds=60)
+    flushes = metrics.get("chat_write_buffer.flushes")
+
+    async def main():
+        write_buffer.start()
+        saved = await asyncio.wait_for(
+            asyncio.gather(
+                *[
+                    write_buffer.save([row(f"Message {index}"), row(f"Reply {index}")])
+                    for index in range(3)
+                ],
+            ),
+            timeout=5,
+        )
+
+        # read-your-writes: committed once the save returns
+        session = session_factory()
+        try:
+            assert (
+                session.query(ChatMessage)
+                .filter(
+                    ChatMessage.user_id == user.id,
+                )
+                .count()
+                == 6
+            )
+        finally:
+            session.close()
+
+        last = asyncio.ensure_future(write_buffer.save([row("Last")]))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(write_buffer.stop(), timeout=5)
+        return saved, await last
+
+    saved, last = asyncio.run(main())
+
+    assert metrics.get("chat_write_buffer.flushes") == flushes + 2
+    assert [
+        [chat_message.message for chat_message in chat_messages]
+        for chat_messages in saved
+    ] == [[f"Message {index}", f"Reply {index}"] for index in range(3)]
+    ids = [chat_message.id for chat_messages in saved for chat_message in chat_messages]
+    assert ids == sorted(ids)
+    assert [chat_message.message for chat_message in last] == ["Last"]
+    assert not write_buffer.running
+
+
+def test_chat_write_buffer_isolates_failing_saves(dbsession: Session):
+    user, _ = create_basic_user(dbsession)
+    conversation_id = services.resolve_conversation_id(dbsession, user.id)
+    dbsession.commit()
+
+    def row(message: str) -> dict:
+        return services.make_chat_message_row(
+            user.id,
+            conversation_id,
+            SenderType.USER,
+            message,
+        )
+
+    write_buffer = ChatMessageWriteBuffer(max_rows=3, max_delay_seconds=60)
+
+    async def main():
+        write_buffer.start()
+        saved = await asyncio.wait_for(
+            asyncio.gather(
+                write_buffer.save([row("Before")]),
+                # Postgres rejects NUL characters in text
+                write_buffer.save([row("Bad \x00")]),
+                write_buffer.save([row("After")]),
+                return_exceptions=True,
+            ),
+            timeout=5,
+        )
+        await write_buffer.stop()
+        return saved
+
+    before, bad, after = asyncio.run(main())
+
+    assert [chat_message.message for chat_message in before] == ["Before"]
+    assert isinstance(bad, Exception)
+    assert [chat_message.message for chat_message in after] == ["After"]
+
+
+def test_model_routing(
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    user, _ = create_basic_user(dbsession)
+    user.tier = "pro"
+    dbsession.commit()
+
+    model = f"slow-model-{uuid.uuid4().hex}"
+    monkeypatch.setattr(
+        settings,
+        "llm_routes",
+        [
+            {"model": "long-model", "min_prompt_tokens": 1000},
+            {"model": model, "user_tiers": ["pro"]},
+        ],
+    )
+    monkeypatch.setattr(settings, "llm_fallback_model", "fast-model")
+    monkeypatch.setattr(settings, "llm_latency_slo_seconds", 2)
+    monkeypatch.setattr(settings, "llm_latency_slo_probe_rate", 0)
+
+    short_prompt = [{"role": "user", "content": "Hi"}]
+    long_prompt = [{"role": "user", "content": "word " * 2000}]
+
+    assert choose_model(dbsession, user.id, None, long_prompt) == "long-model"
+    assert choose_model(dbsession, user.id, None, short_prompt) == model
+
+    for _ in range(settings.llm_latency_slo_min_samples):
+        metrics.observe(f"llm.{model}.latency_seconds", 3)
+    assert choose_model(dbsession, user.id, None, short_prompt) == "fast-model"
+
+    user.tier = constants.USER_TIER_FREE
+    dbsession.commit()
+    assert choose_model(dbsession, user.id, None, short_prompt) == settings.llm_model
+
+
+def test_chat_context_respects_token_budget(
+    user_client: TestClient,
+    dbsession: Session,
+):
+    user_id = user_client.user.id
+    conversation_id = services.resolve_conversation_id(dbsession, user_id)
+    for index in range(120):
+        dbsession.add(
+            ChatMessage(
+                sender_type=SenderType.USER if index % 2 else SenderType.SYSTEM,
+                user_id=user_id,
+                conversation_id=conversation_id,
+                message=f"message number {index} " + "word " * 20,
+            ),
+        )
+    dbsession.commit()
+
+    messages = services.build_chat_context_messages(
+        session=dbsession,
+        user_id=user_id,
+        conversation_id=conversation_id,
+        token_budget=500,
+    )
+
+    assert messages[0] == {"role": "system", "content": SYSTEM_CHATBOT_PROMPT}
+    assert messages[-1]["content"].startswith("message number 119 ")
+    assert 1 < len(messages) < 120
+    assert sum(estimate_message_tokens(message) for message in messages) <= 500
+
+    messages = services.build_chat_context_messages(
+        session=dbsession,
+        user_id=user_id,
+        conversation_id=conversation_id,
+        token_budget=1,
+    )
+
+    assert len(messages) == 2
+    assert messages[-1]["content"].startswith("message number 119 ")
+
+
+def test_chat_memory_recalls_relevant_messages(
+    user_client: TestClient,
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path,
+):
+    monkeypatch.setattr(settings, "chat_memory_enabled", True)
+    monkeypatch.setattr(settings, "chat_memory_index_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "chat_memory_tail_messages", 4)
+    monkeypatch.setattr(settings, "chat_memory_top_k", 1)
+
+    user_id = user_client.user.id
+    conversation_id = services.resolve_conversation_id(dbsession, user_id)
+    other_conversation_id = services.create_conversation(user_id, dbsession).id
+    dbsession.add(
+        ChatMessage(
+            sender_type=SenderType.USER,
+            user_id=user_id,
+            conversation_id=conversation_id,
+            message="My cat is called Tom and he loves tuna",
+        ),
+    )
+    # closer to the query, but part of another conversation
+    dbsession.add(
+        ChatMessage(
+            sender_type=SenderType.USER,
+            user_id=user_id,
+            conversation_id=other_conversation_id,
+            message="What is my cat called?",
+        ),
+    )
+    for index in range(30):
+        dbsession.add(
+            ChatMessage(
+                sender_type=SenderType.USER,
+                user_id=user_id,
+                conversation_id=conversation_id,
+                message=f"unrelated message number {index}",
+            ),
+        )
+    dbsession.commit()
+
+    asyncio.run(memory.embed_chat_messages(user_id))
+    query_vector = asyncio.run(memory.embed_query("What is my cat called?"))
+
+    messages = services.build_chat_context_messages(
+        session=dbsession,
+        user_id=user_id,
+        conversation_id=conversation_id,
+        query_vector=query_vector,
+    )
+
+    assert messages[1] == {
+        "role": "system",
+        "content": "Relevant earlier messages:\nUser: My cat is called Tom and he loves tuna",
+    }
+    assert [message["content"] for message in messages[2:]] == [
+        f"unrelated message number {index}" for index in range(26, 30)
+    ]
+
+
+def test_chat_memory_index_picks_up_embeddings_committed_late(
+    user_client: TestClient,
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path,
+):
+    monkeypatch.setattr(settings, "chat_memory_enabled", True)
+    monkeypatch.setattr(settings, "chat_memory_index_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "chat_memory_top_k", 1)
+
+    user_id = user_client.user.id
+    conversation_id = services.resolve_conversation_id(dbsession, user_id)
+    chat_messages = [
+        ChatMessage(
+            sender_type=SenderType.USER,
+            user_id=user_id,
+            conversation_id=conversation_id,
+            message=message,
+        )
+        for message in ["My cat is called Tom", "The weather is nice"]
+    ]
+    dbsession.add_all(chat_messages)
+    dbsession.commit()
+
+    embedder = get_embedder()
+    vectors = asyncio.run(
+        embedder.embed([message.message for message in chat_messages])
+    )
+    # two concurrent inserts, the one with the lower id commits last
+    late_id, early_id = [
+        dbsession.scalar(
+            text(
+                "SELECT nextval("
+                "pg_get_serial_sequence('chat_message_embeddings', 'id'))",
+            ),
+        )
+        for _ in range(2)
+    ]
+
+    def save_embedding(embedding_id, chat_message, vector):
+        dbsession.add(
+            ChatMessageEmbedding(
+                id=embedding_id,
+                user_id=user_id,
+                message_id=chat_message.id,
+                model=embedder.model,
+                embedding=vector.astype(np.float32).tobytes(),
+            ),
+        )
+        dbsession.commit()
+
+    query_vector = asyncio.run(memory.embed_query("What is my cat called?"))
+
+    save_embedding(early_id, chat_messages[1], vectors[1])
+    recalled = memory.recall_chat_messages(
+        dbsession,
+        user_id,
+        conversation_id,
+        query_vector,
+    )
+    assert [message.message for message in recalled] == ["The weather is nice"]
+
+    save_embedding(late_id, chat_messages[0], vectors[0])
+    recalled = memory.recall_chat_messages(
+        dbsession,
+        user_id,
+        conversation_id,
+        query_vector,
+    )
+    assert [message.message for message in recalled] == ["My cat is called Tom"]
+
+
+def test_chat_summary_is_rolled_and_invalidated(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "chat_summary_threshold_messages", 4)
+    monkeypatch.setattr(settings, "chat_summary_tail_messages", 2)
+
+    url = fastapi_app.url_path_for("send_message")
+    responses = [
+        user_client.post(url, json={"message": f"Message {index}"}).json()
+        for index in range(3)
+    ]
+
+    user_id = user_client.user.id
+    conversation_id = responses[0]["user_message"]["conversation_id"]
+    chat_summary = get_chat_summary(dbsession, conversation_id)
+    assert chat_summary.last_message_id == responses[1]["bot_message"]["id"]
+    assert "User: Message 0" in chat_summary.summary
+    assert "Message 2" not in chat_summary.summary
+
+    messages = services.build_chat_context_messages(
+        session=dbsession,
+        user_id=user_id,
+        conversation_id=conversation_id,
+    )
+    assert [message["role"] for message in messages] == [
+        "system",
+        "system",
+        "user",
+        "assistant",
+    ]
+    assert messages[2]["content"] == "Message 2"
+
+    response = user_client.put(
+        fastapi_app.url_path_for("update_chat_history"),
+        json={
+            "message_id": responses[0]["user_message"]["id"],
+            "message": "Edited message",
+        },
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    dbsession.expire_all()
+    assert get_chat_summary(dbsession, conversation_id) is None
+
+
+def test_chat_summary_of_messages_edited_meanwhile_is_dropped(
+    user_client: TestClient,
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "chat_summary_threshold_messages", 2)
+    monkeypatch.setattr(settings, "chat_summary_tail_messages", 1)
+
+    user_id = user_client.user.id
+    conversation_id = services.resolve_conversation_id(dbsession, user_id)
+    chat_messages = [
+        ChatMessage(
+            sender_type=SenderType.USER,
+            user_id=user_id,
+            conversation_id=conversation_id,
+            message=f"Message {index}",
+        )
+        for index in range(3)
+    ]
+    dbsession.add_all(chat_messages)
+    dbsession.commit()
+
+    generate_chat_summary = summaries.generate_chat_summary
+
+    async def generate_while_editing(user_id, previous_summary, messages):
+        summary = await generate_chat_summary(user_id, previous_summary, messages)
+        services.update_chat_message(
+            user=user_client.user,
+            message_id=chat_messages[0].id,
+            new_message="Edited message",
+            session=dbsession,
+        )
+        return summary
+
+    monkeypatch.setattr(summaries, "generate_chat_summary", generate_while_editing)
+    asyncio.run(summaries.summarize_chat_history(user_id, conversation_id))
+
+    dbsession.expire_all()
+    assert get_chat_summary(dbsession, conversation_id) is None
+
+    monkeypatch.setattr(summaries, "generate_chat_summary", generate_chat_summary)
+    asyncio.run(summaries.summarize_chat_history(user_id, conversation_id))
+
+    summary = get_chat_summary(dbsession, conversation_id).summary
+    assert "User: Edited message" in summary
+
+
+def test_chat_history_keyset_pagination(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+):
+    conversation_id = services.resolve_conversation_id(dbsession, user_client.user.id)
+    for index in range(5):
+        dbsession.add(
+            ChatMessage(
+                sender_type=SenderType.USER,
+                user_id=user_client.user.id,
+                conversation_id=conversation_id,
+                message=f"Message {index}",
+            ),
+        )
+    dbsession.commit()
+
+    url = fastapi_app.url_path_for("get_chat_history")
+
+    page = user_client.get(url, params={"limit": 2}).json()
+    assert [message["message"] for message in page["messages"]] == [
+        "Message 3",
+        "Message 4",
+    ]
+    assert page["has_more"] is True
+
+    first_id = page["messages"][0]["id"]
+    page = user_client.get(url, params={"limit": 2, "before_id": first_id}).json()
+    assert [message["message"] for message in page["messages"]] == [
+        "Message 1",
+        "Message 2",
+    ]
+    assert page["has_more"] is True
+
+    page = user_client.get(url, params={"limit": 3, "after_id": first_id}).json()
+    assert [message["message"] for message in page["messages"]] == ["Message 4"]
+    assert page["has_more"] is False
+
+    response = user_client.get(url, params={"before_id": 1, "after_id": 1})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = user_client.put(
+        fastapi_app.url_path_for("update_chat_history"),
+        json={"message_id": first_id, "message": "Edited"},
+    )
+    assert [message["message"] for message in response.json()["messages"]] == [
+        "Edited",
+    ]
+
+
+def test_conversations_scope_history_and_context(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+):
+    conversations_url = fastapi_app.url_path_for("list_conversations")
+    send_url = fastapi_app.url_path_for("send_message")
+    history_url = fastapi_app.url_path_for("get_chat_history")
+
+    default = user_client.post(send_url, json={"message": "In the default"}).json()
+    default_id = default["user_message"]["conversation_id"]
+
+    response = user_client.post(conversations_url, json={"title": "Trip"})
+    assert response.status_code == status.HTTP_201_CREATED
+    trip_id = response.json()["id"]
+
+    response = user_client.post(
+        send_url,
+        json={"message": "About the trip", "conversation_id": trip_id},
+    )
+    assert response.json()["bot_message"]["conversation_id"] == trip_id
+
+    page = user_client.get(history_url).json()
+    assert [message["message"] for message in page["messages"]] == [
+        "In the default",
+        "System says: In the default",
+    ]
+    page = user_client.get(history_url, params={"conversation_id": trip_id}).json()
+    assert [message["message"] for message in page["messages"]] == [
+        "About the trip",
+        "System says: About the trip",
+    ]
+
+    messages = services.build_chat_context_messages(
+        session=dbsession,
+        user_id=user_client.user.id,
+        conversation_id=trip_id,
+    )
+    assert [message["content"] for message in messages[1:]] == [
+        "About the trip",
+        "System says: About the trip",
+    ]
+
+    page = user_client.get(conversations_url, params={"limit": 1}).json()
+    assert [conversation["id"] for conversation in page["conversations"]] == [trip_id]
+    assert page["conversations"][0]["title"] == "Trip"
+    assert page["has_more"] is True
+    page = user_client.get(
+        conversations_url,
+        params={"limit": 1, "before_id": trip_id},
+    ).json()
+    assert [conversation["id"] for conversation in page["conversations"]] == [
+        default_id,
+    ]
+    assert page["has_more"] is False
+
+    response = user_client.request(
+        "DELETE",
+        fastapi_app.url_path_for("delete_chat_history"),
+        json={"message_id": 0, "delete_all": True, "conversation_id": trip_id},
+    )
+    assert response.json()["messages"] == []
+    page = user_client.get(history_url).json()
+    assert len(page["messages"]) == 2
+
+    other_user, _ = create_basic_user(dbsession)
+    other_conversation_id = services.resolve_conversation_id(dbsession, other_user.id)
+    response = user_client.post(
+        send_url,
+        json={"message": "Hi", "conversation_id": other_conversation_id},
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = user_client.get(
+        history_url,
+        params={"conversation_id": other_conversation_id},
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_default_conversation_is_created_once(dbsession: Session):
+    user, _ = create_basic_user(dbsession)
+    barrier = threading.Barrier(4)
+
+    def first_use() -> int:
+        session = session_factory()
+        try:
+            barrier.wait()
+            return services.resolve_conversation_id(session, user.id)
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        conversation_ids = list(executor.map(lambda _: first_use(), range(4)))
+
+    assert len(set(conversation_ids)) == 1
+    assert (
+        dbsession.query(Conversation).filter(Conversation.user_id == user.id).count()
+        == 1
+    )
+
+
+def test_chat_search(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+):
+    other_user, _ = create_basic_user(dbsession)
+    for user_id, message in [
+        (user_client.user.id, "The cat sat on the mat"),
+        (user_client.user.id, "Dogs are running in the park"),
+        (user_client.user.id, "A cat and another cat, cats everywhere"),
+        (other_user.id, "My cat is not yours"),
+        (user_client.user.id, "<img src=x onerror=alert(1)> \x02dog"),
+    ]:
+        dbsession.add(
+            ChatMessage(
+                sender_type=SenderType.USER,
+                user_id=user_id,
+                conversation_id=services.resolve_conversation_id(dbsession, user_id),
+                message=message,
+            ),
+        )
+    dbsession.commit()
+
+    url = fastapi_app.url_path_for("search_chat_history")
+
+    page = user_client.get(url, params={"q": "cats"}).json()
+    assert [result["message"]["message"] for result in page["results"]] == [
+        "A cat and another cat, cats everywhere",
+        "The cat sat on the mat",
+    ]
+    assert page["results"][0]["rank"] > page["results"][1]["rank"]
+    assert "<mark>cat</mark>" in page["results"][1]["highlight"]
+    assert page["has_more"] is False
+
+    page = user_client.get(url, params={"q": "cat", "limit": 1}).json()
+    assert len(page["results"]) == 1
+    assert page["has_more"] is True
+
+    page = user_client.get(url, params={"q": "cat", "limit": 1, "offset": 1}).json()
+    assert [result["message"]["message"] for result in page["results"]] == [
+        "The cat sat on the mat",
+    ]
+    assert page["has_more"] is False
+
+    page = user_client.get(url, params={"q": "cat -mat"}).json()
+    assert len(page["results"]) == 1
+
+    # highlights are rendered as HTML, markup in messages is escaped
+    page = user_client.get(url, params={"q": "dog"}).json()
+    highlight = page["results"][0]["highlight"]
+    assert highlight.endswith("&gt; <mark>dog</mark>")
+    assert "<" not in highlight.replace("<mark>", "").replace("</mark>", "")
+
+    response = user_client.get(url, params={"q": ""})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_chat_sync_returns_only_changes(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+):
+    # deleted long ago, pruned with the next delete
+    dbsession.add(
+        ChatMessageTombstone(
+            user_id=user_client.user.id,
+            message_id=0,
+            created_at=datetime(2000, 1, 1),
+        ),
+    )
+    dbsession.commit()
+
+    send_url = fastapi_app.url_path_for("send_message")
+    sync_url = fastapi_app.url_path_for("sync_chat_history")
+
+    first = user_client.post(send_url, json={"message": "First"}).json()
+
+    watermark = user_client.get(sync_url).json()
+    assert len(watermark["messages"]) == 2
+    assert watermark["since_id"] == first["bot_message"]["id"]
+
+    params = {"since_id": watermark["since_id"], "since": watermark["since"]}
+    sync = user_client.get(sync_url, params=params).json()
+    assert sync["messages"] == []
+    assert sync["deleted_message_ids"] == []
+
+    second = user_client.post(send_url, json={"message": "Second"}).json()
+    user_client.put(
+        fastapi_app.url_path_for("update_chat_history"),
+        json={"message_id": first["user_message"]["id"], "message": "Edited"},
+    )
+    user_client.request(
+        "DELETE",
+        fastapi_app.url_path_for("delete_chat_history"),
+        json={"message_id": first["bot_message"]["id"]},
+    )
+
+    sync = user_client.get(sync_url, params=params).json()
+    assert [message["message"] for message in sync["messages"]] == [
+        "Edited",
+        "Second",
+        "System says: Second",
+    ]
+    assert sync["deleted_message_ids"] == [first["bot_message"]["id"]]
+    assert sync["since_id"] == second["bot_message"]["id"]
+    assert sync["since"] > watermark["since"]
+    assert sync["has_more"] is False
+    assert (
+        dbsession.query(ChatMessageTombstone)
+        .filter(ChatMessageTombstone.user_id == user_client.user.id)
+        .count()
+        == 1
+    )
+
+    # a page at a time, the watermark of the last page covers them all
+    pages = []
+    page_params = {**params, "limit": 1}
+    while True:
+        page = user_client.get(sync_url, params=page_params).json()
+        pages.append(page)
+        if not page["has_more"]:
+            break
+        page_params["cursor"] = page["cursor"]
+    assert [message["message"] for page in pages for message in page["messages"]] == [
+        "Edited",
+        "Second",
+        "System says: Second",
+    ]
+    assert [
+        message_id for page in pages for message_id in page["deleted_message_ids"]
+    ] == [first["bot_message"]["id"]]
+    assert pages[-1]["since_id"] == sync["since_id"]
+    assert pages[-1]["since"] == sync["since"]
+
+    response = user_client.get(sync_url, params={**params, "cursor": "nope"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # deletes are only tracked by time
+    response = user_client.get(sync_url, params={"since_id": params["since_id"]})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # deletes are not kept forever, older watermarks have to reload the history
+    response = user_client.get(sync_url, params={"since_id": 0, "since": 1})
+    assert response.status_code == status.HTTP_410_GONE
+
+
+def test_chat_sync_watermark_does_not_depend_on_host_timezone(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    send_url = fastapi_app.url_path_for("send_message")
+    sync_url = fastapi_app.url_path_for("sync_chat_history")
+
+    first = user_client.post(send_url, json={"message": "First"}).json()
+    watermark = user_client.get(sync_url).json()
+    user_client.put(
+        fastapi_app.url_path_for("update_chat_history"),
+        json={"message_id": first["user_message"]["id"], "message": "Edited"},
+    )
+
+    # the next sync is served by a worker in another timezone
+    monkeypatch.setenv("TZ", "Asia/Tokyo")
+    time.tzset()
+    try:
+        sync = user_client.get(
+            sync_url,
+            params={"since_id": watermark["since_id"], "since": watermark["since"]},
+        ).json()
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+    assert [message["message"] for message in sync["messages"]] == ["Edited"]
+
+
+def test_chat_history_etag(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+):
+    url = fastapi_app.url_path_for("get_chat_history")
+
+    response = user_client.get(url)
+    etag = response.headers["ETag"]
+
+    response = user_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+
+    user_client.post(fastapi_app.url_path_for("send_message"), json={"message": "Hi"})
+
+    response = user_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["ETag"] != etag
+    assert len(response.json()["messages"]) == 2
+
+    response = user_client.get(
+        url,
+        params={"limit": 1},
+        headers={"If-None-Match": response.headers["ETag"]},
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test_chat_context_prompts_etag(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+):
+    url = fastapi_app.url_path_for("get_chat_context_prompts")
+
+    response = user_client.get(url)
+    assert response.headers["Cache-Control"].startswith("private, max-age=")
+    etag = response.headers["ETag"]
+
+    response = user_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    dbsession.add(ChatContextPrompt(title="Pirate", prompt="Talk like a pirate."))
+    dbsession.commit()
+
+    response = user_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()[-1]["title"] == "Pirate"
+
+
+def test_chat_context_prompt_cache(
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    context = ChatContextPrompt(title="Poet", prompt="Answer in rhymes.")
+    dbsession.add(context)
+    dbsession.commit()
+
+    context_prompt_cache.warm(dbsession)
+    hits = metrics.get("chat_context_prompts_cache.hits")
+
+    assert context_prompt_cache.get_prompt(dbsession, context.id) == "Answer in rhymes."
+    assert context_prompt_cache.get_prompt(dbsession, 0) is None
+    assert metrics.get("chat_context_prompts_cache.hits") == hits + 1
+
+    # an edit made by another worker is picked up by the version check
+    dbsession.execute(
+        ChatContextPrompt.__table__.update()
+        .where(ChatContextPrompt.id == context.id)
+        .values(prompt="Answer in haikus.", updated_at=datetime.now()),
+    )
+    dbsession.commit()
+    monkeypatch.setattr(context_prompt_cache, "check_interval", 0)
+    assert context_prompt_cache.get_prompt(dbsession, context.id) == "Answer in haikus."
+
+
+@pytest.mark.parametrize("backend", ["memory", "postgres"])
+def test_llm_response_cache(
+    backend: str,
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    llm_calls = []
+
+    async def fake_llm(messages: list, **kwargs) -> str:
+        llm_calls.append(messages)
+        return "Cached hello!"
+
+    monkeypatch.setattr(settings, "openai_api_key", "fake-key")
+    monkeypatch.setattr(settings, "llm_response_cache_backend", backend)
+    monkeypatch.setattr(services, "async_get_response_from_gpt_with_context", fake_llm)
+
+    opening_message = f"Hello {uuid.uuid4()}"
+    url = fastapi_app.url_path_for("send_message")
+
+    for _ in range(2):
+        other_user, _ = create_basic_user(dbsession)
+        response = user_client.post(
+            url,
+            json={"message": opening_message},
+            headers={
+                "Authorization": f"Bearer {create_user_access_token(other_user)}",
+            },
+        )
+        assert response.json()["bot_message"]["message"] == "Cached hello!"
+
+    assert len(llm_calls) == 1
+
+    context = ChatContextPrompt(
+        title="Fresh", prompt="Never cached.", cache_responses=False
+    )
+    dbsession.add(context)
+    dbsession.commit()
+
+    for _ in range(2):
+        other_user, _ = create_basic_user(dbsession)
+        user_client.post(
+            url,
+            json={"message": opening_message, "context_id": context.id},
+            headers={
+                "Authorization": f"Bearer {create_user_access_token(other_user)}",
+            },
+        )
+
+    assert len(llm_calls) == 3
+
+
+def test_send_message_idempotency_key(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    llm_calls = []
+
+    async def fake_llm(messages: list, **kwargs) -> str:
+        llm_calls.append(messages)
+        return "Only once!"
+
+    monkeypatch.setattr(settings, "openai_api_key", "fake-key")
+    monkeypatch.setattr(services, "async_get_response_from_gpt_with_context", fake_llm)
+
+    url = fastapi_app.url_path_for("send_message")
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+
+    first = user_client.post(url, json={"message": "Hi"}, headers=headers)
+    retry = user_client.post(url, json={"message": "Hi"}, headers=headers)
+
+    assert first.status_code == status.HTTP_200_OK
+    assert retry.json() == first.json()
+    assert len(llm_calls) == 1
+    assert (
+        dbsession.query(ChatMessage)
+        .filter(ChatMessage.user_id == user_client.user.id)
+        .count()
+        == 2
+    )
+
+    response = user_client.post(url, json={"message": "Bye"}, headers=headers)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_send_message_idempotency_key_in_progress(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    key = str(uuid.uuid4())
+    claimed, _ = idempotency.claim_idempotency_key(
+        session=dbsession,
+        user_id=user_client.user.id,
+        key=key,
+        request_hash=idempotency.hash_request(
+            SendMessageSchema(message="Hi").model_dump_json(),
+        ),
+    )
+    assert claimed
+
+    # the original request is still running, and the retry does not wait for it
+    monkeypatch.setattr(settings, "idempotency_wait_seconds", 0)
+
+    response = user_client.post(
+        fastapi_app.url_path_for("send_message"),
+        json={"message": "Hi"},
+        headers={"Idempotency-Key": key},
+    )
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+def test_send_message_in_background(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+):
+    response = user_client.post(
+        fastapi_app.url_path_for("send_message"),
+        json={"message": "Take your time", "background": True},
+    )
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    job = response.json()
+    assert job["status"] == "PENDING"
+    assert job["user_message"]["message"] == "Take your time"
+
+    job_url = fastapi_app.url_path_for("get_generation_job", job_id=job["job_id"])
+    assert user_client.get(job_url).json()["status"] == "PENDING"
+
+    claimed_job = worker.claim_generation_job(dbsession)
+    assert claimed_job.id == job["job_id"]
+    assert worker.claim_generation_job(dbsession) is None
+
+    asyncio.run(worker.run_generation_job(dbsession, claimed_job))
+
+    job = user_client.get(job_url, params={"wait": 1}).json()
+    assert job["status"] == "DONE"
+    assert job["bot_message"]["message"] == "System says: Take your time"
+
+    # a job deleted with its message while it runs is dropped
+    response = user_client.post(
+        fastapi_app.url_path_for("send_message"),
+        json={"message": "Never mind", "background": True},
+    )
+    claimed_job = worker.claim_generation_job(dbsession)
+    user_client.request(
+        "DELETE",
+        fastapi_app.url_path_for("delete_chat_history"),
+        json={"message_id": response.json()["user_message"]["id"]},
+    )
+
+    asyncio.run(worker.run_generation_job(dbsession, claimed_job))
+
+    assert user_client.get(job_url).json()["status"] == "DONE"
+    assert (
+        dbsession.query(ChatMessage)
+        .filter(ChatMessage.user_id == user_client.user.id)
+        .count()
+        == 2
+    )
+
+
+def test_generation_job_reclaimed_after_lease_expired(
+    fastapi_app: FastAPI,
+    user_client: TestClient,
+    dbsession: Session,
+):
+    response = user_client.post(
+        fastapi_app.url_path_for("send_message"),
+        json={"message": "Slow", "background": True},
+    )
+    job_url = fastapi_app.url_path_for(
+        "get_generation_job",
+        job_id=response.json()["job_id"],
+    )
+
+    stalled_job = worker.claim_generation_job(dbsession)
+    dbsession.query(ChatGenerationJob).update(
+        {ChatGenerationJob.locked_until: datetime(2000, 1, 1)},
+    )
+    dbsession.commit()
+    reclaimed_job = worker.claim_generation_job(dbsession)
+    assert reclaimed_job.id == stalled_job.id
+
+    # the stalled worker finishes late, after its job was reclaimed
+    worker.complete_generation_job(dbsession, stalled_job, "Late reply")
+    worker.fail_generation_job(dbsession, stalled_job, "Late error")
+    assert user_client.get(job_url).json()["status"] == "RUNNING"
+
+    worker.complete_generation_job(dbsession, reclaimed_job, "Reply")
+
+    job = user_client.get(job_url).json()
+    assert job["status"] == "DONE"
+    assert job["bot_message"]["message"] == "Reply"
+    assert (
+        dbsession.query(ChatMessage.message)
+        .filter(
+            ChatMessage.user_id == user_client.user.id,
+            ChatMessage.sender_type == SenderType.SYSTEM,
+        )
+        .all()
+    ) == [("Reply",)]
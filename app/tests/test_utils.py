@@ -0,0 +1,412 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+from starlette.requests import ClientDisconnect, Request
+
+from app.utils import openai as openai_utils
+from app.utils.embeddings import StubEmbedder
+from app.utils.http import cancel_on_disconnect
+from app.utils.llm_providers import FakeProvider, TransientProviderError
+from app.utils.metrics import metrics
+from app.utils.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceededError,
+    deadline_scope,
+    hedge,
+    remaining_time,
+    retry_with_backoff,
+    without_deadline,
+)
+from app.utils.scheduler import FairScheduler, SchedulerFullError
+from app.utils.singleflight import SingleFlight
+from app.utils.vector_index import VectorIndex
+
+
+def test_single_flight_shares_in_flight_calls():
+    calls = []
+
+    async def fetch(value: str) -> str:
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value.upper()
+
+    async def main():
+        single_flight = SingleFlight("test_single_flight")
+        results = await asyncio.gather(
+            single_flight.do("a", lambda: fetch("a")),
+            single_flight.do("a", lambda: fetch("a")),
+            single_flight.do("b", lambda: fetch("b")),
+        )
+        # the call is forgotten once it finished
+        results.append(await single_flight.do("a", lambda: fetch("a")))
+        return results
+
+    assert asyncio.run(main()) == ["A", "A", "B", "A"]
+    assert calls == ["a", "b", "a"]
+
+
+def test_single_flight_cancels_only_when_every_waiter_is_gone():
+    async def slow() -> str:
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        single_flight = SingleFlight("test_single_flight")
+        first = asyncio.ensure_future(single_flight.do("key", slow))
+        second = asyncio.ensure_future(single_flight.do("key", slow))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        assert await second == "done"
+
+        third = asyncio.ensure_future(single_flight.do("key", slow))
+        await asyncio.sleep(0)
+        call = single_flight._calls["key"]
+        third.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await third
+        await asyncio.sleep(0)
+        assert call.task.cancelled()
+
+    asyncio.run(main())
+
+
+def test_fair_scheduler_round_robins_between_users():
+    scheduler = FairScheduler(
+        name="test_scheduler",
+        max_concurrency=1,
+        max_queue_depth=10,
+        max_user_queue_depth=10,
+    )
+    order = []
+
+    async def call(user_id, n):
+        async with scheduler.slot(user_id):
+            order.append((user_id, n))
+            await asyncio.sleep(0)
+
+    async def main():
+        await scheduler.acquire("blocker")
+        tasks = [asyncio.create_task(call("a", n)) for n in range(3)]
+        tasks.append(asyncio.create_task(call("b", 0)))
+        await asyncio.sleep(0)
+        assert scheduler.queued == 4
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+    # user b does not wait behind the whole backlog of user a
+    assert order == [("a", 0), ("b", 0), ("a", 1), ("a", 2)]
+    assert scheduler.active == 0
+    assert (
+        metrics.snapshot()["timings"]["test_scheduler.queue_wait_seconds"]["count"] >= 5
+    )
+
+
+def test_fair_scheduler_rejects_when_queues_are_full():
+    scheduler = FairScheduler(
+        name="test_scheduler",
+        max_concurrency=1,
+        max_queue_depth=2,
+        max_user_queue_depth=1,
+    )
+
+    async def main():
+        await scheduler.acquire("a")
+        waiting = [
+            asyncio.create_task(scheduler.acquire("a")),
+            asyncio.create_task(scheduler.acquire("b")),
+        ]
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerFullError) as exc_info:
+            await scheduler.acquire("a")
+        assert exc_info.value.per_user
+
+        with pytest.raises(SchedulerFullError) as exc_info:
+            await scheduler.acquire("c")
+        assert not exc_info.value.per_user
+
+        # a cancelled waiter gives its place back
+        waiting[0].cancel()
+        await asyncio.sleep(0)
+        assert scheduler.queued == 1
+
+        scheduler.release()
+        await waiting[1]
+        scheduler.release()
+
+    asyncio.run(main())
+
+
+def test_fair_scheduler_skips_cancelled_waiters():
+    scheduler = FairScheduler(
+        name="test_scheduler",
+        max_concurrency=1,
+        max_queue_depth=2,
+        max_user_queue_depth=2,
+    )
+
+    async def main():
+        await scheduler.acquire("blocker")
+        waiting = [
+            asyncio.create_task(scheduler.acquire("a")),
+            asyncio.create_task(scheduler.acquire("b")),
+        ]
+        await asyncio.sleep(0)
+        assert scheduler.queued == 2
+
+        # released before the cancelled waiter gets to leave the queue
+        waiting[0].cancel()
+        scheduler.release()
+        assert scheduler.active == 1
+        assert scheduler.queued == 0
+
+        await waiting[1]
+        with pytest.raises(asyncio.CancelledError):
+            await waiting[0]
+        scheduler.release()
+        assert scheduler.active == 0
+
+    asyncio.run(main())
+
+    assert scheduler.active == 0
+    assert scheduler.queued == 0
+
+
+def test_retry_with_backoff_retries_transient_errors():
+    calls = []
+
+    async def flaky(timeout: float) -> str:
+        calls.append(timeout)
+        if len(calls) < 3:
+            raise ConnectionError()
+        return "ok"
+
+    async def slow(timeout: float) -> str:
+        await asyncio.sleep(1)
+
+    async def main():
+        result = await retry_with_backoff(
+            flaky,
+            attempts=3,
+            timeout=5,
+            backoff_base=0.001,
+            backoff_cap=0.01,
+            retry_on=(ConnectionError,),
+            name="test_retry",
+        )
+        assert result == "ok"
+
+        # each attempt is limited by the deadline of the scope
+        with deadline_scope(0.05):
+            with pytest.raises(asyncio.TimeoutError):
+                await retry_with_backoff(
+                    slow,
+                    attempts=3,
+                    timeout=5,
+                    backoff_base=0.001,
+                    backoff_cap=0.01,
+                    retry_on=(ConnectionError,),
+                    name="test_retry",
+                )
+
+    asyncio.run(main())
+
+    assert len(calls) == 3
+    assert all(timeout <= 5 for timeout in calls)
+
+
+def test_hedge_returns_the_first_success():
+    delays = [0.2, 0.01]
+
+    async def call() -> float:
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        return delay
+
+    async def main():
+        return await hedge(call, delay=0.02, name="test_hedge")
+
+    assert asyncio.run(main()) == 0.01
+    assert metrics.get("test_hedge.hedge_wins") >= 1
+
+
+def test_circuit_breaker_opens_and_probes():
+    breaker = CircuitBreaker("test_circuit", failure_threshold=2, reset_seconds=0.01)
+
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.02)
+    # a single trial call is let through
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    breaker.before_call()
+    assert not breaker.is_open
+
+
+def test_expired_deadlines_do_not_open_the_llm_circuit(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    breaker = CircuitBreaker("test_circuit", failure_threshold=1, reset_seconds=60)
+    monkeypatch.setattr(openai_utils, "llm_circuit_breaker", breaker)
+
+    async def complete(timeout: float) -> str:
+        return "ok"
+
+    @without_deadline
+    async def background() -> float:
+        return remaining_time(5)
+
+    async def main():
+        with deadline_scope(0):
+            for _ in range(5):
+                with pytest.raises(DeadlineExceededError):
+                    await openai_utils.call_llm(complete, model="test", hedged=False)
+            # background work outlives the deadline of the request
+            assert await background() == 5
+
+        assert not breaker.is_open
+        assert await openai_utils.call_llm(complete, model="test", hedged=False) == "ok"
+
+    asyncio.run(main())
+
+
+def test_fake_provider_is_reproducible():
+    messages = [{"role": "user", "content": "one two three"}]
+
+    def run(seed: int) -> list:
+        provider = FakeProvider(
+            latency_distribution="lognormal",
+            latency_mean_seconds=0.001,
+            latency_stddev_seconds=0.001,
+            error_rate=0.5,
+            response_tokens=5,
+            seed=seed,
+        )
+
+        async def main():
+            results = []
+            for _ in range(10):
+                try:
+                    results.append(await provider.complete(messages, "fake", 1))
+                except TransientProviderError:
+                    results.append(None)
+            return results
+
+        return asyncio.run(main())
+
+    results = run(seed=42)
+    assert results == run(seed=42)
+    assert None in results
+    assert "one two three one two" in results
+
+
+def test_cancel_on_disconnect():
+    cancelled = []
+
+    async def slow() -> str:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "done"
+
+    async def fast() -> str:
+        return "done"
+
+    async def receive() -> dict:
+        await asyncio.sleep(0.01)
+        return {"type": "http.disconnect"}
+
+    async def main():
+        request = Request({"type": "http", "headers": []}, receive)
+        assert await cancel_on_disconnect(request, fast()) == "done"
+        with pytest.raises(ClientDisconnect):
+            await cancel_on_disconnect(request, slow())
+
+    asyncio.run(main())
+
+    assert cancelled == [True]
+
+
+def test_stub_embedder_is_deterministic():
+    embedder = StubEmbedder(dimensions=64)
+
+    vectors = asyncio.run(
+        embedder.embed(["my cat is called Tom", "what is my cat called", "taxes"]),
+    )
+
+    assert vectors.shape == (3, 64)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1)
+    assert np.array_equal(asyncio.run(embedder.embed(["taxes"]))[0], vectors[2])
+    assert vectors[1] @ vectors[0] > vectors[1] @ vectors[2]
+
+
+def test_vector_index(tmp_path):
+    index = VectorIndex(tmp_path / "user", dimensions=2)
+    assert index.search(np.array([1.0, 0.0]), k=3) == []
+
+    appended = index.append(
+        np.array([1, 2, 3]),
+        np.array([10, 11, 12]),
+        np.array([[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]], dtype=np.float32),
+    )
+    assert appended == 3
+    # rows already in the index are skipped, item 10 gets a new vector
+    appended = index.append(
+        np.array([3, 4]),
+        np.array([12, 10]),
+        np.array([[0.7, 0.7], [0.0, -1.0]], dtype=np.float32),
+    )
+    assert appended == 1
+    assert len(index) == 4
+    assert index.last_sequence == 4
+
+    hits = index.search(np.array([0.0, 1.0]), k=2)
+    assert [item_id for item_id, _ in hits] == [11, 12]
+
+    hits = index.search(np.array([0.0, 1.0]), k=5, before_item_id=12)
+    assert [item_id for item_id, _ in hits] == [11, 10]
+
+    # an append interrupted half-way is dropped
+    with open(index.vectors_path, "ab") as vectors_file:
+        vectors_file.write(b"\x00" * 4)
+    assert len(index) == 4
+    index.append(np.array([5]), np.array([13]), np.array([[1.0, 0.0]]))
+    assert index.search(np.array([1.0, 0.0]), k=1)[0][0] == 13
+
+
+def test_vector_index_appends_rows_showing_up_late(tmp_path):
+    index = VectorIndex(tmp_path / "user", dimensions=2)
+    index.append(
+        np.array([1, 3]),
+        np.array([10, 12]),
+        np.array([[1.0, 0.0], [0.7, 0.7]], dtype=np.float32),
+    )
+
+    # 2 was committed after 3, and is read again with it
+    appended = index.append(
+        np.array([2, 3]),
+        np.array([11, 12]),
+        np.array([[0.0, 1.0], [0.7, 0.7]], dtype=np.float32),
+    )
+
+    assert appended == 1
+    assert len(index) == 3
+    assert index.last_sequence == 3
+    assert index.search(np.array([0.0, 1.0]), k=1)[0][0] == 11
@@ -1,4 +1,4 @@
-import random
+import uuid
 
 from sqlalchemy.orm import Session
 
@@ -10,7 +10,7 @@ def create_basic_user(dbsession: Session) -> tuple:
     password = "test1234"
 
     user = User(
-        email=f"test{random.randint(0, 1000)}@test.com",
+        email=f"test{uuid.uuid4().hex}@test.com",
         name="test",
         password=password,
     )
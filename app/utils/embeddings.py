@@ -0,0 +1,93 @@
+import hashlib
+import re
+from typing import Protocol
+
+import numpy as np
+from openai import AsyncOpenAI
+
+from app.settings import settings
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class Embedder(Protocol):
+    """Turns texts into L2-normalized float32 vectors of ``dimensions`` values."""
+
+    model: str
+    dimensions: int
+
+    async def embed(self, texts: list[str]) -> np.ndarray: ...
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize the rows of a matrix, so dot products are cosine similarities."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+class StubEmbedder:
+    """Deterministic offline embeddings for tests and local development.
+
+    Words (and word pairs) are hashed into the dimensions of the vector, so texts
+    sharing words are similar. No model, no network, same vectors on every machine.
+    """
+
+    def __init__(self, dimensions: int) -> None:
+        self.model = f"stub-{dimensions}"
+        self.dimensions = dimensions
+
+    def embed_text(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = WORD_PATTERN.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dimensions] += 1 if value >> 63 else -1
+        return vector
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        return normalize(np.stack([self.embed_text(text) for text in texts]))
+
+
+class OpenAIEmbedder:
+    """Embeddings of the OpenAI API."""
+
+    def __init__(self, model: str, dimensions: int) -> None:
+        self.model = model
+        self.dimensions = dimensions
+        self.client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url or None,
+        )
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        response = await self.client.embeddings.create(
+            model=self.model,
+            input=texts,
+            dimensions=self.dimensions,
+        )
+        return normalize(
+            np.array([item.embedding for item in response.data], dtype=np.float32),
+        )
+
+
+_embedders: dict[str, Embedder] = {}
+
+
+def get_embedder() -> Embedder:
+    """Get the embedder selected by ``settings.chat_memory_embedding_provider``."""
+    name = settings.chat_memory_embedding_provider
+    embedder = _embedders.get(name)
+    if embedder is None:
+        if name == "stub":
+            embedder = StubEmbedder(settings.chat_memory_embedding_dimensions)
+        elif name == "openai":
+            embedder = OpenAIEmbedder(
+                settings.chat_memory_embedding_model,
+                settings.chat_memory_embedding_dimensions,
+            )
+        else:
+            raise ValueError(f"Unknown embedding provider: {name}")
+        _embedders[name] = embedder
+    return embedder
@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+from typing import Awaitable, TypeVar
+
+from fastapi import Request
+from starlette.requests import ClientDisconnect
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.constants import REQUEST_TIMEOUT_HEADER, REQUEST_TIMEOUT_MIN_SECONDS
+from app.utils.metrics import metrics
+from app.utils.resilience import deadline_scope
+
+T = TypeVar("T")
+
+
+def make_etag(*parts) -> str:
+    """Build a weak ETag from the parts that determine a response body."""
+    digest = hashlib.sha1(
+        "|".join(str(part) for part in parts).encode("utf-8"),
+    ).hexdigest()
+    return f'W/"{digest}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """Check whether the request's ``If-None-Match`` header matches the ETag."""
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison: W/ prefixes are ignored
+    etag_value = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == etag_value
+        for candidate in if_none_match.split(",")
+    )
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """Return once the client disconnected. Only call it after the body was read."""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable[T]) -> T:
+    """Await ``awaitable``, cancelling it when the client disconnects first.
+
+    Raises ``ClientDisconnect`` once the work is cancelled. Cancellations are counted
+    as ``http.cancelled_on_disconnect``.
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+
+    if task.done() and not task.cancelled():
+        return task.result()
+
+    metrics.increment("http.cancelled_on_disconnect")
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    raise ClientDisconnect()
+
+
+class DeadlineMiddleware:
+    """Give every HTTP request a deadline, see ``app.utils.resilience``.
+
+    Clients can shorten it with the ``X-Request-Timeout`` header (in seconds), down
+    to ``REQUEST_TIMEOUT_MIN_SECONDS``.
+    """
+
+    def __init__(self, app: ASGIApp, timeout: float) -> None:
+        self.app = app
+        self.timeout = timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timeout = self.timeout
+        header = REQUEST_TIMEOUT_HEADER.lower().encode("latin-1")
+        for name, value in scope["headers"]:
+            if name == header:
+                try:
+                    timeout = min(
+                        timeout,
+                        max(REQUEST_TIMEOUT_MIN_SECONDS, float(value)),
+                    )
+                except ValueError:
+                    pass
+
+        with deadline_scope(timeout):
+            await self.app(scope, receive, send)
@@ -0,0 +1,192 @@
+import asyncio
+import math
+import random
+import re
+from itertools import cycle, islice
+from typing import AsyncIterator, Optional, Protocol
+
+from openai import AsyncOpenAI
+
+from app.settings import settings
+
+
+class TransientProviderError(Exception):
+    """A provider failed in a way worth retrying."""
+
+
+class LLMProvider(Protocol):
+    """Backend answering chat completions.
+
+    Both methods take OpenAI style messages. ``open_stream`` raises connection and
+    API errors itself, only then returns an iterator of the tokens, so that opening
+    the stream can be retried.
+    """
+
+    async def complete(self, messages: list, model: str, timeout: float) -> str: ...
+
+    async def open_stream(
+        self,
+        messages: list,
+        model: str,
+        timeout: float,
+    ) -> AsyncIterator[str]: ...
+
+
+class OpenAIProvider:
+    """Chat completions of the OpenAI API (or a server compatible with it)."""
+
+    def __init__(self, client: AsyncOpenAI) -> None:
+        self.client = client
+
+    @classmethod
+    def from_settings(cls) -> "OpenAIProvider":
+        # retries and timeouts are handled by ``app.utils.openai.call_llm``
+        return cls(
+            AsyncOpenAI(
+                api_key=settings.openai_api_key,
+                base_url=settings.openai_base_url or None,
+                max_retries=0,
+            ),
+        )
+
+    async def complete(self, messages: list, model: str, timeout: float) -> str:
+        completion = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            timeout=timeout,
+        )
+        return completion.choices[0].message.content
+
+    async def open_stream(
+        self,
+        messages: list,
+        model: str,
+        timeout: float,
+    ) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            timeout=timeout,
+        )
+
+        async def tokens() -> AsyncIterator[str]:
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        yield content
+            finally:
+                await stream.close()
+
+        return tokens()
+
+
+class FakeProvider:
+    """In-process provider for load tests, nothing leaves the process.
+
+    Every call waits for a latency drawn from the configured distribution
+    ("constant", "uniform" or "lognormal"), fails with ``TransientProviderError``
+    at ``error_rate``, and then produces ``response_tokens`` tokens at
+    ``tokens_per_second``. The reply repeats the words of the last message, so it
+    depends only on the prompt; pass a ``seed`` to make the timings reproducible too.
+    """
+
+    def __init__(
+        self,
+        latency_distribution: str = "constant",
+        latency_mean_seconds: float = 0.0,
+        latency_stddev_seconds: float = 0.0,
+        tokens_per_second: float = 0.0,
+        error_rate: float = 0.0,
+        response_tokens: int = 20,
+        seed: Optional[int] = None,
+    ) -> None:
+        if latency_distribution not in ("constant", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {latency_distribution}")
+        self.latency_distribution = latency_distribution
+        self.latency_mean_seconds = latency_mean_seconds
+        self.latency_stddev_seconds = latency_stddev_seconds
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.response_tokens = response_tokens
+        self.random = random.Random(seed)
+
+    @classmethod
+    def from_settings(cls) -> "FakeProvider":
+        return cls(
+            latency_distribution=settings.fake_llm_latency_distribution,
+            latency_mean_seconds=settings.fake_llm_latency_mean_seconds,
+            latency_stddev_seconds=settings.fake_llm_latency_stddev_seconds,
+            tokens_per_second=settings.fake_llm_tokens_per_second,
+            error_rate=settings.fake_llm_error_rate,
+            response_tokens=settings.fake_llm_response_tokens,
+            seed=settings.fake_llm_seed,
+        )
+
+    def sample_latency(self) -> float:
+        """Time to the first token, in seconds."""
+        mean, stddev = self.latency_mean_seconds, self.latency_stddev_seconds
+        if mean <= 0:
+            return 0.0
+        if self.latency_distribution == "uniform":
+            return self.random.uniform(max(0.0, mean - stddev), mean + stddev)
+        if self.latency_distribution == "lognormal":
+            # parameters of the underlying normal distribution giving this mean/stddev
+            sigma2 = math.log(1 + (stddev / mean) ** 2)
+            return self.random.lognormvariate(math.log(mean) - sigma2 / 2, sigma2**0.5)
+        return mean
+
+    def make_tokens(self, messages: list) -> list[str]:
+        words = str(messages[-1]["content"]).split() if messages else []
+        reply = " ".join(islice(cycle(words or ["..."]), self.response_tokens))
+        return re.findall(r"\S+\s*", reply)
+
+    async def _start(self) -> None:
+        await asyncio.sleep(self.sample_latency())
+        if self.random.random() < self.error_rate:
+            raise TransientProviderError("Fake provider error.")
+
+    async def complete(self, messages: list, model: str, timeout: float) -> str:
+        await self._start()
+        tokens = self.make_tokens(messages)
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(len(tokens) / self.tokens_per_second)
+        return "".join(tokens)
+
+    async def open_stream(
+        self,
+        messages: list,
+        model: str,
+        timeout: float,
+    ) -> AsyncIterator[str]:
+        await self._start()
+
+        async def tokens() -> AsyncIterator[str]:
+            for token in self.make_tokens(messages):
+                if self.tokens_per_second > 0:
+                    await asyncio.sleep(1 / self.tokens_per_second)
+                yield token
+
+        return tokens()
+
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "fake": FakeProvider,
+}
+
+_providers: dict[str, LLMProvider] = {}
+
+
+def get_llm_provider() -> LLMProvider:
+    """Get the provider selected by ``settings.llm_provider``, built once per worker."""
+    name = settings.llm_provider
+    provider = _providers.get(name)
+    if provider is None:
+        if name not in PROVIDERS:
+            raise ValueError(f"Unknown LLM provider: {name}")
+        provider = _providers[name] = PROVIDERS[name].from_settings()
+    return provider
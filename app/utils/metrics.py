@@ -0,0 +1,85 @@
+import math
+import threading
+from collections import defaultdict, deque
+
+# number of most recent observations percentiles are computed over
+TIMING_WINDOW_SIZE = 1000
+
+
+class Timing:
+    """Summary of observed values, with percentiles over a recent window."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.window: deque[float] = deque(maxlen=TIMING_WINDOW_SIZE)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.window.append(value)
+
+    def percentile(self, q: float) -> float:
+        if not self.window:
+            return 0.0
+        values = sorted(self.window)
+        return values[min(len(values) - 1, math.ceil(q * len(values)) - 1)]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """In-process metrics registry. Every uvicorn worker keeps its own."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: dict[str, int] = defaultdict(int)
+        self._timings: dict[str, Timing] = defaultdict(Timing)
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """Increment a counter."""
+        with self._lock:
+            self._counters[name] += value
+
+    def get(self, name: str) -> int:
+        """Get the current value of a counter."""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def observe(self, name: str, value: float) -> None:
+        """Record a value (usually a duration in seconds) of a timing."""
+        with self._lock:
+            self._timings[name].observe(value)
+
+    def percentile(self, name: str, q: float) -> float:
+        """Get a percentile (0 < q <= 1) of the recent values of a timing."""
+        with self._lock:
+            timing = self._timings.get(name)
+            return timing.percentile(q) if timing else 0.0
+
+    def timing(self, name: str) -> dict:
+        """Get the summary (count, avg, p50, p95, max) of a timing."""
+        with self._lock:
+            return self._timings.get(name, Timing()).summary()
+
+    def snapshot(self) -> dict:
+        """Get a copy of all metrics."""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "timings": {
+                    name: timing.summary() for name, timing in self._timings.items()
+                },
+            }
+
+
+metrics = Metrics()
@@ -1,31 +1,182 @@
-from openai import OpenAI
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from openai import APIConnectionError, InternalServerError, RateLimitError
 
-from app.constants import SYSTEM_CHATBOT_PROMPT
 from app.settings import settings
+from app.utils.llm_providers import TransientProviderError, get_llm_provider
+from app.utils.metrics import metrics
+from app.utils.resilience import (
+    CircuitBreaker,
+    DeadlineExceededError,
+    hedge,
+    remaining_time,
+    retry_with_backoff,
+)
+from app.utils.scheduler import FairScheduler
+from app.utils.tokens import estimate_message_tokens, estimate_tokens
+
+T = TypeVar("T")
+
+# every async LLM call of a worker goes through the scheduler
+llm_scheduler = FairScheduler(
+    name="llm_scheduler",
+    max_concurrency=settings.llm_max_concurrency,
+    max_queue_depth=settings.llm_max_queue_depth,
+    max_user_queue_depth=settings.llm_max_user_queue_depth,
+)
+
+llm_circuit_breaker = CircuitBreaker(
+    name="llm_circuit",
+    failure_threshold=settings.llm_circuit_failure_threshold,
+    reset_seconds=settings.llm_circuit_reset_seconds,
+)
+
+# errors after which the same request may succeed (APITimeoutError is a connection
+# error)
+RETRYABLE_ERRORS = (
+    APIConnectionError,
+    RateLimitError,
+    InternalServerError,
+    TransientProviderError,
+)
+
 
-client = OpenAI(api_key=settings.openai_api_key)
-
-
-def get_response_from_gpt(message: str) -> str:
-    completion = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {
-                "role": "system",
-                "content": SYSTEM_CHATBOT_PROMPT,
-            },
-            {
-                "role": "user",
-                "content": message,
-            },
-        ],
+def model_metric(model: str, name: str) -> str:
+    """Name of a per-model metric, e.g. ``llm.gpt-4o.latency_seconds``."""
+    return f"llm.{model}.{name}"
+
+
+def get_hedge_delay(model: str) -> Optional[float]:
+    """How long a call may take before it is hedged, ``None`` if hedging is off."""
+    if not settings.llm_hedge_enabled:
+        return None
+    return max(
+        settings.llm_hedge_min_delay_seconds,
+        metrics.percentile(model_metric(model, "latency_seconds"), 0.95),
     )
-    return completion.choices[0].message.content
 
 
-def get_response_from_gpt_with_context(messages: list) -> str:
-    completion = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=messages,
+def record_tokens(model: str, messages: list, completion: str) -> None:
+    """Count the (estimated) prompt and completion tokens of a call."""
+    metrics.increment(
+        model_metric(model, "prompt_tokens"),
+        sum(estimate_message_tokens(message) for message in messages),
+    )
+    metrics.increment(
+        model_metric(model, "completion_tokens"),
+        estimate_tokens(completion),
     )
-    return completion.choices[0].message.content
+
+
+async def call_llm(
+    create: Callable[[float], Awaitable[T]],
+    model: str,
+    hedged: bool,
+    latency_metric: str = "latency_seconds",
+) -> T:
+    """Call the LLM provider through ``llm_circuit_breaker``, with retries and hedging.
+
+    ``create`` gets the timeout of the attempt. The latency of successful calls is
+    recorded as ``llm.<latency_metric>`` and ``llm.<model>.<latency_metric>``. Only
+    transient errors count as failures of the circuit; an API error like a bad
+    request means it is reachable.
+    """
+    llm_circuit_breaker.before_call()
+
+    def hedged_create(timeout: float) -> Awaitable[T]:
+        return hedge(lambda: create(timeout), get_hedge_delay(model), name="llm")
+
+    started_at = time.monotonic()
+    try:
+        result = await retry_with_backoff(
+            hedged_create if hedged else create,
+            attempts=settings.llm_max_attempts,
+            timeout=settings.llm_timeout_seconds,
+            backoff_base=settings.llm_backoff_base_seconds,
+            backoff_cap=settings.llm_backoff_max_seconds,
+            retry_on=RETRYABLE_ERRORS,
+            name="llm",
+        )
+    except (DeadlineExceededError, asyncio.CancelledError):
+        # the caller gave up, callers pick their own deadline
+        llm_circuit_breaker.record_cancel()
+        raise
+    except (asyncio.TimeoutError, *RETRYABLE_ERRORS):
+        llm_circuit_breaker.record_failure()
+        raise
+    except Exception:
+        llm_circuit_breaker.record_success()
+        raise
+
+    llm_circuit_breaker.record_success()
+    latency = time.monotonic() - started_at
+    metrics.observe(f"llm.{latency_metric}", latency)
+    metrics.observe(model_metric(model, latency_metric), latency)
+    return result
+
+
+async def async_get_response_from_gpt_with_context(
+    messages: list,
+    user_id: Optional[int] = None,
+    model: Optional[str] = None,
+) -> str:
+    """Get the completion of the chat from the provider of ``settings.llm_provider``.
+
+    Waits for a slot of ``llm_scheduler``, queued fairly with the calls of other users,
+    and raises ``CircuitOpenError`` right away while the provider is failing.
+    """
+    provider = get_llm_provider()
+    model = model or settings.llm_model
+
+    llm_circuit_breaker.raise_if_open()
+    async with llm_scheduler.slot(user_id):
+        response = await call_llm(
+            lambda timeout: provider.complete(messages, model, timeout),
+            model=model,
+            hedged=True,
+        )
+
+    record_tokens(model, messages, response)
+    return response
+
+
+async def async_stream_response_from_gpt_with_context(
+    messages: list,
+    user_id: Optional[int] = None,
+    model: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """Yield the completion token by token as it comes back from the model.
+
+    The ``llm_scheduler`` slot is held until the stream ends. Opening the stream is
+    retried, but not hedged; once it is open, each token has to arrive in time. The
+    time it took to open the stream is recorded as ``llm.<model>.stream_open_seconds``,
+    apart from the latency of whole completions the routing SLO is checked against.
+    """
+    provider = get_llm_provider()
+    model = model or settings.llm_model
+
+    llm_circuit_breaker.raise_if_open()
+    async with llm_scheduler.slot(user_id):
+        tokens = await call_llm(
+            lambda timeout: provider.open_stream(messages, model, timeout),
+            model=model,
+            hedged=False,
+            latency_metric="stream_open_seconds",
+        )
+        completion = []
+        try:
+            while True:
+                timeout = remaining_time(settings.llm_timeout_seconds)
+                if timeout <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    token = await asyncio.wait_for(tokens.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                completion.append(token)
+                yield token
+        finally:
+            await tokens.aclose()
+            record_tokens(model, messages, "".join(completion))
@@ -0,0 +1,222 @@
+import asyncio
+import contextvars
+import functools
+import random
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, Optional, TypeVar
+
+from app.utils.metrics import metrics
+
+T = TypeVar("T")
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "deadline",
+    default=None,
+)
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[None]:
+    """Give the code in the block ``seconds`` to finish.
+
+    Nested scopes can only shorten the deadline, never extend it.
+    """
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def without_deadline(
+    func: Callable[..., Awaitable[T]],
+) -> Callable[..., Awaitable[T]]:
+    """Run the coroutine function outside the deadline of its caller's scope.
+
+    For background work started by a request that outlives it.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs) -> T:
+        token = _deadline.set(None)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _deadline.reset(token)
+
+    return wrapper
+
+
+def remaining_time(default: float) -> float:
+    """Seconds left until the deadline of the current scope, at most ``default``."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return min(default, deadline - time.monotonic())
+
+
+class DeadlineExceededError(asyncio.TimeoutError):
+    """Raised when the deadline of the scope ran out, rather than a call's timeout.
+
+    The caller ran out of time, which tells nothing about the dependency called.
+    """
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Stop calling a dependency after repeated failures.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and calls
+    fail right away with ``CircuitOpenError``. Once ``reset_seconds`` have passed a
+    single trial call is let through: its success closes the circuit, its failure
+    opens it again. Openings are counted as ``<name>.opened`` and rejected calls as
+    ``<name>.rejected``.
+
+    The breaker belongs to one event loop; every uvicorn worker has its own.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls are currently rejected."""
+        if self._opened_at is None:
+            return False
+        if time.monotonic() - self._opened_at < self.reset_seconds:
+            return True
+        return self._probing
+
+    def raise_if_open(self) -> None:
+        """Raise ``CircuitOpenError`` while calls are rejected."""
+        if self.is_open:
+            metrics.increment(f"{self.name}.rejected")
+            raise CircuitOpenError(f"Circuit {self.name} is open.")
+
+    def before_call(self) -> None:
+        """Raise ``CircuitOpenError`` unless the call may go through.
+
+        Every call let through must report its outcome with one of the ``record_*``
+        methods.
+        """
+        self.raise_if_open()
+        if self._opened_at is not None:
+            self._probing = True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probing = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            if self._opened_at is None:
+                metrics.increment(f"{self.name}.opened")
+            self._opened_at = time.monotonic()
+
+    def record_cancel(self) -> None:
+        """The call was cancelled before it told anything about the dependency."""
+        self._probing = False
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter for the given (0-based) retry."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+async def retry_with_backoff(
+    func: Callable[[float], Awaitable[T]],
+    attempts: int,
+    timeout: float,
+    backoff_base: float,
+    backoff_cap: float,
+    retry_on: tuple[type[BaseException], ...],
+    name: str,
+) -> T:
+    """Call ``func(timeout)`` until it succeeds, at most ``attempts`` times.
+
+    Each attempt gets ``timeout`` seconds, less if the deadline of the current scope
+    is closer. Only the ``retry_on`` exceptions (and timeouts) are retried, and no
+    retry is started when the deadline would pass during the backoff. Retries are
+    counted as ``<name>.retries``.
+
+    Raises ``DeadlineExceededError`` when the deadline, not the timeout of an
+    attempt, ran out.
+    """
+    for attempt in range(attempts):
+        attempt_timeout = remaining_time(timeout)
+        if attempt_timeout <= 0:
+            raise DeadlineExceededError()
+
+        try:
+            return await asyncio.wait_for(func(attempt_timeout), attempt_timeout)
+        except (asyncio.TimeoutError, *retry_on) as e:
+            if isinstance(e, asyncio.TimeoutError) and attempt_timeout < timeout:
+                # the attempt was cut short by the deadline
+                raise DeadlineExceededError() from e
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt, backoff_base, backoff_cap)
+            if remaining_time(timeout) <= delay:
+                raise
+
+        metrics.increment(f"{name}.retries")
+        await asyncio.sleep(delay)
+
+    raise AssertionError("unreachable")
+
+
+async def hedge(
+    func: Callable[[], Awaitable[T]],
+    delay: Optional[float],
+    name: str,
+) -> T:
+    """Call ``func``, and call it again if the first call takes longer than ``delay``.
+
+    The first call to succeed wins and the other one is cancelled. An error is only
+    raised once both calls failed. ``delay=None`` disables hedging. Hedged calls are
+    counted as ``<name>.hedged`` and the ones won by the second call as
+    ``<name>.hedge_wins``.
+    """
+    first = asyncio.ensure_future(func())
+    if delay is None:
+        return await first
+
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            metrics.increment(f"{name}.hedged")
+            pending.add(asyncio.ensure_future(func()))
+
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        metrics.increment(f"{name}.hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,130 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Hashable
+
+from app.utils.metrics import metrics
+
+
+class SchedulerFullError(Exception):
+    """Raised when a call cannot even be queued.
+
+    ``per_user`` tells whether the caller's own queue is full (the caller should
+    slow down) or the whole scheduler is (the service is overloaded).
+    """
+
+    def __init__(self, detail: str, per_user: bool) -> None:
+        super().__init__(detail)
+        self.detail = detail
+        self.per_user = per_user
+
+
+class FairScheduler:
+    """Limit concurrent calls and share the capacity fairly between users.
+
+    At most ``max_concurrency`` calls run at once. Further calls wait in one FIFO
+    queue per user, and freed slots go to the users round-robin, so a user flooding
+    the scheduler only delays their own calls. Queues are bounded, so overload is
+    reported right away instead of piling up. Time spent waiting is recorded as the
+    ``<name>.queue_wait_seconds`` timing.
+
+    The scheduler belongs to one event loop; every uvicorn worker has its own.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue_depth: int,
+        max_user_queue_depth: int,
+    ) -> None:
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.max_user_queue_depth = max_user_queue_depth
+        self._active = 0
+        self._queued = 0
+        self._queues: OrderedDict[Hashable, deque[asyncio.Future]] = OrderedDict()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    async def acquire(self, user_id: Hashable) -> None:
+        """Wait for a slot, raising ``SchedulerFullError`` if the call cannot queue."""
+        started_at = time.monotonic()
+
+        if self._active < self.max_concurrency and not self._queued:
+            self._active += 1
+            metrics.observe(f"{self.name}.queue_wait_seconds", 0.0)
+            return
+
+        user_queue = self._queues.get(user_id)
+        if user_queue is not None and len(user_queue) >= self.max_user_queue_depth:
+            metrics.increment(f"{self.name}.rejected_user")
+            raise SchedulerFullError("Too many requests in flight.", per_user=True)
+        if self._queued >= self.max_queue_depth:
+            metrics.increment(f"{self.name}.rejected")
+            raise SchedulerFullError("Too many requests queued.", per_user=False)
+
+        future = asyncio.get_running_loop().create_future()
+        if user_queue is None:
+            user_queue = self._queues[user_id] = deque()
+        user_queue.append(future)
+        self._queued += 1
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was handed over right before the cancellation
+                self.release()
+            else:
+                self._forget(user_id, future)
+            raise
+
+        metrics.observe(
+            f"{self.name}.queue_wait_seconds",
+            time.monotonic() - started_at,
+        )
+
+    def release(self) -> None:
+        """Free a slot and hand it to the next user in line."""
+        self._active -= 1
+        while self._active < self.max_concurrency and self._queues:
+            user_id, user_queue = next(iter(self._queues.items()))
+            future = user_queue.popleft()
+            self._queued -= 1
+            if user_queue:
+                # round-robin: the user goes to the back of the line
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if future.done():
+                # cancelled, its waiter has not run yet to leave the queue
+                continue
+            self._active += 1
+            future.set_result(None)
+
+    def _forget(self, user_id: Hashable, future: asyncio.Future) -> None:
+        user_queue = self._queues.get(user_id)
+        if user_queue is None or future not in user_queue:
+            return
+        user_queue.remove(future)
+        self._queued -= 1
+        if not user_queue:
+            del self._queues[user_id]
+
+    @asynccontextmanager
+    async def slot(self, user_id: Hashable) -> AsyncIterator[None]:
+        """Hold a slot for the duration of the block."""
+        await self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release()
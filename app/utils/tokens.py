@@ -0,0 +1,28 @@
+import math
+import re
+
+# Rough average for English text with OpenAI's BPE tokenizers.
+CHARS_PER_TOKEN = 4
+
+# Every chat message costs a few tokens on top of its content (role, separators).
+MESSAGE_TOKEN_OVERHEAD = 4
+
+TOKEN_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text without a tokenizer.
+
+    Words and punctuation marks are counted as one token each, and long words are
+    accounted for by the characters per token ratio, whichever is larger. This
+    errs on the side of over-estimating, which is what a budget needs.
+    """
+    if not text:
+        return 0
+    pieces = len(TOKEN_PIECE_PATTERN.findall(text))
+    return max(pieces, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def estimate_message_tokens(message: dict) -> int:
+    """Estimate the number of tokens a chat completion message costs."""
+    return estimate_tokens(message["content"]) + MESSAGE_TOKEN_OVERHEAD
@@ -0,0 +1,144 @@
+import fcntl
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+ID_DTYPE = np.dtype(np.int64)
+VECTOR_DTYPE = np.dtype(np.float32)
+
+
+class VectorIndex:
+    """Append-only flat index of normalized vectors, memory-mapped from disk.
+
+    Every row holds an item id (e.g. a chat message id) with its vector, and a
+    unique sequence number (e.g. the id of the row in the source of truth), so the
+    index can be caught up by appending what came after ``last_sequence``. Rows whose
+    sequence is already in the index are skipped, so the ones showing up late, below
+    ``last_sequence``, can be appended too. When the same item is appended again,
+    its newest row replaces the older ones.
+
+    Rows are stored in two raw files, ``<path>.ids`` (sequence, item id) and
+    ``<path>.vectors``, read with ``np.memmap``. Appends hold an exclusive ``flock``
+    on ``<path>.lock``, so several processes can share the files; readers only
+    consider rows complete in both files.
+    """
+
+    def __init__(self, path: Path, dimensions: int) -> None:
+        self.path = path
+        self.dimensions = dimensions
+        self.ids_path = path.with_name(f"{path.name}.ids")
+        self.vectors_path = path.with_name(f"{path.name}.vectors")
+        self.lock_path = path.with_name(f"{path.name}.lock")
+
+    def _row_count(self) -> int:
+        try:
+            ids_size = self.ids_path.stat().st_size
+            vectors_size = self.vectors_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+        return min(
+            ids_size // (2 * ID_DTYPE.itemsize),
+            vectors_size // (self.dimensions * VECTOR_DTYPE.itemsize),
+        )
+
+    def __len__(self) -> int:
+        return self._row_count()
+
+    def _open(self) -> tuple[np.ndarray, np.ndarray]:
+        rows = self._row_count()
+        if not rows:
+            return (
+                np.empty((0, 2), dtype=ID_DTYPE),
+                np.empty((0, self.dimensions), dtype=VECTOR_DTYPE),
+            )
+        ids = np.memmap(self.ids_path, dtype=ID_DTYPE, mode="r", shape=(rows, 2))
+        vectors = np.memmap(
+            self.vectors_path,
+            dtype=VECTOR_DTYPE,
+            mode="r",
+            shape=(rows, self.dimensions),
+        )
+        return ids, vectors
+
+    @property
+    def last_sequence(self) -> int:
+        """Highest sequence number in the index, 0 when the index is empty."""
+        ids, _ = self._open()
+        return int(ids[:, 0].max()) if len(ids) else 0
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def append(
+        self,
+        sequences: np.ndarray,
+        item_ids: np.ndarray,
+        vectors: np.ndarray,
+    ) -> int:
+        """Append rows, skipping the ones whose sequence is already in the index.
+
+        Returns the number of rows appended.
+        """
+        with self._locked():
+            rows = self._row_count()
+            # drop the tail of an append interrupted half-way
+            for path, row_size in (
+                (self.ids_path, 2 * ID_DTYPE.itemsize),
+                (self.vectors_path, self.dimensions * VECTOR_DTYPE.itemsize),
+            ):
+                if path.exists() and path.stat().st_size != rows * row_size:
+                    os.truncate(path, rows * row_size)
+
+            existing_ids, _ = self._open()
+            new_rows = ~np.isin(sequences, existing_ids[:, 0])
+            if not new_rows.any():
+                return 0
+
+            ids = np.column_stack([sequences, item_ids]).astype(ID_DTYPE)[new_rows]
+            with open(self.vectors_path, "ab") as vectors_file:
+                vectors_file.write(
+                    np.ascontiguousarray(
+                        vectors[new_rows], dtype=VECTOR_DTYPE
+                    ).tobytes(),
+                )
+            with open(self.ids_path, "ab") as ids_file:
+                ids_file.write(np.ascontiguousarray(ids).tobytes())
+            return int(new_rows.sum())
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        before_item_id: Optional[int] = None,
+    ) -> list[tuple[int, float]]:
+        """Find the ``k`` items most similar to ``query`` (by dot product).
+
+        Only items with an id lower than ``before_item_id`` are considered. Returns
+        ``(item_id, score)`` pairs, best first.
+        """
+        ids, vectors = self._open()
+        if not len(ids) or k <= 0:
+            return []
+
+        item_ids = np.asarray(ids[:, 1])
+        # newest row of every item
+        _, reversed_index = np.unique(item_ids[::-1], return_index=True)
+        rows = len(item_ids) - 1 - reversed_index
+        if before_item_id is not None:
+            rows = rows[item_ids[rows] < before_item_id]
+        if not len(rows):
+            return []
+
+        scores = vectors[rows] @ query.astype(VECTOR_DTYPE)
+        top = np.argsort(-scores)[:k]
+        return [(int(item_ids[rows[i]]), float(scores[i])) for i in top]
@@ -0,0 +1,19 @@
+import asyncio
+
+from app.api.v1.chat.worker import GenerationWorkerPool
+from app.settings import settings
+
+
+def main() -> None:
+    """
+    Entrypoint of the background generation workers.
+    """
+    pool = GenerationWorkerPool(
+        concurrency=settings.chat_generation_worker_concurrency,
+        poll_interval=settings.chat_generation_poll_seconds,
+    )
+    asyncio.run(pool.run())
+
+
+if __name__ == "__main__":
+    main()